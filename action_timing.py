@@ -0,0 +1,143 @@
+"""
+Action timing
+Per-command timing profiles for PyAutoGUI actions instead of one global pyautogui.PAUSE
+
+A command selects a profile with "timing": a profile name, or an object of overrides (a custom
+profile, optionally starting from "base"). "text_mode" picks how type_text enters text:
+"keys" (one key press per character), "paste" (the whole string through the clipboard in one
+operation) or "auto" (paste long strings when the profile allows it).
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+TimingProfile = namedtuple('TimingProfile', ['name', 'pause', 'type_interval', 'move_duration',
+                                             'bulk_text', 'bulk_min_chars'])
+
+TIMING_PROFILES = {
+    # A 10 ms settle after each action instead of half a second, no per-key or movement delays:
+    # for scripts that synchronise with wait_for_image instead
+    'fast': TimingProfile('fast', 0.01, 0.0, 0.0, True, 16),
+    # The original behaviour (and the default): half a second after every action, no movement or
+    # per-key delay, text typed key by key
+    'safe': TimingProfile('safe', 0.5, 0.0, 0.0, False, 16)
+}
+# Existing clients keep their behaviour; 'fast' is opt-in via TIMING_PROFILE or a command's timing
+DEFAULT_PROFILE = 'safe'
+TEXT_MODES = ('auto', 'keys', 'paste')
+
+# Seconds the target application gets to read the clipboard before it is restored
+PASTE_SETTLE = 0.1
+
+
+def resolve_profile(spec=None, default=None):
+    """Turn a profile name, an overrides dict or None into a TimingProfile (ValueError if invalid)"""
+    default = default or os.environ.get('TIMING_PROFILE', DEFAULT_PROFILE)
+    if spec is None:
+        spec = default
+    if isinstance(spec, TimingProfile):
+        return spec
+    if isinstance(spec, str):
+        if spec not in TIMING_PROFILES:
+            raise ValueError(f"Unknown timing profile: {spec} (expected one of {', '.join(TIMING_PROFILES)})")
+        return TIMING_PROFILES[spec]
+    if not isinstance(spec, dict):
+        raise ValueError("timing must be a profile name or an object of overrides")
+
+    overrides = dict(spec)
+    base = resolve_profile(overrides.pop('base', None), default)
+    unknown = set(overrides) - set(TimingProfile._fields[1:])
+    if unknown:
+        raise ValueError(f"Unknown timing fields: {', '.join(sorted(unknown))}")
+    values = base._asdict()
+    for field, value in overrides.items():
+        if field == 'bulk_text':
+            values[field] = bool(value)
+            continue
+        try:
+            value = int(value) if field == 'bulk_min_chars' else float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"timing {field} must be a number")
+        if value < 0:
+            raise ValueError(f"timing {field} must not be negative")
+        values[field] = value
+    values['name'] = 'custom'
+    return TimingProfile(**values)
+
+
+def validate_text_mode(mode):
+    if mode is not None and mode not in TEXT_MODES:
+        raise ValueError(f"Unknown text_mode: {mode} (expected one of {', '.join(TEXT_MODES)})")
+    return mode
+
+
+class ActionPerformer:
+    """Clicks and types through PyAutoGUI with the active profile's delays
+
+    pyautogui.PAUSE is set to 0; the profile's pause is applied once after each action instead.
+    """
+
+    def __init__(self, pyautogui, profile=None):
+        self.pyautogui = pyautogui
+        self.pyautogui.PAUSE = 0
+        self.default_profile = resolve_profile(profile)
+        self._local = threading.local()
+
+    @property
+    def profile(self):
+        return getattr(self._local, 'profile', None) or self.default_profile
+
+    @contextmanager
+    def using(self, spec=None):
+        """Use a command's timing profile (None keeps the default) for the actions in the block"""
+        previous = getattr(self._local, 'profile', None)
+        self._local.profile = resolve_profile(spec, self.default_profile.name) if spec is not None else None
+        try:
+            yield self.profile
+        finally:
+            self._local.profile = previous
+
+    def _settle(self):
+        if self.profile.pause:
+            time.sleep(self.profile.pause)
+
+    def click(self, x, y):
+        profile = self.profile
+        self.pyautogui.click(x, y, duration=profile.move_duration, _pause=False)
+        self._settle()
+
+    def type_text(self, text, mode=None):
+        """Type text key by key, or paste it in one operation; returns the mode used"""
+        profile = self.profile
+        mode = validate_text_mode(mode) or 'auto'
+        if mode == 'auto':
+            mode = 'paste' if profile.bulk_text and len(text) >= profile.bulk_min_chars else 'keys'
+        if mode == 'paste':
+            try:
+                self.paste_text(text)
+                self._settle()
+                return 'paste'
+            except Exception as e:
+                print(f"Bulk text input unavailable ({e}), typing key by key")
+        self.pyautogui.typewrite(text, interval=profile.type_interval, _pause=False)
+        self._settle()
+        return 'keys'
+
+    def paste_text(self, text):
+        """Enter text in one operation through the clipboard, restoring its previous contents"""
+        import pyperclip
+        try:
+            previous = pyperclip.paste()
+        except Exception:
+            previous = None
+        pyperclip.copy(text)
+        try:
+            self.pyautogui.hotkey('command' if sys.platform == 'darwin' else 'ctrl', 'v', _pause=False)
+            time.sleep(PASTE_SETTLE)
+        finally:
+            if previous is not None:
+                pyperclip.copy(previous)
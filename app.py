@@ -1,68 +1,196 @@
-from flask import Flask, render_template, request, jsonify
+import time
+
+# Measured from the very first import so boot time can be reported
+BOOT_STARTED = time.perf_counter()
+
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 import json
 import os
-import time
-import logging
+import threading
+import uuid
+import zlib
 from datetime import datetime
 
-# Set up virtual display for headless environments (like Render)
-try:
-    from pyvirtualdisplay import Display
-    # Check if we're in a headless environment
-    if not os.environ.get('DISPLAY'):
-        print("Setting up virtual display for PyAutoGUI...")
-        display = Display(visible=0, size=(1920, 1080))
-        display.start()
-        os.environ['DISPLAY'] = ':99'
-        print("Virtual display started successfully")
-except ImportError:
-    print("pyvirtualdisplay not available - PyAutoGUI may not work in headless environment")
-except Exception as e:
-    print(f"Error setting up virtual display: {e}")
-
-# Now import PyAutoGUI after setting up display
-import pyautogui
-from PIL import Image
+from screen_region import normalize_region
+from command_queue import QueueFull, UnknownClient, create_command_queue
+from action_timing import resolve_profile, validate_text_mode
+from command_sequence import compile_sequence
+from detection_scheduler import DetectionScheduler, TemplateConfig
+from event_stream import create_event_log, format_event
+from latency_trace import command_stages, summarize
+from log_pipeline import LogPipeline, parse_console_batch
+from log_store import LogSegmentStore
+from metrics import CONTENT_TYPE, REGISTRY
 
 app = Flask(__name__)
 
-# Configure PyAutoGUI
-pyautogui.FAILSAFE = True  # Move mouse to top-left corner to stop
-pyautogui.PAUSE = 0.5  # Pause between actions
+# Instrumentation: recording is a locked dict update, gauges are computed only when scraped
+http_requests = REGISTRY.counter('haccser_http_requests_total', 'HTTP requests by route, method and status',
+                                 ('route', 'method', 'status'))
+http_latency = REGISTRY.histogram('haccser_http_request_duration_seconds', 'HTTP request latency by route',
+                                  ('route', 'method'))
+command_latency = REGISTRY.histogram('haccser_command_result_latency_seconds',
+                                     'Time from a command being queued to its result arriving', ('action',))
+command_stage_latency = REGISTRY.histogram('haccser_command_stage_seconds',
+                                           'Command round trip split into stages (see latency_trace)',
+                                           ('action', 'stage'))
+commands_total = REGISTRY.counter('haccser_commands_total', 'Commands queued by action', ('action',))
+command_results_total = REGISTRY.counter('haccser_command_results_total', 'Command results by outcome',
+                                         ('outcome',))
+log_entries_total = REGISTRY.counter('haccser_console_log_entries_total', 'Console log entries received',
+                                     ('outcome',))
+detection_cycle = REGISTRY.histogram('haccser_detection_cycle_seconds',
+                                     'Background detection cycle time (capture, diff and matching)',
+                                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+detection_cycles = REGISTRY.counter('haccser_detection_cycles_total', 'Background detection cycles by outcome',
+                                    ('outcome',))
+detection_templates = REGISTRY.counter('haccser_detection_templates_total',
+                                       'Template checks in background detection by result', ('result',))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        # Label by route template (not the raw path) to keep cardinality bounded
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        http_latency.observe(time.perf_counter() - started, route=route, method=request.method)
+        http_requests.inc(route=route, method=request.method, status=response.status_code)
+    return response
 
-# Hardcoded image paths (you can modify these)
+# Default image paths, used until templates are changed through /api/detection/templates
 IMAGE_PATHS = {
     'button': 'images/button.png',
     'icon': 'images/icon.png',
     'logo': 'images/logo.png'
 }
+# Template images registered at runtime must live under this directory
+IMAGE_ROOT = os.environ.get('IMAGE_ROOT', 'images')
 
-# Configure logging
-def setup_logging():
-    """Setup file logging for console logs"""
-    # Create logs directory if it doesn't exist
-    os.makedirs('logs', exist_ok=True)
-    
-    # Create a custom logger
-    logger = logging.getLogger('console_logs')
-    logger.setLevel(logging.INFO)
-    
-    # Create file handler with timestamp
-    log_filename = f"logs/console_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    file_handler = logging.FileHandler(log_filename)
-    file_handler.setLevel(logging.INFO)
-    
-    # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    
-    # Add handler to logger
-    logger.addHandler(file_handler)
-    
-    return logger
+# Runtime template set shared by all worker processes; the detection process picks up changes
+template_config = TemplateConfig(
+    os.environ.get('DETECTION_CONFIG_FILE', os.path.join('data', 'detection_templates.json')),
+    IMAGE_PATHS
+)
+
+# Display, PyAutoGUI, matching and the detection thread are set up lazily by the start_*
+# hooks below, so importing this module (web workers, tests, tools) needs no X server
+display = None
+pyautogui = None
+template_store = None
+image_matcher = None
+change_detector = None
+detection_scheduler = None
+automation_actions = None
+background_thread = None
+detection_stop = threading.Event()
+detection_restarts = 0
+startup_report = {}
+_startup_lock = threading.RLock()
+
+def env_flag(name, default):
+    """Read a boolean environment variable ('1', 'true', 'yes' / '0', 'false', 'no')"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def start_display():
+    """Set up a virtual display for headless environments (like Render)"""
+    global display
+    with _startup_lock:
+        if display is not None or os.environ.get('DISPLAY'):
+            return display
+        try:
+            from pyvirtualdisplay import Display
+            print("Setting up virtual display for PyAutoGUI...")
+            display = Display(visible=0, size=(1920, 1080))
+            display.start()
+            os.environ['DISPLAY'] = ':99'
+            print("Virtual display started successfully")
+        except ImportError:
+            print("pyvirtualdisplay not available - PyAutoGUI may not work in headless environment")
+        except Exception as e:
+            print(f"Error setting up virtual display: {e}")
+        return display
+
+def start_automation():
+    """Import and configure PyAutoGUI and the image matching engine (idempotent)"""
+    global pyautogui, template_store, image_matcher, change_detector, detection_scheduler, automation_actions
+    with _startup_lock:
+        if pyautogui is not None:
+            return pyautogui
+        started = time.perf_counter()
+        
+        # PyAutoGUI must be imported after the display is set up
+        start_display()
+        import pyautogui as pyautogui_module
+        from image_matching import TemplateMatcher
+        from template_store import TemplateStore
+        from screen_change import ChangeDetector
+        from action_timing import ActionPerformer
+        
+        # Configure PyAutoGUI
+        pyautogui_module.FAILSAFE = True  # Move mouse to top-left corner to stop
+        # Background clicks wait per DETECTION_TIMING instead of a global pyautogui.PAUSE
+        automation_actions = ActionPerformer(pyautogui_module, os.environ.get('DETECTION_TIMING'))
+        
+        # Templates are decoded once and reloaded only when the file changes
+        template_store = TemplateStore({name: options['path'] for name, options in template_config.load().items()})
+        
+        # Shared matcher: one screen capture per detection cycle for all templates
+        # MATCH_SEARCH trades speed for accuracy: fast, balanced or exact (full-resolution only)
+        image_matcher = TemplateMatcher(template_store, confidence=0.9,
+                                        search=os.environ.get('MATCH_SEARCH', 'balanced'))
+        
+        # Skips matching when the screen hasn't changed since the last cycle
+        change_detector = ChangeDetector()
+        
+        # Per-template intervals: hits are re-checked quickly, misses back off
+        detection_scheduler = DetectionScheduler(
+            min_interval=float(os.environ.get('DETECTION_MIN_INTERVAL', 0.5)),
+            max_interval=float(os.environ.get('DETECTION_MAX_INTERVAL', 30)),
+            backoff=float(os.environ.get('DETECTION_BACKOFF', 1.5)),
+            max_per_cycle=int(os.environ.get('DETECTION_MAX_PER_CYCLE', 0)) or None
+        )
+        
+        pyautogui = pyautogui_module
+        startup_report['automation_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"Automation started in {startup_report['automation_ms']} ms (DISPLAY={os.environ.get('DISPLAY')})")
+        return pyautogui
+
+# Compressed, indexed copy of every console log entry for /api/console-logs/query
+log_store = LogSegmentStore(
+    directory=os.path.join('logs', 'segments'),
+    max_age=float(os.environ.get('CONSOLE_LOG_RETENTION_DAYS', 7)) * 24 * 3600,
+    max_total_bytes=int(os.environ.get('CONSOLE_LOG_RETENTION_MB', 512)) * 1024 * 1024
+)
+
+# Console logs are written by a background thread so requests never wait on disk
+console_logger = LogPipeline(
+    directory='logs',
+    max_queue=int(os.environ.get('CONSOLE_LOG_QUEUE', 10000)),
+    max_bytes=int(os.environ.get('CONSOLE_LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    rotate_interval=float(os.environ.get('CONSOLE_LOG_ROTATE_SECONDS', 24 * 3600)),
+    echo=os.environ.get('CONSOLE_LOG_ECHO') == '1',
+    store=log_store
+)
 
-# Initialize logging
-console_logger = setup_logging()
+# Largest console log batch accepted, measured after decompression
+MAX_CONSOLE_BATCH_BYTES = int(os.environ.get('CONSOLE_LOG_MAX_BATCH_BYTES', 5 * 1024 * 1024))
+
+def read_json_body(max_bytes):
+    """Parse the request JSON, inflating it first when sent with Content-Encoding: gzip"""
+    body = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        # Stop inflating just past the limit so a small, highly compressed body cannot exhaust memory
+        body = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body, max_bytes + 1)
+    if len(body) > max_bytes:
+        raise ValueError(f"Request body larger than {max_bytes} bytes")
+    return json.loads(body)
 
 @app.route('/')
 def index():
@@ -109,26 +237,26 @@ def handle_location():
 
 @app.route('/api/console-logs', methods=['POST'])
 def handle_console_logs():
-    """Handle console logs from JavaScript and save to file"""
+    """Handle console logs from JavaScript and save to file
+
+    Accepts the original per-entry JSON and the compact batch format (see parse_console_batch),
+    either of them optionally gzip-compressed.
+    """
     try:
-        data = request.get_json()
-        logs = data.get('logs', [])
-        session_id = data.get('sessionId', 'unknown')
+        session_id, rows = parse_console_batch(read_json_body(MAX_CONSOLE_BATCH_BYTES))
         
-        print(f"Received {len(logs)} console logs from session: {session_id}")
-        
-        # Log each console entry to file
-        for log_entry in logs:
-            log_message = f"[{session_id}] {log_entry.get('level', 'info').upper()}: {log_entry.get('message', '')}"
-            console_logger.info(log_message)
-            
-            # Also print to server console for debugging
-            print(f"Console Log [{log_entry.get('level', 'info')}]: {log_entry.get('message', '')}")
+        # Hand the batch to the background writer and return immediately
+        accepted, dropped = console_logger.submit_rows(session_id, rows)
+        log_entries_total.inc(accepted, outcome='accepted')
+        if dropped:
+            log_entries_total.inc(dropped, outcome='dropped')
         
         return jsonify({
             'status': 'success',
-            'message': f'Successfully logged {len(logs)} console entries',
+            'message': f'Successfully logged {accepted} console entries',
             'sessionId': session_id,
+            'accepted': accepted,
+            'dropped': dropped,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -139,21 +267,69 @@ def handle_console_logs():
             'message': str(e)
         }), 400
 
+@app.route('/api/console-logs/stats', methods=['GET'])
+def get_console_log_stats():
+    """Get console log queue depth, written/dropped counters and the current log file"""
+    return jsonify(console_logger.stats())
+
+def parse_time_arg(value):
+    """Parse a query-string time given as epoch seconds or an ISO 8601 timestamp"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+@app.route('/api/console-logs/query', methods=['GET'])
+def query_console_logs():
+    """Stream stored console log entries as JSON lines, filtered by sessionId, level and time range"""
+    try:
+        session_id = request.args.get('sessionId')
+        level = request.args.get('level')
+        since = parse_time_arg(request.args.get('since'))
+        until = parse_time_arg(request.args.get('until'))
+        limit = int(request.args.get('limit', 1000))
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    def generate():
+        for record in log_store.query(session_id=session_id, level=level.lower() if level else None,
+                                      since=since, until=until, limit=limit):
+            yield json.dumps(record) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/test-pyautogui', methods=['GET'])
 def test_pyautogui():
     """Test if PyAutoGUI is working properly"""
     try:
+        start_automation()
+        
         # Test screen size
         screen_size = pyautogui.size()
         
-        # Test screenshot capability
-        screenshot = pyautogui.screenshot()
+        # Test screenshot capability through the same capture backend detection uses
+        screen = image_matcher.screen
+        try:
+            started = time.perf_counter()
+            frame = screen.grab()
+            capture_ms = round((time.perf_counter() - started) * 1000, 2)
+            backend = screen.active_backend()
+        finally:
+            # Request threads are short-lived: release this thread's display connection
+            screen.close()
         
         return jsonify({
             'status': 'success',
             'message': 'PyAutoGUI is working properly',
             'screen_size': {'width': screen_size.width, 'height': screen_size.height},
-            'screenshot_size': {'width': screenshot.width, 'height': screenshot.height},
+            'screenshot_size': {'width': frame.shape[1], 'height': frame.shape[0]},
+            'capture_backend': backend,
+            'capture_ms': capture_ms,
             'display': os.environ.get('DISPLAY', 'Not set')
         })
         
@@ -165,9 +341,183 @@ def test_pyautogui():
         }), 400
 
 # Remote PyAutoGUI control system
-connected_clients = {}
-command_queue = {}
-command_results = {}
+# Client registry, per-session bounded queues and results live in one thread-safe subsystem.
+# STATE_BACKEND=sqlite:///data/state.db shares it between worker processes (default: memory)
+command_queue = create_command_queue(
+    os.environ.get('STATE_BACKEND', 'memory'),
+    max_pending=int(os.environ.get('COMMAND_QUEUE_MAX', 100)),
+    overflow=os.environ.get('COMMAND_QUEUE_OVERFLOW', 'reject'),
+    result_ttl=float(os.environ.get('COMMAND_RESULT_TTL', 3600)),
+    client_ttl=float(os.environ.get('CLIENT_TTL', 120))
+)
+
+# Longest time get_commands may hold a long-poll request open
+MAX_LONG_POLL_WAIT = 30
+
+# Client connect/disconnect events and command results pushed to browsers over /api/events;
+# kept next to the command queue so every worker process streams the same events
+event_log = create_event_log(os.environ.get('STATE_BACKEND', 'memory'),
+                             max_events=int(os.environ.get('EVENT_LOG_MAX', 1000)))
+command_queue.add_listener(event_log.publish)
+
+# Each open stream holds a server thread: it sends a comment every EVENT_STREAM_HEARTBEAT seconds
+# so proxies keep it open, and ends after EVENT_STREAM_MAX_AGE so threads are recycled (the
+# browser's EventSource reconnects on its own and resumes from the last event it saw)
+EVENT_STREAM_HEARTBEAT = 15
+EVENT_STREAM_MAX_AGE = float(os.environ.get('EVENT_STREAM_MAX_AGE', 60))
+
+# Long-polls and event streams share a per-process budget of threads so they can never occupy
+# every thread of the worker: RESERVED_THREADS always stay free for send-command, results and the UI.
+# Past the budget a long-poll returns at once (the client retries after retry_after) and an event
+# stream sends its snapshot and asks the browser to reconnect later.
+RESERVED_THREADS = 4
+LONG_LIVED_REQUESTS = int(os.environ.get('LONG_LIVED_REQUESTS',
+                                         max(1, int(os.environ.get('WEB_THREADS', 16)) - RESERVED_THREADS)))
+long_lived_slots = threading.BoundedSemaphore(LONG_LIVED_REQUESTS)
+BUSY_RETRY_AFTER = 2
+long_lived_rejected = REGISTRY.counter('haccser_long_lived_rejected_total',
+                                       'Long-polls and event streams turned away because the thread budget was in use',
+                                       ('kind',))
+
+# Actions the local client executes; also the only values used as metric labels
+COMMAND_ACTIONS = ('click_image', 'click_coordinates', 'type_text', 'screenshot', 'get_screen_size', 'run_sequence')
+
+def metric_action(action):
+    """Action as a metric label: anything a caller or client makes up is counted as 'other'"""
+    return action if action in COMMAND_ACTIONS else 'other'
+
+def build_command(data):
+    """Build a queued command from request JSON (the ID is assigned when it is enqueued)"""
+    if data.get('action') not in COMMAND_ACTIONS:
+        raise ValueError(f"Unknown action: {data.get('action')!r} (expected one of {', '.join(COMMAND_ACTIONS)})")
+    command = {
+        'action': data.get('action'),
+        'image_name': data.get('image_name'),
+        'x': data.get('x'),
+        'y': data.get('y'),
+        'text': data.get('text'),
+        'region': normalize_region(data.get('region')),
+        'timestamp': datetime.now().isoformat(),
+        # Epoch seconds, echoed back with the result to measure queue-to-result latency
+        'enqueued_at': time.time()
+    }
+    if data.get('timing') is not None:
+        # Profile name or custom overrides, checked here and resolved again on the client
+        resolve_profile(data['timing'])
+        command['timing'] = data['timing']
+    if data.get('text_mode') is not None:
+        command['text_mode'] = validate_text_mode(data['text_mode'])
+    if command['action'] == 'run_sequence':
+        # Validated here so a malformed sequence is rejected before it reaches the client
+        command['steps'] = compile_sequence(data.get('steps'))
+    return command
+
+def store_command_result(session_id, data):
+    """Record one command result reported by a local client"""
+    command_id = data.get('command_id')
+    success = data.get('success')
+    message = data.get('message', '')
+    
+    action = metric_action(data.get('action'))
+    received_at = time.time()
+    
+    command_results_total.inc(outcome='success' if success else 'failure')
+    enqueued_at = data.get('enqueued_at')
+    if isinstance(enqueued_at, (int, float)):
+        command_latency.observe(max(0.0, received_at - enqueued_at), action=action)
+    stages = command_stages(enqueued_at, received_at, data.get('trace'))
+    for stage, ms in stages.items():
+        command_stage_latency.observe(ms / 1000, action=action, stage=stage)
+    
+    result = {
+        'session_id': session_id,
+        'success': success,
+        'message': message,
+        'action': action,
+        'latency_ms': stages,
+        'timestamp': datetime.now().isoformat()
+    }
+    if isinstance(data.get('steps'), list):
+        # Per-step progress of a run_sequence command
+        result['steps'] = data['steps']
+    if data.get('broadcast_id'):
+        result['broadcast_id'] = data['broadcast_id']
+    command_queue.record_result(command_id, result)
+    event_log.publish('command_result', dict(result, command_id=command_id))
+    
+    print(f"Command {command_id} result: {'Success' if success else 'Failed'} - {message}")
+
+def parse_client_labels(data):
+    """Validated (group, tags) from a registration request"""
+    group = data.get('group')
+    tags = data.get('tags') or []
+    if group is not None and not isinstance(group, str):
+        raise ValueError("group must be a string")
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("tags must be a list of strings")
+    return group, tags
+
+def match_clients(clients, target):
+    """Session IDs of the clients a broadcast target selects
+
+    target is {"group": ..., "tags": [...], "session_ids": [...]}; every given field must match
+    (a client needs all the tags) and {} selects every connected client.
+    """
+    if not isinstance(target, dict):
+        raise ValueError("target must be an object")
+    group = target.get('group')
+    if group is not None and not isinstance(group, str):
+        raise ValueError("target group must be a string")
+    for field in ('tags', 'session_ids'):
+        values = target.get(field)
+        if values is not None and (not isinstance(values, list) or not all(isinstance(value, str) for value in values)):
+            raise ValueError(f"target {field} must be a list of strings")
+    tags = set(target.get('tags') or [])
+    session_ids = target.get('session_ids')
+    wanted = set(session_ids) if session_ids is not None else None
+    return [session_id for session_id, info in clients.items()
+            if (group is None or info.get('group') == group)
+            and tags.issubset(info.get('tags') or [])
+            and (wanted is None or session_id in wanted)]
+
+def summarize_broadcast(broadcast, results, detail=False):
+    """Completion, failures and the slowest client of a broadcast from its stored results"""
+    summary = {
+        'broadcast_id': broadcast['broadcast_id'],
+        'action': broadcast['action'],
+        'created_at': broadcast['created_at'],
+        'targets': len(broadcast['queued']) + len(broadcast['failed']),
+        'queued': len(broadcast['queued']),
+        'not_queued': len(broadcast['failed']),
+        'completed': 0,
+        'succeeded': 0,
+        'failed': 0,
+        'pending': 0,
+        'slowest': None,
+        'failures': [{'session_id': session_id, 'message': reason, 'stage': 'enqueue'}
+                     for session_id, reason in broadcast['failed'].items()]
+    }
+    clients = {}
+    for session_id, command_id in broadcast['queued'].items():
+        result = results.get(command_id)
+        if result is None:
+            summary['pending'] += 1
+            clients[session_id] = {'command_id': command_id, 'status': 'pending'}
+            continue
+        summary['completed'] += 1
+        summary['succeeded' if result.get('success') else 'failed'] += 1
+        if not result.get('success'):
+            summary['failures'].append({'session_id': session_id, 'message': result.get('message', ''),
+                                        'stage': 'execute'})
+        total_ms = (result.get('latency_ms') or {}).get('total')
+        if total_ms is not None and (summary['slowest'] is None or total_ms > summary['slowest']['total_ms']):
+            summary['slowest'] = {'session_id': session_id, 'total_ms': total_ms}
+        clients[session_id] = {'command_id': command_id, 'status': 'success' if result.get('success') else 'failed',
+                               'message': result.get('message', ''), 'total_ms': total_ms}
+    summary['done'] = summary['pending'] == 0
+    if detail:
+        summary['clients'] = clients
+    return summary
 
 @app.route('/api/register-client', methods=['POST'])
 def register_client():
@@ -177,13 +527,16 @@ def register_client():
         session_id = data.get('session_id')
         client_type = data.get('client_type')
         
-        connected_clients[session_id] = {
-            'type': client_type,
-            'connected_at': datetime.now().isoformat(),
-            'last_seen': datetime.now().isoformat()
-        }
+        if not session_id:
+            return jsonify({
+                'status': 'error',
+                'message': 'session_id is required'
+            }), 400
+        
+        group, tags = parse_client_labels(data)
+        command_queue.register_client(session_id, client_type, group=group, tags=tags)
         
-        print(f"Client registered: {session_id} ({client_type})")
+        print(f"Client registered: {session_id} ({client_type}, group={group}, tags={tags})")
         
         return jsonify({
             'status': 'success',
@@ -199,39 +552,122 @@ def register_client():
 
 @app.route('/api/send-command', methods=['POST'])
 def send_command():
-    """Send a command to a local PyAutoGUI client"""
+    """Send a command to a local PyAutoGUI client
+
+    Instead of session_id, a "target" ({"group", "tags", "session_ids"}, {} for everyone)
+    broadcasts the command to every matching client in one call; follow its progress with
+    GET /api/broadcasts/<broadcast_id>.
+    """
     try:
         data = request.get_json()
         session_id = data.get('session_id')
-        action = data.get('action')
+        command = build_command(data)
+        
+        if session_id is None and data.get('target') is not None:
+            return broadcast_command(command, data['target'])
         
-        if session_id not in connected_clients:
+        try:
+            command_id = command_queue.enqueue(session_id, command)
+            commands_total.inc(action=command['action'])
+        except UnknownClient:
             return jsonify({
                 'status': 'error',
                 'message': 'Client not connected'
             }), 400
+        except QueueFull as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 429
         
-        command = {
-            'id': len(command_queue.get(session_id, [])) + 1,
-            'action': action,
-            'image_name': data.get('image_name'),
-            'x': data.get('x'),
-            'y': data.get('y'),
-            'text': data.get('text'),
-            'timestamp': datetime.now().isoformat()
-        }
+        print(f"Command queued for {session_id}: {command}")
         
-        if session_id not in command_queue:
-            command_queue[session_id] = []
+        return jsonify({
+            'status': 'success',
+            'message': 'Command sent to local client',
+            'command_id': command_id
+        })
         
-        command_queue[session_id].append(command)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+def broadcast_command(command, target):
+    """Queue one command for every client the target selects"""
+    session_ids = match_clients(command_queue.clients(), target)
+    if not session_ids:
+        return jsonify({
+            'status': 'error',
+            'message': 'No connected clients match the target'
+        }), 400
+    
+    broadcast_id = uuid.uuid4().hex[:16]
+    queued, failed = command_queue.enqueue_broadcast(broadcast_id, session_ids, command)
+    commands_total.inc(len(queued), action=command['action'])
+    
+    print(f"Command broadcast {broadcast_id} queued for {len(queued)} of {len(session_ids)} clients: "
+          f"{command['action']}")
+    
+    return jsonify({
+        'status': 'success' if queued else 'error',
+        'message': f'Command sent to {len(queued)} of {len(session_ids)} clients',
+        'broadcast_id': broadcast_id,
+        'command_ids': queued,
+        'failed': failed
+    }), 200 if queued else 429
+
+@app.route('/api/broadcasts/<broadcast_id>', methods=['GET'])
+def get_broadcast(broadcast_id):
+    """Aggregate result of a broadcast: completed/succeeded/failed/pending counts, failures and
+    the slowest client; ?detail=1 adds every client's status"""
+    broadcast = command_queue.get_broadcast(broadcast_id)
+    if broadcast is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Unknown broadcast'
+        }), 404
+    results = command_queue.get_results(list(broadcast['queued'].values()))
+    return jsonify(summarize_broadcast(broadcast, results, detail=request.args.get('detail') == '1'))
+
+@app.route('/api/send-commands', methods=['POST'])
+def send_commands():
+    """Send an ordered batch of commands to a local PyAutoGUI client in one request"""
+    try:
+        data = request.get_json()
+        session_id = data.get('session_id')
+        batch = data.get('commands')
         
-        print(f"Command queued for {session_id}: {command}")
+        if not isinstance(batch, list) or not batch:
+            return jsonify({
+                'status': 'error',
+                'message': 'commands must be a non-empty list'
+            }), 400
+        
+        commands = [build_command(item) for item in batch]
+        
+        try:
+            command_ids = command_queue.enqueue_many(session_id, commands)
+            for command in commands:
+                commands_total.inc(action=command['action'])
+        except UnknownClient:
+            return jsonify({
+                'status': 'error',
+                'message': 'Client not connected'
+            }), 400
+        except QueueFull as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 429
+        
+        print(f"{len(command_ids)} commands queued for {session_id}: {command_ids}")
         
         return jsonify({
             'status': 'success',
-            'message': 'Command sent to local client',
-            'command_id': command['id']
+            'message': f'{len(command_ids)} commands sent to local client',
+            'command_ids': command_ids
         })
         
     except Exception as e:
@@ -242,19 +678,45 @@ def send_command():
 
 @app.route('/api/get-commands/<session_id>', methods=['GET'])
 def get_commands(session_id):
-    """Get pending commands for a client"""
+    """Get pending commands for a client
+
+    With ?wait=<seconds> the request long-polls: it blocks until a command is queued
+    for this session or the timeout expires. Without it, it returns immediately.
+    """
     try:
-        if session_id in connected_clients:
-            connected_clients[session_id]['last_seen'] = datetime.now().isoformat()
+        if not command_queue.touch(session_id):
+            # Unknown session (e.g. the server restarted): tell the client to register again
+            return jsonify({
+                'status': 'error',
+                'message': 'Client not registered',
+                'registered': False
+            }), 404
         
-        commands = command_queue.get(session_id, [])
-        # Clear the queue after sending
-        if session_id in command_queue:
-            command_queue[session_id] = []
+        wait = min(max(float(request.args.get('wait', 0)), 0), MAX_LONG_POLL_WAIT)
+        busy = wait > 0 and not long_lived_slots.acquire(blocking=False)
+        if busy:
+            long_lived_rejected.inc(kind='long_poll')
+            commands = command_queue.take(session_id)
+        else:
+            try:
+                commands = command_queue.take(session_id, wait=wait)
+            finally:
+                if wait > 0:
+                    long_lived_slots.release()
+        delivered_at = time.time()
+        for command in commands:
+            command['delivered_at'] = delivered_at
         
-        return jsonify({
-            'commands': commands
-        })
+        command_queue.touch(session_id)
+        
+        response = {
+            'commands': commands,
+            'long_poll': wait > 0
+        }
+        if busy and not commands:
+            # No thread to spare for waiting: poll again shortly instead
+            response['retry_after'] = BUSY_RETRY_AFTER
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({
@@ -267,19 +729,10 @@ def handle_command_result():
     """Handle command results from local clients"""
     try:
         data = request.get_json()
-        command_id = data.get('command_id')
         session_id = data.get('session_id')
-        success = data.get('success')
-        message = data.get('message', '')
         
-        command_results[command_id] = {
-            'session_id': session_id,
-            'success': success,
-            'message': message,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        print(f"Command {command_id} result: {'Success' if success else 'Failed'} - {message}")
+        store_command_result(session_id, data)
+        command_queue.touch(session_id)
         
         return jsonify({'status': 'success'})
         
@@ -289,51 +742,381 @@ def handle_command_result():
             'message': str(e)
         }), 400
 
+@app.route('/api/command-results', methods=['POST'])
+def handle_command_results():
+    """Handle a batch of command results from a local client in one request"""
+    try:
+        data = request.get_json()
+        session_id = data.get('session_id')
+        results = data.get('results', [])
+        
+        for result in results:
+            store_command_result(session_id, result)
+        command_queue.touch(session_id)
+        
+        return jsonify({
+            'status': 'success',
+            'received': len(results)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
 @app.route('/api/connected-clients', methods=['GET'])
 def get_connected_clients():
-    """Get list of connected clients"""
+    """Get list of connected clients, optionally only those in ?group= with every ?tag="""
+    clients = command_queue.clients()
+    if request.args.get('group') or request.args.getlist('tag'):
+        target = {'group': request.args.get('group'), 'tags': request.args.getlist('tag')}
+        clients = {session_id: clients[session_id] for session_id in match_clients(clients, target)}
     return jsonify({
-        'clients': connected_clients,
-        'count': len(connected_clients)
+        'clients': clients,
+        'count': len(clients)
     })
 
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """Server-sent events: a 'clients' snapshot, then client_connected, client_disconnected
+    and command_result events as they happen
+
+    Resumes after the Last-Event-ID header (or ?last_event_id); ?session_id limits the stream
+    to one client's events.
+    """
+    try:
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+        session_filter = request.args.get('session_id')
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    def generate():
+        # Take the position before the snapshot so nothing between the two is missed
+        after = event_log.last_id()
+        if last_event_id is not None and last_event_id <= after:
+            after = last_event_id
+        clients = command_queue.clients()
+        if session_filter:
+            clients = {session_id: info for session_id, info in clients.items() if session_id == session_filter}
+        if not long_lived_slots.acquire(blocking=False):
+            # Thread budget in use: hand over the snapshot and have the browser come back later
+            long_lived_rejected.inc(kind='event_stream')
+            yield 'retry: 10000\n\n'
+            yield format_event(None, 'clients', {'clients': clients, 'count': len(clients)})
+            return
+        try:
+            yield 'retry: 3000\n\n'
+            yield format_event(None, 'clients', {'clients': clients, 'count': len(clients)})
+            
+            deadline = time.monotonic() + EVENT_STREAM_MAX_AGE
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                events = event_log.read(after, timeout=min(EVENT_STREAM_HEARTBEAT, remaining))
+                if not events:
+                    yield ': keep-alive\n\n'
+                    continue
+                for event_id, event_type, data in events:
+                    after = event_id
+                    if session_filter and data.get('session_id') != session_filter:
+                        continue
+                    yield format_event(event_id, event_type, data)
+        finally:
+            long_lived_slots.release()
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/latency', methods=['GET'])
+def get_command_latency():
+    """Per-stage p50/p95/p99 command latency (ms) by action over the stored command results
+
+    Stages: queue (waiting for the client to poll), network, client_wait (behind earlier
+    commands of the same batch), execute (with its locate and action parts), report_wait
+    (result held for the batch report) and total. ?action= limits the report to one action.
+    """
+    try:
+        action = request.args.get('action')
+        results = list(command_queue.results().values())
+        return jsonify({
+            'actions': summarize(results, action=action),
+            'results_considered': len(results)
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/api/queue-stats', methods=['GET'])
+def get_queue_stats():
+    """Get command queue depths, drop/reject counters and stored result counts"""
+    return jsonify(command_queue.stats())
+
+@app.route('/api/matcher-stats', methods=['GET'])
+def get_matcher_stats():
+    """Get background matcher counters and template status"""
+    if image_matcher is None:
+        return jsonify({
+            'status': 'inactive',
+            'message': 'Image matching has not been started in this worker'
+        })
+    return jsonify({
+        'matcher': image_matcher.stats(),
+        'capture': image_matcher.screen.stats(),
+        'scheduler': detection_scheduler.status(),
+        'detection_restarts': detection_restarts,
+        'change_detector': change_detector.stats(),
+        'templates': template_store.status()
+    })
+
+def parse_template_options(name, value):
+    """Validate one template entry: a path, or {path, priority, min_interval, max_interval}"""
+    options = {'path': value} if isinstance(value, str) else dict(value or {})
+    unknown = set(options) - {'path', 'priority', 'min_interval', 'max_interval'}
+    if not name or unknown:
+        raise ValueError(f"Invalid template {name!r}: unknown fields {sorted(unknown)}")
+    path = options.get('path')
+    if not isinstance(path, str) or not path:
+        raise ValueError(f"Template {name!r} needs a path")
+    root = os.path.realpath(IMAGE_ROOT)
+    if not os.path.realpath(path).startswith(root + os.sep):
+        raise ValueError(f"Template {name!r} must be an image under {IMAGE_ROOT}/")
+    for field in ('priority', 'min_interval', 'max_interval'):
+        if options.get(field) is not None:
+            options[field] = int(options[field]) if field == 'priority' else float(options[field])
+            if field != 'priority' and options[field] <= 0:
+                raise ValueError(f"Template {name!r}: {field} must be positive")
+    return options
+
+@app.route('/api/detection/templates', methods=['GET'])
+def get_detection_templates():
+    """List the background detection templates and, in the detection process, their schedule"""
+    return jsonify({
+        'templates': template_config.load(),
+        'scheduler': detection_scheduler.status() if detection_scheduler is not None else None,
+        'invalid': template_store.invalid() if template_store is not None else None
+    })
+
+@app.route('/api/detection/templates', methods=['POST', 'PUT'])
+def update_detection_templates():
+    """Add or update templates (POST), or replace the whole set (PUT), without a restart"""
+    try:
+        data = request.get_json() or {}
+        templates = data.get('templates')
+        if not isinstance(templates, dict):
+            raise ValueError("Expected {\"templates\": {name: path or options}}")
+        parsed = {name: parse_template_options(name, value) for name, value in templates.items()}
+        
+        def apply(current):
+            if request.method == 'PUT':
+                current.clear()
+            current.update(parsed)
+        
+        updated = template_config.update(apply)
+        console_logger.info(f"Detection templates {'replaced' if request.method == 'PUT' else 'updated'}: "
+                            f"{', '.join(sorted(parsed)) or 'none'}")
+        return jsonify({'status': 'success', 'templates': updated})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/api/detection/templates/<name>', methods=['DELETE'])
+def delete_detection_template(name):
+    """Stop detecting one template"""
+    removed = []
+    
+    def apply(current):
+        if current.pop(name, None) is not None:
+            removed.append(name)
+    
+    updated = template_config.update(apply)
+    if not removed:
+        return jsonify({'status': 'error', 'message': f'Unknown template: {name}'}), 404
+    return jsonify({'status': 'success', 'templates': updated})
+
+def queue_depth_samples():
+    return {(session_id,): depth for session_id, depth in command_queue.stats()['queue_depths'].items()}
+
+REGISTRY.gauge('haccser_command_queue_depth', 'Pending commands per client session', ('session_id',),
+               callback=queue_depth_samples)
+REGISTRY.gauge('haccser_connected_clients', 'Registered local clients',
+               callback=lambda: len(command_queue.clients()))
+REGISTRY.gauge('haccser_console_log_queue_depth', 'Console log entries waiting for the writer',
+               callback=lambda: console_logger.stats()['queue_depth'])
+REGISTRY.counter('haccser_console_log_written_total', 'Console log entries written by this process',
+                 callback=lambda: console_logger.stats()['written'])
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text-format metrics for this process"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 # Background PyAutoGUI functions (no frontend interface)
+def apply_template_config():
+    """Load template changes made through the API (by any worker) into the store and scheduler"""
+    templates = template_config.changed()
+    if templates is None:
+        return False
+    template_store.set_paths({name: options['path'] for name, options in templates.items()})
+    detection_scheduler.sync(templates)
+    print(f"Detection templates: {', '.join(sorted(templates)) or 'none'}")
+    return True
+
+def detection_cycle_once():
+    """Check the templates that are due against one capture; returns seconds until the next is due"""
+    apply_template_config()
+    due = []
+    for name in detection_scheduler.due():
+        if template_store.get(name) is None:
+            # Missing or unreadable image: back it off like a miss so it is not due again at once
+            detection_scheduler.record_error(name)
+        else:
+            due.append(name)
+    if due:
+        cycle_started = time.perf_counter()
+        try:
+            # One capture for every due template. Templates checked last cycle only need the
+            # tiles that changed since; others (new, or skipped while the screen changed) need
+            # a full search. With no change at all, templates checked last cycle are not rematched.
+            frame = image_matcher.capture()
+            change = change_detector.update(frame)
+            if change.changed:
+                detection_scheduler.screen_changed(due)
+            full = [name for name in due if change.regions is None or detection_scheduler.needs_full(name)]
+            partial = [name for name in due if name not in full] if change.changed else []
+            
+            result = image_matcher.match_all(full, frame=frame) if full else None
+            if partial:
+                dirty = image_matcher.match_all(partial, frame=frame, dirty=change.regions)
+                result = dirty if result is None else result.merge(dirty)
+            detection_cycles.inc(outcome='processed' if result is not None else 'skipped')
+            
+            for name in due:
+                if result is not None and name in result.errors:
+                    detection_scheduler.record_error(name)
+                    continue
+                match = result.get(name) if result is not None else None
+                detection_scheduler.record(name, match is not None)
+                detection_templates.inc(result='match' if match else 'miss')
+                if match:
+                    center = match.center
+                    automation_actions.click(center.x, center.y)
+                    print(f"Background: Clicked on {match.name} at ({center.x}, {center.y}) score={match.score:.3f}")
+                    
+                    # Log to file
+                    console_logger.info(f"Background PyAutoGUI: Clicked on {match.name} at ({center.x}, {center.y})")
+        except Exception as e:
+            # A failed capture or match backs off the due templates; the loop carries on
+            detection_cycles.inc(outcome='error')
+            for name in due:
+                detection_scheduler.record_error(name)
+            print(f"Background detection cycle failed: {e}")
+        detection_cycle.observe(time.perf_counter() - cycle_started)
+    
+    # Free templates that are no longer in use
+    template_store.evict_unused()
+    return detection_scheduler.next_wakeup()
+
 def background_image_detection():
     """Background function to continuously detect and click images"""
+    while not detection_stop.is_set():
+        wakeup = detection_cycle_once()
+        # Wake for the next due template, but look for template changes at least once a second
+        detection_stop.wait(min(1.0, wakeup) if wakeup is not None else 1.0)
+
+def supervise_detection(max_delay=60.0):
+    """Run background detection, restarting it with backoff whenever it dies"""
+    global detection_restarts
+    delay = 1.0
+    while not detection_stop.is_set():
+        started = time.monotonic()
+        try:
+            start_automation()
+            background_image_detection()
+        except Exception as e:
+            detection_restarts += 1
+            print(f"Background image detection error: {str(e)} (restart {detection_restarts} in {delay:.0f}s)")
+            console_logger.error(f"Background PyAutoGUI error: {str(e)}")
+            if image_matcher is not None:
+                # Reconnect the capture backend on the next run
+                image_matcher.screen.close()
+        if time.monotonic() - started > max_delay:
+            delay = 1.0
+        detection_stop.wait(delay)
+        delay = min(max_delay, delay * 2)
+
+def acquire_detection_lock():
+    """Block until this process holds the detection lock, so only one worker runs detection"""
     try:
-        while True:
-            for image_name, image_path in IMAGE_PATHS.items():
-                if os.path.exists(image_path):
-                    try:
-                        # Look for the image with high confidence
-                        location = pyautogui.locateOnScreen(image_path, confidence=0.9)
-                        if location:
-                            center = pyautogui.center(location)
-                            pyautogui.click(center.x, center.y)
-                            print(f"Background: Clicked on {image_name} at ({center.x}, {center.y})")
-                            
-                            # Log to file
-                            console_logger.info(f"Background PyAutoGUI: Clicked on {image_name} at ({center.x}, {center.y})")
-                            
-                    except Exception as e:
-                        # Silently continue if image not found
-                        pass
-            
-            # Wait before next check
-            time.sleep(2)
-            
-    except Exception as e:
-        print(f"Background image detection error: {str(e)}")
-        console_logger.error(f"Background PyAutoGUI error: {str(e)}")
+        import fcntl
+    except ImportError:
+        # No flock (Windows): single-process development server, nothing to coordinate
+        return None
+    lock_path = os.environ.get('DETECTION_LOCK_FILE', os.path.join('data', 'detection.lock'))
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    lock_file = open(lock_path, 'w')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
 
-# Start background PyAutoGUI in a separate thread
-import threading
-background_thread = threading.Thread(target=background_image_detection, daemon=True)
-background_thread.start()
+def run_background_detection():
+    """Wait for the detection lock, then start automation and run the detection loop"""
+    lock_file = acquire_detection_lock()
+    print(f"Background detection running in process {os.getpid()}")
+    try:
+        supervise_detection()
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+
+def start_background_detection():
+    """Start the background detection thread in this process (idempotent)
+
+    Every process may call this; the thread waits on a file lock so exactly one
+    process runs detection, and another takes over if that process exits.
+    """
+    global background_thread
+    with _startup_lock:
+        if background_thread is None or not background_thread.is_alive():
+            background_thread = threading.Thread(target=run_background_detection,
+                                                 name='background-detection', daemon=True)
+            background_thread.start()
+        return background_thread
+
+def start_services():
+    """Explicit start hook: call once per serving process, after any fork
+
+    BACKGROUND_DETECTION (default on) controls whether this process competes to run
+    the detection worker; AUTOMATION_EAGER starts PyAutoGUI up front instead of lazily.
+    """
+    with _startup_lock:
+        if startup_report.get('services_started'):
+            return startup_report
+        started = time.perf_counter()
+        
+        console_logger.start()
+        command_queue.start_reaper()
+        if env_flag('AUTOMATION_EAGER', False):
+            start_automation()
+        if env_flag('BACKGROUND_DETECTION', True):
+            start_background_detection()
+        
+        startup_report['services_started'] = True
+        startup_report['services_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        startup_report['boot_ms'] = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+        print(f"Startup complete in {startup_report['boot_ms']} ms "
+              f"(services {startup_report['services_ms']} ms, pid {os.getpid()})")
+        return startup_report
 
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
+    # With the debug reloader only the child process that actually serves starts the services
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services()
     app.run(debug=debug, host='0.0.0.0', port=port)
-    
\ No newline at end of file
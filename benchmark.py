@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Benchmarks
+Headless, network-free timings for image matching, command dispatch and console log ingest
+
+Runs against synthetic NumPy frames by default (add --capture under Xvfb to also time real
+screen grabs) and writes machine-readable JSON that --compare can diff against an earlier run.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from image_matching import SEARCH_PROFILES, TemplateMatcher, to_gray  # noqa: E402
+from match_pool import default_workers  # noqa: E402
+from screen_capture import ScreenCapture, default_capture  # noqa: E402
+from template_store import TemplateStore  # noqa: E402
+
+SCREEN_SIZES = [(1280, 720), (1920, 1080), (3840, 2160)]
+TEMPLATE_COUNTS = [1, 5, 20]
+QUICK_SCREEN_SIZES = [(1280, 720), (1920, 1080)]
+QUICK_TEMPLATE_COUNTS = [1, 5]
+TEMPLATE_SIZE = (96, 48)
+SEED = 1234
+# Run parameters rather than measurements; left out of --compare
+PARAMETERS = ('repeat', 'templates', 'workers', 'found', 'sessions', 'commands', 'requests', 'batch_size')
+
+
+def measure(fn, repeat=5, warmup=1):
+    """Run fn repeatedly and summarise its wall time in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'repeat': repeat
+    }
+
+
+def synthetic_screen(width, height, seed=SEED):
+    """Deterministic desktop-like frame: flat panels, outlined widgets and text on a gradient"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(40, 90, width, dtype=np.float32)
+    frame = np.repeat(np.tile(gradient, (height, 1))[:, :, None], 3, axis=2).astype(np.uint8)
+    for _ in range(width * height // 20000):
+        x, y = int(rng.integers(0, width - 40)), int(rng.integers(0, height - 20))
+        w, h = int(rng.integers(20, 240)), int(rng.integers(12, 120))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, -1 if rng.random() < 0.6 else 2)
+        if rng.random() < 0.5:
+            cv2.putText(frame, f"item {int(rng.integers(0, 1000))}", (x + 4, y + 16),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    return frame
+
+
+def write_templates(frame, count, directory, seed=SEED):
+    """Cut count templates out of frame, half of which are then hidden so both hits and misses are timed"""
+    rng = np.random.default_rng(seed + count)
+    height, width = frame.shape[:2]
+    tw, th = TEMPLATE_SIZE
+    paths = {}
+    for index in range(count):
+        x, y = int(rng.integers(0, width - tw)), int(rng.integers(0, height - th))
+        template = frame[y:y + th, x:x + tw].copy()
+        if index % 2:
+            # Not on screen: draw a pattern that does not occur in the frame
+            template = np.full_like(template, 255)
+            cv2.circle(template, (tw // 2, th // 2), th // 3, (0, 0, 255), 3)
+        path = os.path.join(directory, f"template_{width}x{height}_{count}_{index}.png")
+        cv2.imwrite(path, template)
+        paths[f"template_{index}"] = path
+    return paths
+
+
+def bench_locate(sizes, counts, repeat, workdir, worker_counts=(1,)):
+    """Locate latency by screen size, template count, search profile and match worker count"""
+    results = []
+    for width, height in sizes:
+        frame = synthetic_screen(width, height)
+        gray = to_gray(frame)
+        for count in counts:
+            store = TemplateStore(write_templates(frame, count, workdir))
+            names = store.names()
+            for workers in worker_counts:
+                matcher = TemplateMatcher(store, confidence=0.9, workers=workers)
+                for search in SEARCH_PROFILES:
+                    def cold():
+                        matcher.forget()
+                        return matcher.match_all(names, frame=gray, search=search)
+
+                    found = len(cold().matches)
+                    entry = {'screen': f"{width}x{height}", 'templates': count, 'search': search,
+                             'workers': workers, 'found': found, 'cold': measure(cold, repeat)}
+                    # Warm: every hit is re-checked in its last-hit window first
+                    cold()
+                    entry['warm'] = measure(lambda: matcher.match_all(names, frame=gray, search=search), repeat)
+                    results.append(entry)
+                    print(f"locate {width}x{height} templates={count} search={search} workers={workers}: "
+                          f"cold {entry['cold']['median_ms']} ms, warm {entry['warm']['median_ms']} ms")
+                matcher.pool.close()
+            results.extend(bench_pyscreeze(frame, store, count, repeat))
+    return results
+
+
+def bench_pyscreeze(frame, store, count, repeat):
+    """The original pyautogui.locateOnScreen path (pyscreeze) on the same frame, when installed"""
+    try:
+        import pyscreeze
+        from PIL import Image
+    except ImportError:
+        return []
+    height, width = frame.shape[:2]
+    haystack = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    needles = [store.paths()[name] for name in store.names()]
+
+    def locate_all():
+        for needle in needles:
+            try:
+                pyscreeze.locate(needle, haystack, confidence=0.9, grayscale=True)
+            except pyscreeze.ImageNotFoundException:
+                pass
+
+    entry = {'screen': f"{width}x{height}", 'templates': count, 'search': 'pyscreeze',
+             'cold': measure(locate_all, repeat)}
+    print(f"locate {width}x{height} templates={count} search=pyscreeze: {entry['cold']['median_ms']} ms")
+    return [entry]
+
+
+def bench_capture(repeat):
+    """Real screen grabs (needs a display, e.g. Xvfb)"""
+    if not os.environ.get('DISPLAY'):
+        print("capture: skipped (no DISPLAY)")
+        return {'skipped': 'no DISPLAY'}
+    screen = default_capture()
+    legacy = ScreenCapture('pyautogui')
+    frame = screen.grab()
+    result = {'screen': f"{frame.shape[1]}x{frame.shape[0]}", 'backend': screen.active_backend(),
+              'grab': measure(screen.grab, repeat),
+              'grab_gray': measure(lambda: screen.grab(grayscale=True), repeat),
+              'grab_region': measure(lambda: screen.grab((0, 0, 400, 300)), repeat),
+              'grab_pyautogui': measure(legacy.grab, repeat)}
+    print(f"capture {result['screen']} ({result['backend']}): {result['grab']['median_ms']} ms, "
+          f"pyautogui {result['grab_pyautogui']['median_ms']} ms")
+    return result
+
+
+def load_app():
+    """Import the Flask app with in-memory state and without starting any background services"""
+    os.environ.setdefault('STATE_BACKEND', 'memory')
+    os.environ['BACKGROUND_DETECTION'] = '0'
+    import app
+    return app
+
+
+def bench_dispatch(app_module, sessions, commands_per_session):
+    """send-command -> get-commands round trips through the Flask test client"""
+    client = app_module.app.test_client()
+    session_ids = [f"bench_{index}" for index in range(sessions)]
+    for session_id in session_ids:
+        client.post('/api/register-client', json={'session_id': session_id, 'client_type': 'benchmark'})
+
+    round_trips = []
+    started = time.perf_counter()
+    for _ in range(commands_per_session):
+        for session_id in session_ids:
+            sent = time.perf_counter()
+            client.post('/api/send-command', json={'session_id': session_id, 'action': 'click_coordinates',
+                                                   'x': 10, 'y': 10})
+            response = client.get(f"/api/get-commands/{session_id}")
+            if len(response.get_json()['commands']) != 1:
+                raise RuntimeError(f"Command for {session_id} was not delivered")
+            round_trips.append((time.perf_counter() - sent) * 1000)
+    elapsed = time.perf_counter() - started
+
+    batch_started = time.perf_counter()
+    for session_id in session_ids:
+        client.post('/api/send-commands', json={
+            'session_id': session_id,
+            'commands': [{'action': 'click_coordinates', 'x': 10, 'y': 10}] * commands_per_session})
+        client.get(f"/api/get-commands/{session_id}")
+    batch_elapsed = time.perf_counter() - batch_started
+
+    for session_id in session_ids:
+        app_module.command_queue.remove_client(session_id)
+
+    round_trips.sort()
+    total = sessions * commands_per_session
+    result = {
+        'sessions': sessions,
+        'commands': total,
+        'round_trips_per_s': round(total / elapsed, 1),
+        'round_trip_median_ms': round(statistics.median(round_trips), 3),
+        'round_trip_p95_ms': round(round_trips[int(len(round_trips) * 0.95) - 1], 3),
+        'batched_commands_per_s': round(total / batch_elapsed, 1)
+    }
+    print(f"dispatch {sessions} sessions x {commands_per_session}: {result['round_trips_per_s']} round trips/s, "
+          f"{result['batched_commands_per_s']} commands/s batched")
+    return result
+
+
+def bench_console_logs(app_module, requests_count, batch_size):
+    """/api/console-logs request throughput and the writer's time to drain everything to disk"""
+    client = app_module.app.test_client()
+    logs = [{'level': 'log', 'message': f"benchmark message {index} " + 'x' * 80,
+             'timestamp': datetime.now().isoformat()} for index in range(batch_size)]
+    before = app_module.console_logger.stats()
+
+    started = time.perf_counter()
+    for index in range(requests_count):
+        client.post('/api/console-logs', json={'sessionId': f"bench_{index % 10}", 'logs': logs})
+    elapsed = time.perf_counter() - started
+    app_module.console_logger.close()
+    drained = time.perf_counter() - started
+
+    after = app_module.console_logger.stats()
+    accepted = after['enqueued'] - before['enqueued']
+    result = {
+        'requests': requests_count,
+        'batch_size': batch_size,
+        'requests_per_s': round(requests_count / elapsed, 1),
+        'entries_per_s': round(accepted / elapsed, 1),
+        'accepted': accepted,
+        'dropped': after['dropped'] - before['dropped'],
+        'written': after['written'] - before['written'],
+        'drain_s': round(drained, 3)
+    }
+    print(f"console-logs {requests_count} x {batch_size}: {result['requests_per_s']} req/s, "
+          f"{result['entries_per_s']} entries/s, {result['dropped']} dropped, drained in {result['drain_s']} s")
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__
+    }
+
+
+def flatten(results, prefix=''):
+    """Numeric leaves keyed by path, so two runs can be compared value by value"""
+    values = {}
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        # Locate entries are keyed by what they measured rather than by position
+        items = ((f"{item.get('screen')}/{item.get('templates')}/{item.get('search')}/{item.get('workers', 1)}"
+                  if isinstance(item, dict) and 'search' in item else str(index), item)
+                 for index, item in enumerate(results))
+    else:
+        return {prefix: results} if isinstance(results, (int, float)) and not isinstance(results, bool) else {}
+    for key, value in items:
+        values.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    return values
+
+
+def compare(current, baseline_path):
+    """Print per-metric change against an earlier run"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    old = flatten(baseline.get('results', {}))
+    new = flatten(current['results'])
+    print(f"\nCompared with {baseline_path} ({baseline.get('environment', {}).get('commit')}):")
+    for key in sorted(set(old) & set(new)):
+        if key.rsplit('.', 1)[-1] in PARAMETERS or not old[key]:
+            continue
+        change = (new[key] - old[key]) / old[key] * 100
+        print(f"  {key}: {old[key]} -> {new[key]} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument('--output', help='Write JSON results to this file (default: stdout)')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against')
+    parser.add_argument('--quick', action='store_true', help='Fewer screen sizes, templates and iterations')
+    parser.add_argument('--capture', action='store_true', help='Also time real screen grabs (needs DISPLAY)')
+    parser.add_argument('--workers', default=f"1,{default_workers()}",
+                        help='Comma-separated match worker counts to compare (default: 1 and MATCH_WORKERS/cores)')
+    parser.add_argument('--only', choices=['locate', 'dispatch', 'console_logs'], action='append',
+                        help='Run only these benchmarks (repeatable)')
+    args = parser.parse_args()
+
+    selected = set(args.only or ['locate', 'dispatch', 'console_logs'])
+    repeat = 3 if args.quick else 7
+    workdir = tempfile.mkdtemp(prefix='haccser_bench_')
+    cwd = os.getcwd()
+    results = {}
+    try:
+        # The app writes logs/ and data/ relative to the working directory
+        os.chdir(workdir)
+        if 'locate' in selected:
+            results['locate'] = bench_locate(QUICK_SCREEN_SIZES if args.quick else SCREEN_SIZES,
+                                             QUICK_TEMPLATE_COUNTS if args.quick else TEMPLATE_COUNTS,
+                                             repeat, workdir,
+                                             sorted({int(value) for value in args.workers.split(',')}))
+        if args.capture:
+            results['capture'] = bench_capture(repeat)
+        if selected & {'dispatch', 'console_logs'}:
+            app_module = load_app()
+            if 'dispatch' in selected:
+                results['dispatch'] = bench_dispatch(app_module, 10 if args.quick else 50,
+                                                     10 if args.quick else 40)
+            if 'console_logs' in selected:
+                results['console_logs'] = bench_console_logs(app_module, 50 if args.quick else 200, 50)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+"""
+Command queue
+Thread-safe client registry, per-session bounded command queues and result storage
+
+CommandQueueBackend is the interface the web tier talks to. CommandQueue keeps everything
+in process memory; sqlite_queue.SQLiteCommandQueue shares state between worker processes.
+Use create_command_queue() to pick one from a STATE_BACKEND style URL.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+OVERFLOW_POLICIES = ('reject', 'drop_oldest')
+
+
+class QueueFull(Exception):
+    """Raised when a session's queue is full and the overflow policy is 'reject'"""
+
+
+class UnknownClient(Exception):
+    """Raised when a command targets a session that is not registered"""
+
+
+class _Session:
+    """Pending commands for one client, guarded by its own condition"""
+
+    def __init__(self, info):
+        self.info = info
+        self.last_seen = time.monotonic()
+        self.pending = deque()
+        self.condition = threading.Condition()
+
+
+class CommandQueueBackend:
+    """Interface shared by the in-memory and SQLite command queue backends"""
+
+    def register_client(self, session_id, client_type, group=None, tags=None):
+        raise NotImplementedError
+
+    def touch(self, session_id):
+        raise NotImplementedError
+
+    def is_connected(self, session_id):
+        raise NotImplementedError
+
+    def clients(self):
+        raise NotImplementedError
+
+    def remove_client(self, session_id, reason='removed'):
+        raise NotImplementedError
+
+    def enqueue(self, session_id, command):
+        raise NotImplementedError
+
+    def enqueue_many(self, session_id, commands):
+        raise NotImplementedError
+
+    def enqueue_broadcast(self, broadcast_id, session_ids, command):
+        raise NotImplementedError
+
+    def get_broadcast(self, broadcast_id):
+        raise NotImplementedError
+
+    def take(self, session_id, wait=0):
+        raise NotImplementedError
+
+    def depth(self, session_id):
+        raise NotImplementedError
+
+    def record_result(self, command_id, result):
+        raise NotImplementedError
+
+    def get_result(self, command_id):
+        raise NotImplementedError
+
+    def get_results(self, command_ids):
+        raise NotImplementedError
+
+    def results(self):
+        raise NotImplementedError
+
+    def reap(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def add_listener(self, callback):
+        """Call callback(event_type, data) when a client connects ('client_connected') or is
+        removed or reaped ('client_disconnected')"""
+        self._listeners.append(callback)
+
+    def _emit(self, event_type, data):
+        for callback in self._listeners:
+            try:
+                callback(event_type, data)
+            except Exception as e:
+                print(f"Command queue listener error: {e}")
+
+    def start_reaper(self, interval=30):
+        """Run reap() every interval seconds in a daemon thread"""
+        if getattr(self, '_reaper', None) is not None and self._reaper.is_alive():
+            return self._reaper
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reap()
+                except Exception as e:
+                    print(f"Command queue reaper error: {e}")
+
+        self._reaper = threading.Thread(target=run, name='command-queue-reaper', daemon=True)
+        self._reaper.start()
+        return self._reaper
+
+
+class CommandQueue(CommandQueueBackend):
+    """In-process command queue backend shared by the Flask request threads of one process"""
+
+    def __init__(self, max_pending=100, overflow='reject', result_ttl=3600, max_results=10000,
+                 client_ttl=120):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self.client_ttl = client_ttl
+
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._ids_lock = threading.Lock()
+        self._results = OrderedDict()
+        self._results_lock = threading.Lock()
+        self._broadcasts = OrderedDict()
+        self._counters = {'enqueued': 0, 'delivered': 0, 'rejected': 0, 'dropped': 0,
+                          'results': 0, 'results_evicted': 0, 'clients_reaped': 0, 'broadcasts': 0}
+        self._counters_lock = threading.Lock()
+        self._reaper = None
+        self._listeners = []
+
+    # Client registry
+
+    def register_client(self, session_id, client_type, group=None, tags=None):
+        """Register (or re-register) a client, keeping any commands already queued for it"""
+        now = datetime.now().isoformat()
+        with self._sessions_lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session({'type': client_type, 'connected_at': now})
+            session.info['type'] = client_type
+            session.info['group'] = group
+            session.info['tags'] = sorted(tags or [])
+            session.info['last_seen'] = now
+            session.last_seen = time.monotonic()
+            info = dict(session.info)
+        self._emit('client_connected', {'session_id': session_id, 'client': info})
+        return session.info
+
+    def touch(self, session_id):
+        """Record that a client has just been seen; returns False if it is not registered"""
+        session = self._get(session_id)
+        if session is None:
+            return False
+        session.last_seen = time.monotonic()
+        session.info['last_seen'] = datetime.now().isoformat()
+        return True
+
+    def is_connected(self, session_id):
+        return self._get(session_id) is not None
+
+    def clients(self):
+        """Snapshot of session_id -> client info"""
+        with self._sessions_lock:
+            return {session_id: dict(session.info) for session_id, session in self._sessions.items()}
+
+    def remove_client(self, session_id, reason='removed'):
+        with self._sessions_lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            # Release any long-poll waiting on this session
+            with session.condition:
+                session.condition.notify_all()
+            self._emit('client_disconnected', {'session_id': session_id, 'reason': reason})
+        return session is not None
+
+    # Commands
+
+    def next_id(self):
+        """Globally unique, monotonically increasing command ID"""
+        with self._ids_lock:
+            return next(self._ids)
+
+    def enqueue(self, session_id, command):
+        """Queue a command for a client, assigning its ID; returns the ID"""
+        session = self._get(session_id)
+        if session is None:
+            raise UnknownClient(session_id)
+        self._push(session_id, session, command)
+        self._count('enqueued')
+        return command['id']
+
+    def _push(self, session_id, session, command):
+        with session.condition:
+            if len(session.pending) >= self.max_pending:
+                if self.overflow == 'reject':
+                    self._count('rejected')
+                    raise QueueFull(f"Command queue for {session_id} is full ({self.max_pending} pending)")
+                session.pending.popleft()
+                self._count('dropped')
+
+            command['id'] = self.next_id()
+            session.pending.append(command)
+            # Wake up a long-polling client immediately
+            session.condition.notify_all()
+
+    def enqueue_many(self, session_id, commands):
+        """Queue an ordered batch atomically (all or nothing under 'reject'); returns the IDs"""
+        session = self._get(session_id)
+        if session is None:
+            raise UnknownClient(session_id)
+
+        with session.condition:
+            overflow = len(session.pending) + len(commands) - self.max_pending
+            if overflow > 0:
+                if self.overflow == 'reject' or len(commands) > self.max_pending:
+                    self._count('rejected', len(commands))
+                    raise QueueFull(f"Command queue for {session_id} cannot take {len(commands)} more "
+                                    f"commands ({len(session.pending)}/{self.max_pending} pending)")
+                for _ in range(overflow):
+                    session.pending.popleft()
+                self._count('dropped', overflow)
+
+            ids = []
+            for command in commands:
+                command['id'] = self.next_id()
+                session.pending.append(command)
+                ids.append(command['id'])
+            session.condition.notify_all()
+
+        self._count('enqueued', len(ids))
+        return ids
+
+    def enqueue_broadcast(self, broadcast_id, session_ids, command):
+        """Queue a copy of command for every session in one call
+
+        Returns (queued {session_id: command_id}, failed {session_id: reason}); a full or
+        unknown session does not stop the others. The broadcast is kept for get_broadcast().
+        """
+        queued, failed = {}, {}
+        with self._sessions_lock:
+            sessions = [(session_id, self._sessions.get(session_id)) for session_id in session_ids]
+        for session_id, session in sessions:
+            if session is None:
+                failed[session_id] = 'Client not connected'
+                continue
+            copy = dict(command, broadcast_id=broadcast_id)
+            try:
+                self._push(session_id, session, copy)
+            except QueueFull as e:
+                failed[session_id] = str(e)
+                continue
+            queued[session_id] = copy['id']
+
+        with self._results_lock:
+            self._broadcasts[broadcast_id] = (time.monotonic(), {
+                'broadcast_id': broadcast_id,
+                'action': command.get('action'),
+                'created_at': datetime.now().isoformat(),
+                'queued': queued,
+                'failed': failed
+            })
+            while len(self._broadcasts) > self.max_results:
+                self._broadcasts.popitem(last=False)
+        self._count('enqueued', len(queued))
+        self._count('broadcasts')
+        return queued, failed
+
+    def get_broadcast(self, broadcast_id):
+        with self._results_lock:
+            entry = self._broadcasts.get(broadcast_id)
+        return entry[1] if entry is not None else None
+
+    def take(self, session_id, wait=0):
+        """Remove and return all pending commands, optionally blocking up to wait seconds for one"""
+        session = self._get(session_id)
+        if session is None:
+            return []
+
+        with session.condition:
+            if wait > 0 and not session.pending:
+                session.condition.wait_for(lambda: session.pending or not self.is_connected(session_id),
+                                           timeout=wait)
+            commands = list(session.pending)
+            session.pending.clear()
+
+        if commands:
+            self._count('delivered', len(commands))
+        return commands
+
+    def depth(self, session_id):
+        session = self._get(session_id)
+        return len(session.pending) if session is not None else 0
+
+    # Results
+
+    def record_result(self, command_id, result):
+        with self._results_lock:
+            self._results.pop(command_id, None)
+            self._results[command_id] = (time.monotonic(), result)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+                self._count('results_evicted')
+        self._count('results')
+
+    def get_result(self, command_id):
+        with self._results_lock:
+            entry = self._results.get(command_id)
+        return entry[1] if entry is not None else None
+
+    def get_results(self, command_ids):
+        """{command_id: result} for the IDs that have a result"""
+        with self._results_lock:
+            entries = {command_id: self._results.get(command_id) for command_id in command_ids}
+        return {command_id: entry[1] for command_id, entry in entries.items() if entry is not None}
+
+    def results(self):
+        with self._results_lock:
+            return {command_id: result for command_id, (_, result) in self._results.items()}
+
+    # Housekeeping
+
+    def reap(self):
+        """Drop stale clients and expired results; returns (clients_reaped, results_evicted)"""
+        now = time.monotonic()
+
+        stale = []
+        with self._sessions_lock:
+            for session_id, session in list(self._sessions.items()):
+                if now - session.last_seen > self.client_ttl:
+                    stale.append(session_id)
+        for session_id in stale:
+            if self.remove_client(session_id, reason='timeout'):
+                print(f"Client reaped (not seen for {self.client_ttl}s): {session_id}")
+        if stale:
+            self._count('clients_reaped', len(stale))
+
+        evicted = 0
+        with self._results_lock:
+            while self._results:
+                command_id, (stored_at, _) = next(iter(self._results.items()))
+                if now - stored_at <= self.result_ttl:
+                    break
+                self._results.popitem(last=False)
+                evicted += 1
+            while self._broadcasts:
+                stored_at, _ = next(iter(self._broadcasts.values()))
+                if now - stored_at <= self.result_ttl:
+                    break
+                self._broadcasts.popitem(last=False)
+        if evicted:
+            self._count('results_evicted', evicted)
+
+        return len(stale), evicted
+
+    def stats(self):
+        with self._counters_lock:
+            counters = dict(self._counters)
+        with self._sessions_lock:
+            depths = {session_id: len(session.pending) for session_id, session in self._sessions.items()}
+        with self._results_lock:
+            stored = len(self._results)
+            broadcasts = len(self._broadcasts)
+        counters.update({
+            'clients': len(depths),
+            'pending': sum(depths.values()),
+            'queue_depths': depths,
+            'stored_results': stored,
+            'stored_broadcasts': broadcasts,
+            'max_pending': self.max_pending,
+            'overflow': self.overflow
+        })
+        return counters
+
+    def _get(self, session_id):
+        with self._sessions_lock:
+            return self._sessions.get(session_id)
+
+    def _count(self, counter, amount=1):
+        with self._counters_lock:
+            self._counters[counter] += amount
+
+
+def create_command_queue(url='memory', **options):
+    """Create a backend from a URL: 'memory' or 'sqlite:///path/to/state.db'"""
+    if not url or url == 'memory':
+        return CommandQueue(**options)
+    if url.startswith('sqlite:///'):
+        from sqlite_queue import SQLiteCommandQueue
+        return SQLiteCommandQueue(url[len('sqlite:///'):], **options)
+    raise ValueError(f"Unknown state backend: {url}")
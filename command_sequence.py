@@ -0,0 +1,184 @@
+"""
+Command sequences
+Multi-step automations a local client validates once and then runs without going back to the server
+
+A sequence is a list of steps:
+  {"action": "wait_for_image", "image_name": "button", "timeout": 10, "interval": 0.25}
+  {"action": "click_image", "image_name": "button", "timeout": 0}
+  {"action": "click_coordinates", "x": 100, "y": 200}
+  {"action": "type_text", "text": "hello"}
+  {"action": "sleep", "seconds": 0.5}
+  {"action": "if_image", "image_name": "dialog", "timeout": 0, "then": [...], "else": [...]}
+
+Every step also accepts "retries" (extra attempts after a failure), "retry_delay" (seconds) and
+"optional" (a failure is recorded but the sequence carries on). Image steps accept a "region",
+type_text a "text_mode" (see action_timing).
+"""
+
+import time
+
+from action_timing import validate_text_mode
+from screen_region import normalize_region
+
+STEP_ACTIONS = ('wait_for_image', 'click_image', 'click_coordinates', 'type_text', 'sleep', 'if_image')
+IMAGE_ACTIONS = ('wait_for_image', 'click_image', 'if_image')
+MAX_STEPS = 200
+MAX_DEPTH = 5
+MAX_RETRIES = 10
+DEFAULT_WAIT_TIMEOUT = 10.0
+DEFAULT_POLL_INTERVAL = 0.25
+
+
+def _number(step, field, default, minimum=0.0):
+    value = step.get(field, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{step.get('action')}: {field} must be a number")
+    if value < minimum:
+        raise ValueError(f"{step.get('action')}: {field} must be at least {minimum}")
+    return value
+
+
+def compile_sequence(steps, images=None, _depth=0, _count=None):
+    """Validate a sequence and return it normalised, raising ValueError before anything runs
+
+    images, when given, is the set of template names the runner knows; unknown names are rejected.
+    """
+    count = _count if _count is not None else [0]
+    if not isinstance(steps, list) or (not steps and _depth == 0):
+        raise ValueError("steps must be a non-empty list")
+    if _depth > MAX_DEPTH:
+        raise ValueError(f"if_image branches are nested more than {MAX_DEPTH} deep")
+
+    compiled = []
+    for step in steps:
+        count[0] += 1
+        if count[0] > MAX_STEPS:
+            raise ValueError(f"a sequence may have at most {MAX_STEPS} steps")
+        if not isinstance(step, dict):
+            raise ValueError("each step must be an object")
+        action = step.get('action')
+        if action not in STEP_ACTIONS:
+            raise ValueError(f"unknown step action: {action!r}")
+
+        retries = int(_number(step, 'retries', 0))
+        if retries > MAX_RETRIES:
+            raise ValueError(f"{action}: retries must be at most {MAX_RETRIES}")
+        item = {
+            'action': action,
+            'retries': retries,
+            'retry_delay': _number(step, 'retry_delay', 0.5),
+            'optional': bool(step.get('optional', False))
+        }
+
+        if action in IMAGE_ACTIONS:
+            image_name = step.get('image_name')
+            if not image_name:
+                raise ValueError(f"{action}: image_name is required")
+            if images is not None and image_name not in images:
+                raise ValueError(f"{action}: unknown image {image_name!r}")
+            item['image_name'] = image_name
+            item['region'] = normalize_region(step.get('region'))
+            default_timeout = DEFAULT_WAIT_TIMEOUT if action == 'wait_for_image' else 0.0
+            item['timeout'] = _number(step, 'timeout', default_timeout)
+            item['interval'] = _number(step, 'interval', DEFAULT_POLL_INTERVAL, minimum=0.01)
+        if action == 'click_coordinates':
+            try:
+                item['x'], item['y'] = int(step['x']), int(step['y'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("click_coordinates: x and y must be integers")
+        elif action == 'type_text':
+            if not isinstance(step.get('text'), str):
+                raise ValueError("type_text: text must be a string")
+            item['text'] = step['text']
+            item['text_mode'] = validate_text_mode(step.get('text_mode'))
+        elif action == 'sleep':
+            item['seconds'] = _number(step, 'seconds', 0.0)
+        elif action == 'if_image':
+            item['then'] = compile_sequence(step.get('then', []), images, _depth + 1, count)
+            item['else'] = compile_sequence(step.get('else', []), images, _depth + 1, count)
+        compiled.append(item)
+    return compiled
+
+
+class SequenceRunner:
+    """Runs a compiled sequence against an executor providing locate(image_name, region),
+    click(x, y) and type_text(text, mode); locate returns a Match (or anything with .center) or None
+    """
+
+    def __init__(self, executor, clock=time.monotonic, sleep=time.sleep):
+        self.executor = executor
+        self.clock = clock
+        self.sleep = sleep
+
+    def run(self, steps):
+        """Run every step in order; returns (success, message, progress)"""
+        progress = []
+        success, message = self._run_steps(steps, '', progress)
+        return success, message or f"{len(progress)} steps completed", progress
+
+    def _run_steps(self, steps, prefix, progress):
+        for index, step in enumerate(steps, start=1):
+            label = f"{prefix}{index}"
+            started = self.clock()
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    ok, detail = self._run_step(step, label, progress)
+                except Exception as e:
+                    ok, detail = False, f"error: {e}"
+                if ok or attempts > step['retries']:
+                    break
+                self.sleep(step['retry_delay'])
+
+            progress.append({
+                'step': label,
+                'action': step['action'],
+                'success': ok,
+                'attempts': attempts,
+                'ms': round((self.clock() - started) * 1000, 1),
+                'detail': detail
+            })
+            if not ok and not step['optional']:
+                return False, f"Step {label} ({step['action']}) failed: {detail}"
+        return True, None
+
+    def _wait_for(self, step):
+        # Poll until the image shows up or the step's timeout passes (a timeout of 0 checks once)
+        deadline = self.clock() + step['timeout']
+        while True:
+            match = self.executor.locate(step['image_name'], step['region'])
+            if match is not None or self.clock() + step['interval'] > deadline:
+                return match
+            self.sleep(step['interval'])
+
+    def _run_step(self, step, label, progress):
+        action = step['action']
+        if action == 'wait_for_image':
+            match = self._wait_for(step)
+            if match is None:
+                return False, f"{step['image_name']} not found within {step['timeout']}s"
+            return True, f"{step['image_name']} at ({match.center.x}, {match.center.y})"
+        if action == 'click_image':
+            match = self._wait_for(step)
+            if match is None:
+                return False, f"{step['image_name']} not found"
+            self.executor.click(match.center.x, match.center.y)
+            return True, f"clicked {step['image_name']} at ({match.center.x}, {match.center.y})"
+        if action == 'click_coordinates':
+            self.executor.click(step['x'], step['y'])
+            return True, f"clicked ({step['x']}, {step['y']})"
+        if action == 'type_text':
+            mode = self.executor.type_text(step['text'], step.get('text_mode'))
+            return True, f"typed {len(step['text'])} characters" + (f" ({mode})" if mode else '')
+        if action == 'sleep':
+            self.sleep(step['seconds'])
+            return True, f"slept {step['seconds']}s"
+        # if_image: the step succeeds when the branch it takes succeeds
+        found = self._wait_for(step) is not None
+        branch = 'then' if found else 'else'
+        ok, message = self._run_steps(step[branch], f"{label}.{branch}.", progress)
+        return ok, f"{step['image_name']} {'found' if found else 'not found'}, ran {branch}" + (
+            f" ({message})" if message else '')
@@ -0,0 +1,226 @@
+"""
+Detection scheduler
+Per-template poll intervals, priorities and backoff for background image detection, plus the
+shared template configuration file that lets the image set change at runtime
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_MIN_INTERVAL = 0.5
+DEFAULT_MAX_INTERVAL = 30.0
+DEFAULT_BACKOFF = 1.5
+
+
+class TemplateSchedule:
+    """Scheduling state for one template"""
+
+    def __init__(self, name, priority=0, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL):
+        self.name = name
+        self.priority = priority
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_due = 0.0
+        self.checks = 0
+        self.hits = 0
+        self.errors = 0
+        self.consecutive_misses = 0
+        self.last_checked = None
+        self.last_hit = None
+        # Set when the screen changed while this template was not being checked, so its next
+        # check cannot rely on the change detector's dirty regions
+        self.needs_full = True
+
+    def to_dict(self, now):
+        return {
+            'priority': self.priority,
+            'interval': round(self.interval, 3),
+            'min_interval': self.min_interval,
+            'max_interval': self.max_interval,
+            'due_in': round(max(0.0, self.next_due - now), 3),
+            'checks': self.checks,
+            'hits': self.hits,
+            'errors': self.errors,
+            'consecutive_misses': self.consecutive_misses,
+            'last_checked': self.last_checked,
+            'last_hit': self.last_hit
+        }
+
+
+class DetectionScheduler:
+    """Decides which templates are due each cycle
+
+    A hit resets a template to its minimum interval; every miss (or error) multiplies the
+    interval by backoff up to its maximum. Due templates are returned highest priority first.
+    """
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 backoff=DEFAULT_BACKOFF, max_per_cycle=None):
+        if min_interval <= 0 or max_interval < min_interval or backoff < 1:
+            raise ValueError("need 0 < min_interval <= max_interval and backoff >= 1")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_per_cycle = max_per_cycle
+
+        self._schedules = {}
+        self._lock = threading.Lock()
+
+    def sync(self, settings):
+        """Match the scheduled templates to {name: {priority, min_interval, max_interval}}"""
+        with self._lock:
+            for name in list(self._schedules):
+                if name not in settings:
+                    del self._schedules[name]
+            for name, options in settings.items():
+                options = options or {}
+                min_interval = float(options.get('min_interval') or self.min_interval)
+                max_interval = max(min_interval, float(options.get('max_interval') or self.max_interval))
+                priority = int(options.get('priority') or 0)
+                schedule = self._schedules.get(name)
+                if schedule is None:
+                    self._schedules[name] = TemplateSchedule(name, priority, min_interval, max_interval)
+                    continue
+                schedule.priority = priority
+                schedule.min_interval = min_interval
+                schedule.max_interval = max_interval
+                schedule.interval = min(max(schedule.interval, min_interval), max_interval)
+                schedule.next_due = min(schedule.next_due, (schedule.last_checked or 0.0) + schedule.interval)
+
+    def names(self):
+        with self._lock:
+            return list(self._schedules)
+
+    def due(self, now=None):
+        """Names due for a check, highest priority (then most overdue) first"""
+        now = time.time() if now is None else now
+        with self._lock:
+            due = [schedule for schedule in self._schedules.values() if schedule.next_due <= now]
+        due.sort(key=lambda schedule: (-schedule.priority, schedule.next_due))
+        if self.max_per_cycle:
+            due = due[:self.max_per_cycle]
+        return [schedule.name for schedule in due]
+
+    def needs_full(self, name):
+        with self._lock:
+            schedule = self._schedules.get(name)
+            return schedule is None or schedule.needs_full
+
+    def screen_changed(self, checked):
+        """The screen changed this cycle: templates not checked lose their dirty-region shortcut"""
+        checked = set(checked)
+        with self._lock:
+            for name, schedule in self._schedules.items():
+                if name not in checked:
+                    schedule.needs_full = True
+
+    def record(self, name, found, now=None):
+        """Reschedule after a check: soon after a hit, further out after each miss"""
+        now = time.time() if now is None else now
+        with self._lock:
+            schedule = self._schedules.get(name)
+            if schedule is None:
+                return
+            schedule.checks += 1
+            schedule.last_checked = now
+            schedule.needs_full = False
+            if found:
+                schedule.hits += 1
+                schedule.last_hit = now
+                schedule.consecutive_misses = 0
+                schedule.interval = schedule.min_interval
+            else:
+                schedule.consecutive_misses += 1
+                schedule.interval = min(schedule.max_interval, schedule.interval * self.backoff)
+            schedule.next_due = now + schedule.interval
+
+    def record_error(self, name, now=None):
+        """Back off a template whose check failed, without forgetting it needs a full scan"""
+        now = time.time() if now is None else now
+        with self._lock:
+            schedule = self._schedules.get(name)
+            if schedule is None:
+                return
+            schedule.errors += 1
+            schedule.interval = min(schedule.max_interval, schedule.interval * self.backoff)
+            schedule.next_due = now + schedule.interval
+
+    def next_wakeup(self, now=None):
+        """Seconds until the next template is due (None when nothing is scheduled)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if not self._schedules:
+                return None
+            return max(0.0, min(schedule.next_due for schedule in self._schedules.values()) - now)
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            return {name: schedule.to_dict(now) for name, schedule in self._schedules.items()}
+
+
+@contextmanager
+def _locked(path):
+    # Serialises read-modify-write of the config between worker processes where flock exists
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class TemplateConfig:
+    """Detection templates ({name: {path, priority, min_interval, max_interval}}) kept in a JSON file
+
+    Any worker process can change it; the process running detection notices the new mtime and
+    applies it on its next cycle, so templates change without a restart.
+    """
+
+    def __init__(self, path, defaults):
+        self.path = path
+        self.defaults = {name: {'path': image_path} for name, image_path in defaults.items()}
+        self._mtime = None
+        self._cached = None
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)['templates']
+        except FileNotFoundError:
+            return {name: dict(options) for name, options in self.defaults.items()}
+
+    def changed(self):
+        """Return the templates if the file changed since the last call, else None"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if self._cached is not None and mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        self._cached = self.load()
+        return self._cached
+
+    def update(self, mutate):
+        """Apply mutate(templates) under the file lock and save the result atomically"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with _locked(self.path):
+            templates = self.load()
+            mutate(templates)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'templates': templates}, f, indent=2)
+            os.replace(tmp_path, self.path)
+        return templates
@@ -0,0 +1,144 @@
+"""
+Event stream
+Ordered log of client connect/disconnect events and command results that browsers follow over
+server-sent events instead of polling
+
+Every event gets an increasing integer ID. A stream reads the events after the last ID it sent,
+so a reconnecting EventSource resumes from its Last-Event-ID without missing anything that is
+still retained. Use create_event_log() with the same STATE_BACKEND style URL as the command queue.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+def format_event(event_id, event_type, data):
+    """Encode one event in the text/event-stream wire format"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class EventLog:
+    """Interface shared by the in-memory and SQLite event logs"""
+
+    def publish(self, event_type, data):
+        raise NotImplementedError
+
+    def read(self, after_id, timeout=0):
+        """Events with an ID above after_id as [(id, type, data)], waiting up to timeout for one"""
+        raise NotImplementedError
+
+    def last_id(self):
+        raise NotImplementedError
+
+
+class MemoryEventLog(EventLog):
+    """Bounded in-process event log; readers block on a condition until an event is published"""
+
+    def __init__(self, max_events=1000):
+        self._events = deque(maxlen=max_events)
+        self._last_id = 0
+        self._condition = threading.Condition()
+
+    def publish(self, event_type, data):
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, event_type, data))
+            self._condition.notify_all()
+            return self._last_id
+
+    def read(self, after_id, timeout=0):
+        with self._condition:
+            if timeout > 0 and self._last_id <= after_id:
+                self._condition.wait_for(lambda: self._last_id > after_id, timeout=timeout)
+            return [event for event in self._events if event[0] > after_id]
+
+    def last_id(self):
+        with self._condition:
+            return self._last_id
+
+
+class SQLiteEventLog(EventLog):
+    """Event log in a SQLite table so a stream served by one worker sees events from all of them
+
+    Readers are woken instantly by events published in the same process and otherwise notice
+    events from other processes within poll_interval seconds.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path, max_events=1000, poll_interval=0.25):
+        self.path = path
+        self.max_events = max_events
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('PRAGMA busy_timeout=30000')
+            self._local.db = db
+        return db
+
+    def publish(self, event_type, data):
+        db = self._connect()
+        event_id = db.execute('INSERT INTO events (type, data, created_at) VALUES (?, ?, ?)',
+                              (event_type, json.dumps(data), time.time())).lastrowid
+        # Prune in steps rather than on every insert
+        if event_id % 100 == 0:
+            db.execute('DELETE FROM events WHERE id <= ?', (event_id - self.max_events,))
+        with self._wakeup:
+            self._wakeup.notify_all()
+        return event_id
+
+    def _read_now(self, after_id):
+        rows = self._connect().execute('SELECT id, type, data FROM events WHERE id > ? ORDER BY id',
+                                       (after_id,)).fetchall()
+        return [(event_id, event_type, json.loads(data)) for event_id, event_type, data in rows]
+
+    def read(self, after_id, timeout=0):
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self._read_now(after_id)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            with self._wakeup:
+                self._wakeup.wait(min(self.poll_interval, remaining))
+
+    def last_id(self):
+        row = self._connect().execute('SELECT MAX(id) FROM events').fetchone()
+        return row[0] or 0
+
+
+def create_event_log(url='memory', **options):
+    """Create an event log from a URL: 'memory' or 'sqlite:///path/to/state.db'"""
+    if not url or url == 'memory':
+        return MemoryEventLog(**options)
+    if url.startswith('sqlite:///'):
+        return SQLiteEventLog(url[len('sqlite:///'):], **options)
+    raise ValueError(f"Unknown state backend: {url}")
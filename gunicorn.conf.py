@@ -0,0 +1,54 @@
+"""
+Gunicorn configuration for the production serving mode
+
+    STATE_BACKEND=sqlite:///data/state.db gunicorn -c gunicorn.conf.py app:app
+
+Every worker process shares clients, command queues and results through STATE_BACKEND,
+so requests can be spread across cores without losing commands. Background detection
+runs in exactly one worker at a time.
+
+Metrics are not shared: /metrics reports the worker that serves the scrape, labelled with
+worker="<pid>" (see metrics.py), so sum rates across workers in Prometheus.
+"""
+
+import math
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Processes x threads: long-polling clients hold a thread each while they wait
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count() * 2)))
+# The in-memory backend lives inside one process: more workers would each see different clients
+MEMORY_BACKEND = os.environ.get('STATE_BACKEND', 'memory') == 'memory'
+if MEMORY_BACKEND:
+    workers = 1
+worker_class = 'gthread'
+# Every waiting local client and every open browser tab holds a thread (see LONG_LIVED_REQUESTS
+# in app.py), so size the threads from the fleet: EXPECTED_CLIENTS spread over the workers plus
+# the threads app.py keeps in reserve for ordinary requests
+EXPECTED_CLIENTS = int(os.environ.get('EXPECTED_CLIENTS', 32))
+threads = int(os.environ.get('WEB_THREADS', max(16, math.ceil(EXPECTED_CLIENTS / workers) + 4)))
+# app.py derives its long-lived request budget from the same number
+os.environ['WEB_THREADS'] = str(threads)
+
+# Must outlive the longest get-commands long-poll (30s)
+timeout = 60
+graceful_timeout = 30
+keepalive = 75
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    # Threads, the display and PyAutoGUI are only created after the fork, inside each worker;
+    # the detection thread is guarded by a file lock so exactly one worker runs it
+    from app import start_services
+    start_services()
+
+
+def on_starting(server):
+    if MEMORY_BACKEND:
+        server.log.warning("STATE_BACKEND is 'memory': running a single worker; set "
+                           "STATE_BACKEND=sqlite:///data/state.db to use more")
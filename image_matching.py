@@ -0,0 +1,455 @@
+"""
+Image matching engine
+Captures the screen once per cycle and matches every template against that single frame
+"""
+
+import math
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from match_pool import MatchPool, match_template_tiled
+from screen_capture import default_capture
+from screen_region import normalize_region, pad_box
+
+DEFAULT_CONFIDENCE = 0.9
+
+# Speed/accuracy presets for the coarse-to-fine search:
+#   downscale  - size of the coarse level relative to the screen (1.0 = plain full-resolution search)
+#   candidates - how many coarse peaks are refined at full resolution
+SEARCH_PROFILES = {
+    'exact': {'downscale': 1.0, 'candidates': 1},
+    'balanced': {'downscale': 0.5, 'candidates': 5},
+    'fast': {'downscale': 0.25, 'candidates': 3}
+}
+DEFAULT_SEARCH = 'balanced'
+
+# Template scale factors tried to absorb small DPI differences between capture and screen.
+# The best hit on this grid is refined halfway to its neighbours (see refine_scale), so 5%
+# differences are found without searching the whole frame at every 5% step.
+DEFAULT_SCALES = (1.0, 0.9, 1.1)
+
+# Extra pixels searched around a template's last hit before falling back to a full scan
+ROI_PADDING = 48
+
+# Smallest template side (in coarse pixels) that still matches reliably
+MIN_COARSE_TEMPLATE = 12
+
+
+Point = namedtuple('Point', ['x', 'y'])
+Box = namedtuple('Box', ['left', 'top', 'width', 'height'])
+
+
+class Match(namedtuple('Match', ['name', 'left', 'top', 'width', 'height', 'score', 'scale'],
+                       defaults=(1.0,))):
+    """A template hit on the captured frame"""
+    __slots__ = ()
+
+    @property
+    def center(self):
+        return Point(self.left + self.width // 2, self.top + self.height // 2)
+
+    @property
+    def box(self):
+        return Box(self.left, self.top, self.width, self.height)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'left': self.left,
+            'top': self.top,
+            'width': self.width,
+            'height': self.height,
+            'score': round(self.score, 4),
+            'scale': self.scale
+        }
+
+
+class MatchResult:
+    """Result of matching a set of templates against one captured frame"""
+
+    def __init__(self, frame_size):
+        self.frame_size = frame_size
+        self.matches = {}
+        self.scores = {}
+        self.errors = {}
+        self.capture_time = 0.0
+        self.match_time = 0.0
+
+    def add(self, name, score, match=None):
+        self.scores[name] = score
+        if match is not None:
+            self.matches[name] = match
+
+    def merge(self, other):
+        """Fold in the result of matching other templates against the same frame"""
+        self.matches.update(other.matches)
+        self.scores.update(other.scores)
+        self.errors.update(other.errors)
+        self.capture_time += other.capture_time
+        self.match_time += other.match_time
+        return self
+
+    def get(self, name):
+        return self.matches.get(name)
+
+    def found(self, name):
+        return name in self.matches
+
+    def __iter__(self):
+        return iter(self.matches.values())
+
+    def __len__(self):
+        return len(self.matches)
+
+    def to_dict(self):
+        return {
+            'frame_size': {'width': self.frame_size[0], 'height': self.frame_size[1]},
+            'matches': [match.to_dict() for match in self.matches.values()],
+            'scores': {name: round(score, 4) for name, score in self.scores.items()},
+            'errors': self.errors,
+            'capture_ms': round(self.capture_time * 1000, 2),
+            'match_ms': round(self.match_time * 1000, 2)
+        }
+
+
+def grab_frame(region=None):
+    """Capture the whole screen (or a region) once as a new BGR NumPy array"""
+    return default_capture().grab(region, copy=True)
+
+
+def to_gray(image):
+    """Convert a BGR/BGRA image to grayscale (no-op for single channel arrays)"""
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def match_template(frame, template, confidence=DEFAULT_CONFIDENCE):
+    """Match one template against a frame, returning (score, (left, top)) of the best hit"""
+    frame_h, frame_w = frame.shape[:2]
+    tmpl_h, tmpl_w = template.shape[:2]
+    if tmpl_h > frame_h or tmpl_w > frame_w:
+        return 0.0, None
+
+    scores = cv2.matchTemplate(frame, template, cv2.TM_CCOEFF_NORMED)
+    _, score, _, location = cv2.minMaxLoc(scores)
+    if not np.isfinite(score):
+        return 0.0, None
+    if score < confidence:
+        return float(score), None
+    return float(score), location
+
+
+def find_peaks(scores, count, radius_x, radius_y):
+    """Return up to count (score, x, y) maxima of a score map, suppressing overlapping peaks"""
+    scores = np.nan_to_num(scores, nan=-1.0, posinf=-1.0, neginf=-1.0)
+    peaks = []
+    for _ in range(count):
+        _, value, _, (x, y) = cv2.minMaxLoc(scores)
+        if value <= -1.0:
+            break
+        peaks.append((float(value), x, y))
+        scores[max(0, y - radius_y):y + radius_y + 1, max(0, x - radius_x):x + radius_x + 1] = -1.0
+    return peaks
+
+
+class FramePyramid:
+    """A captured frame plus lazily built downscaled levels, shared by all templates"""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._levels = {1.0: frame}
+
+    @property
+    def size(self):
+        return (self.frame.shape[1], self.frame.shape[0])
+
+    def level(self, downscale):
+        image = self._levels.get(downscale)
+        if image is None:
+            image = cv2.resize(self.frame, None, fx=downscale, fy=downscale, interpolation=cv2.INTER_AREA)
+            self._levels[downscale] = image
+        return image
+
+
+def coarse_level(template, downscale, scales):
+    """Pick the coarsest usable level for a template, doubling up towards full resolution"""
+    smallest = min(template.width, template.height) * min(scales)
+    while downscale < 1.0 and smallest * downscale < MIN_COARSE_TEMPLATE:
+        downscale = min(1.0, downscale * 2)
+    return downscale
+
+
+def scale_step(scales):
+    """Half the smallest gap between the scales tried, i.e. the refinement step around a hit"""
+    ordered = sorted(set(scales))
+    if len(ordered) < 2:
+        return 0.0
+    return min(high - low for low, high in zip(ordered, ordered[1:])) / 2
+
+
+def refine_scale(frame, template, best, step, grayscale=True):
+    """Rematch a hit at scale +/- step inside a window around it, keeping whichever scores best
+
+    Between two grid scales the true scale can score under the confidence at both of them, so
+    this runs on the best grid hit before the threshold is applied.
+    """
+    score, box, scale = best
+    if box is None or step <= 0 or score >= 0.99:
+        return best
+    frame_h, frame_w = frame.shape[:2]
+    for candidate in (scale - step, scale + step):
+        if candidate <= 0:
+            continue
+        image = template.scaled(candidate, grayscale)
+        height, width = image.shape[:2]
+        pad = max(abs(width - box[2]), abs(height - box[3])) + 4
+        left = max(0, box[0] - pad)
+        top = max(0, box[1] - pad)
+        right = min(frame_w, box[0] + max(width, box[2]) + pad)
+        bottom = min(frame_h, box[1] + max(height, box[3]) + pad)
+        found, location = match_template(frame[top:bottom, left:right], image, -1.0)
+        if location is not None and found > best[0]:
+            best = (found, (left + location[0], top + location[1], width, height), round(candidate, 4))
+    return best
+
+
+def pyramid_locate(pyramid, template, confidence=DEFAULT_CONFIDENCE, search=DEFAULT_SEARCH,
+                   scales=DEFAULT_SCALES, grayscale=True, pool=None):
+    """Coarse-to-fine search for a template, returning (score, (left, top, width, height), scale)
+
+    With a MatchPool, full-resolution searches are split into bands matched in parallel.
+    """
+    profile = SEARCH_PROFILES[search]
+    downscale = coarse_level(template, profile['downscale'], scales)
+    frame = pyramid.frame
+
+    if downscale >= 1.0:
+        # Template too small (or profile is exact): plain full-resolution search per scale
+        best = (0.0, None, 1.0)
+        for scale in scales:
+            image = template.scaled(scale, grayscale)
+            if pool is not None:
+                score, location = match_template_tiled(frame, image, pool, -1.0)
+            else:
+                score, location = match_template(frame, image, -1.0)
+            if location is not None and score > best[0]:
+                best = (score, (location[0], location[1], image.shape[1], image.shape[0]), scale)
+        best = refine_scale(frame, template, best, scale_step(scales), grayscale)
+        if best[0] < confidence:
+            return best[0], None, best[2]
+        return best
+
+    # Coarse pass: collect the strongest peaks across all scales on the downscaled frame
+    coarse = pyramid.level(downscale)
+    candidates = []
+    for scale in scales:
+        image = template.scaled(scale * downscale, grayscale)
+        if image.shape[0] > coarse.shape[0] or image.shape[1] > coarse.shape[1]:
+            continue
+        scores = cv2.matchTemplate(coarse, image, cv2.TM_CCOEFF_NORMED)
+        for value, x, y in find_peaks(scores, profile['candidates'], image.shape[1] // 2, image.shape[0] // 2):
+            candidates.append((value, x, y, scale))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+    # Fine pass: rematch each candidate at full resolution inside a small padded window
+    pad = int(math.ceil(1.0 / downscale)) + 2
+    best = (0.0, None, 1.0)
+    for _, x, y, scale in candidates[:profile['candidates']]:
+        image = template.scaled(scale, grayscale)
+        height, width = image.shape[:2]
+        left = max(0, int(x / downscale) - pad)
+        top = max(0, int(y / downscale) - pad)
+        window = frame[top:top + height + 2 * pad, left:left + width + 2 * pad]
+        score, location = match_template(window, image, -1.0)
+        if location is not None and score > best[0]:
+            best = (score, (left + location[0], top + location[1], width, height), scale)
+            if score >= 0.99:
+                break
+
+    best = refine_scale(frame, template, best, scale_step(scales), grayscale)
+    if best[0] < confidence:
+        return best[0], None, best[2]
+    return best
+
+
+class TemplateMatcher:
+    """Matches many templates against a single screen capture"""
+
+    def __init__(self, store, confidence=DEFAULT_CONFIDENCE, grayscale=True,
+                 search=DEFAULT_SEARCH, scales=DEFAULT_SCALES, screen=None, workers=None):
+        if search not in SEARCH_PROFILES:
+            raise ValueError(f"Unknown search profile: {search}")
+        self.store = store
+        self.confidence = confidence
+        self.grayscale = grayscale
+        self.search = search
+        self.scales = tuple(scales)
+        self.roi_padding = ROI_PADDING
+        # ScreenCapture used when no frame is passed in
+        self.screen = screen or default_capture()
+        # Templates (and bands of large full-resolution searches) are matched on this pool
+        self.pool = MatchPool(workers)
+
+        # Last hit box per template, used to search a small window before the whole screen
+        self.last_hits = {}
+        self._counters = {'roi_hits': 0, 'roi_misses': 0, 'full_scans': 0, 'region_scans': 0,
+                          'dirty_scans': 0}
+        self._lock = threading.Lock()
+
+    def capture(self, region=None):
+        """Grab one frame in the colour space used for matching
+
+        The array is the capture's reused buffer: it stays valid until the next capture on this thread.
+        """
+        return self.screen.grab(region, grayscale=self.grayscale)
+
+    def stats(self):
+        """Counters showing how often the last-hit window avoided a full-screen scan"""
+        with self._lock:
+            counters = dict(self._counters)
+        attempts = counters['roi_hits'] + counters['roi_misses']
+        counters['roi_hit_rate'] = round(counters['roi_hits'] / attempts, 4) if attempts else None
+        counters['workers'] = self.pool.workers
+        return counters
+
+    def forget(self, name=None):
+        """Drop the remembered last hit for one template (or all of them)"""
+        with self._lock:
+            if name is None:
+                self.last_hits.clear()
+            else:
+                self.last_hits.pop(name, None)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _search_window(self, pyramid, window, template, confidence, search, scales):
+        left, top, width, height = window
+        if width < template.width * min(scales) or height < template.height * min(scales):
+            return 0.0, None, 1.0
+        crop = FramePyramid(pyramid.frame[top:top + height, left:left + width])
+        score, box, scale = pyramid_locate(crop, template, confidence, search, scales, self.grayscale,
+                                           self.pool)
+        if box is not None:
+            box = (box[0] + left, box[1] + top, box[2], box[3])
+        return score, box, scale
+
+    def _locate(self, name, template, pyramid, confidence, search, region, dirty):
+        if region is not None:
+            # Caller asked for a specific area: search only there
+            self._count('region_scans')
+            return self._search_window(pyramid, pad_box(region, 0, pyramid.size), template,
+                                       confidence, search, self.scales)
+
+        if dirty is not None:
+            # Only the changed areas (grown by the template size) can hold a new hit
+            self._count('dirty_scans')
+            padding = int(math.ceil(max(template.width, template.height) * max(self.scales)))
+            best = (0.0, None, 1.0)
+            for box in dirty:
+                window = pad_box(box, padding, pyramid.size)
+                score, found, scale = self._search_window(pyramid, window, template, confidence,
+                                                          search, self.scales)
+                if found is not None and score > best[0]:
+                    best = (score, found, scale)
+                elif best[1] is None and score > best[0]:
+                    best = (score, None, scale)
+            if best[1] is not None:
+                self.last_hits[name] = (best[1], best[2])
+            return best
+
+        last = self.last_hits.get(name)
+        if last is not None:
+            # Fast path: small exact search around the previous hit at the scale it matched at
+            box, scale = last
+            window = pad_box(box, self.roi_padding, pyramid.size)
+            score, found, scale = self._search_window(pyramid, window, template, confidence, 'exact', (scale,))
+            if found is not None:
+                self._count('roi_hits')
+                self.last_hits[name] = (found, scale)
+                return score, found, scale
+            self._count('roi_misses')
+
+        self._count('full_scans')
+        score, found, scale = pyramid_locate(pyramid, template, confidence, search, self.scales, self.grayscale,
+                                             self.pool)
+        if found is not None:
+            self.last_hits[name] = (found, scale)
+        else:
+            self.last_hits.pop(name, None)
+        return score, found, scale
+
+    def match_all(self, names=None, frame=None, confidence=None, search=None, region=None, dirty=None):
+        """Match every stored template (or just the given names) against one frame
+
+        region limits the search to one caller-supplied box; dirty is a list of changed
+        boxes from the screen change detector (None means the whole frame may have changed).
+        """
+        confidence = self.confidence if confidence is None else confidence
+        search = self.search if search is None else search
+        region = normalize_region(region)
+
+        templates = self.store.templates(names)
+        invalid = self.store.invalid()
+
+        start = time.perf_counter()
+        offset = None
+        if frame is None and templates:
+            if region is not None:
+                # Only the requested area is captured; search all of it and shift hits back
+                frame = self.capture(region)
+                offset = region[:2]
+                region = (0, 0, frame.shape[1], frame.shape[0])
+            else:
+                frame = self.capture()
+        captured = time.perf_counter()
+
+        frame_size = (frame.shape[1], frame.shape[0]) if frame is not None else (0, 0)
+        result = MatchResult(frame_size)
+        for name in (names if names is not None else self.store.names()):
+            if name not in templates:
+                result.errors[name] = invalid.get(name, 'unknown template')
+
+        pyramid = FramePyramid(frame) if templates else None
+        if pyramid is not None and search != 'exact':
+            # Build the shared coarse level once instead of racing to build it in every worker
+            pyramid.level(SEARCH_PROFILES[search]['downscale'])
+
+        def check(item):
+            name, template = item
+            try:
+                return self._locate(name, template, pyramid, confidence, search, region, dirty), None
+            except Exception as e:
+                return None, str(e)
+
+        # Matched in parallel on the pool, collected in template order so results are deterministic
+        items = list(templates.items())
+        for (name, template), (found, error) in zip(items, self.pool.map(check, items)):
+            if error is not None:
+                result.errors[name] = error
+                continue
+            score, box, scale = found
+
+            match = None
+            if box is not None:
+                if offset is not None:
+                    box = (box[0] + offset[0], box[1] + offset[1], box[2], box[3])
+                match = Match(name, box[0], box[1], box[2], box[3], score, scale)
+            result.add(name, score, match)
+
+        result.capture_time = captured - start
+        result.match_time = time.perf_counter() - captured
+        return result
+
+    def locate(self, name, frame=None, confidence=None, search=None, region=None):
+        """Locate a single template, returning a Match or None"""
+        result = self.match_all([name], frame=frame, confidence=confidence, search=search, region=region)
+        return result.get(name)
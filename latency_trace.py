@@ -0,0 +1,86 @@
+"""
+Latency trace
+Splits a command's round trip into stages from the timestamps the server and the local client
+stamp on it, and summarises the stages as percentiles per action
+
+Server clock: enqueued_at (send_command), delivered_at (get_commands), result receipt.
+Client clock: received_at, started_at, finished_at, reported_at, plus locate_ms/action_ms.
+Stages only ever subtract timestamps from the same clock, so clock skew between the server and
+the client does not distort them; "network" is whatever the round trip spent outside both.
+"""
+
+STAGES = ('queue', 'network', 'client_wait', 'execute', 'locate', 'action', 'report_wait', 'total')
+PERCENTILES = (50, 95, 99)
+
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def command_stages(enqueued_at, result_at, trace):
+    """Stage durations in milliseconds for one command; stages missing a timestamp are left out"""
+    stages = {}
+    trace = trace if isinstance(trace, dict) else {}
+    enqueued_at = _number(enqueued_at)
+    delivered_at = _number(trace.get('delivered_at'))
+    received_at = _number(trace.get('received_at'))
+    started_at = _number(trace.get('started_at'))
+    finished_at = _number(trace.get('finished_at'))
+    reported_at = _number(trace.get('reported_at'))
+
+    def stage(name, seconds):
+        stages[name] = round(max(0.0, seconds) * 1000, 3)
+
+    if enqueued_at is not None:
+        stage('total', result_at - enqueued_at)
+        if delivered_at is not None:
+            stage('queue', delivered_at - enqueued_at)
+            if received_at is not None and reported_at is not None:
+                # Round trip minus time on the server queue and time held by the client
+                stage('network', (result_at - enqueued_at) - (delivered_at - enqueued_at)
+                      - (reported_at - received_at))
+    if received_at is not None and started_at is not None:
+        stage('client_wait', started_at - received_at)
+    if started_at is not None and finished_at is not None:
+        stage('execute', finished_at - started_at)
+    if finished_at is not None and reported_at is not None:
+        stage('report_wait', reported_at - finished_at)
+    for name in ('locate', 'action'):
+        value = _number(trace.get(f'{name}_ms'))
+        if value is not None:
+            stages[name] = round(max(0.0, value), 3)
+    return stages
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(results, action=None):
+    """{action: {'count': n, 'stages': {stage: {count, p50, p95, p99, max}}}} over stored results"""
+    samples = {}
+    for result in results:
+        stages = result.get('latency_ms')
+        if not stages or (action and result.get('action') != action):
+            continue
+        per_action = samples.setdefault(result.get('action') or 'unknown', {'count': 0, 'stages': {}})
+        per_action['count'] += 1
+        for stage, value in stages.items():
+            per_action['stages'].setdefault(stage, []).append(value)
+
+    summary = {}
+    for name, per_action in samples.items():
+        stages = {}
+        for stage in STAGES:
+            values = sorted(per_action['stages'].get(stage, []))
+            if not values:
+                continue
+            stages[stage] = {'count': len(values), 'max': values[-1]}
+            for pct in PERCENTILES:
+                stages[stage][f'p{pct}'] = percentile(values, pct)
+        summary[name] = {'count': per_action['count'], 'stages': stages}
+    return summary
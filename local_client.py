@@ -5,38 +5,98 @@ Connects to your Render web app and executes automation commands on the user's l
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import pyautogui
 import time
 import json
 import os
+import random
 from PIL import Image
 import threading
+from contextlib import contextmanager
+
+import cv2
+
+from action_timing import ActionPerformer
+from command_sequence import SequenceRunner, compile_sequence
+from image_matching import TemplateMatcher
+from screen_region import normalize_region
+from template_store import TemplateStore
 
 # Configuration
 RENDER_APP_URL = "https://haccser.onrender.com"  # Replace with your actual Render URL
+LONG_POLL_WAIT = 25  # Seconds the server may hold a get-commands request open
+CONNECT_TIMEOUT = 5  # Seconds to establish a connection
+READ_TIMEOUT = 15  # Seconds to wait for a (non long-poll) response
+REGISTER_ATTEMPTS = 5  # Registration attempts at startup before giving up
+# Fleet labels sent at registration so the server can broadcast to a group or tag
+CLIENT_GROUP = os.environ.get('CLIENT_GROUP') or None
+CLIENT_TAGS = [tag.strip() for tag in os.environ.get('CLIENT_TAGS', '').split(',') if tag.strip()]
 LOCAL_IMAGES = {
     'button': 'images/button.png',
     'logo': 'images/logo.png'
 }
 
+class Backoff:
+    """Jittered exponential backoff for retrying failed server requests"""
+    
+    def __init__(self, base=1.0, cap=60.0):
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+    
+    def next_delay(self):
+        delay = min(self.cap, self.base * (2 ** self.attempts))
+        self.attempts += 1
+        # "Equal jitter": keep at least half the delay, randomise the rest
+        return random.uniform(delay / 2, delay)
+    
+    def reset(self):
+        self.attempts = 0
+
 class PyAutoGUIClient:
-    def __init__(self, server_url):
+    def __init__(self, server_url, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 group=CLIENT_GROUP, tags=CLIENT_TAGS):
         self.server_url = server_url
         self.running = False
-        self.session_id = f"client_{int(time.time())}"
+        # Random suffix so clients of a fleet started in the same second do not collide
+        self.session_id = f"client_{int(time.time())}_{random.getrandbits(32):08x}"
+        self.group = group
+        self.tags = list(tags or [])
+        self.long_poll = True
+        self.batch_results = True
+        self.pending_results = []
+        self.backoff = Backoff()
+        self.timeout = (connect_timeout, read_timeout)
+        # Milliseconds spent locating images vs. clicking/typing for the command being run
+        self.stage_ms = {}
+        
+        # One pooled keep-alive session so polls and results reuse the same TCP/TLS connection
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        self.templates = TemplateStore(LOCAL_IMAGES)
+        self.matcher = TemplateMatcher(self.templates, confidence=0.9)
         
-        # Configure PyAutoGUI
+        # Configure PyAutoGUI; delays come from each command's timing profile (TIMING_PROFILE default)
         pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = 0.5
+        self.actions = ActionPerformer(pyautogui)
         
         print(f"PyAutoGUI Client started with session ID: {self.session_id}")
         print(f"Connecting to server: {server_url}")
     
+    def request(self, method, path, **kwargs):
+        """Send a request over the pooled session with the configured timeouts"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.http.request(method, f"{self.server_url}{path}", **kwargs)
+    
     def register_with_server(self):
         """Register this client with the server"""
         try:
-            response = requests.post(f"{self.server_url}/api/register-client", 
-                                   json={'session_id': self.session_id, 'client_type': 'pyautogui'})
+            response = self.request('POST', "/api/register-client",
+                                    json={'session_id': self.session_id, 'client_type': 'pyautogui',
+                                          'group': self.group, 'tags': self.tags})
             if response.status_code == 200:
                 print("Successfully registered with server")
                 return True
@@ -48,15 +108,103 @@ class PyAutoGUIClient:
             return False
     
     def check_for_commands(self):
-        """Check the server for automation commands"""
+        """Check the server for automation commands (long-polls when the server supports it)
+
+        Returns the list of commands, or None if the server could not be reached.
+        """
         try:
-            response = requests.get(f"{self.server_url}/api/get-commands/{self.session_id}")
+            params = {'wait': LONG_POLL_WAIT} if self.long_poll else {}
+            timeout = (self.timeout[0], LONG_POLL_WAIT + self.timeout[1]) if self.long_poll else self.timeout
+            response = self.request('GET', f"/api/get-commands/{self.session_id}",
+                                    params=params, timeout=timeout)
+            if response.status_code == 404:
+                # Server restarted and lost its in-memory state: register again
+                print("Server no longer knows this client, re-registering...")
+                return [] if self.register_with_server() else None
             if response.status_code == 200:
                 data = response.json()
-                return data.get('commands', [])
+                if self.long_poll and not data.get('long_poll'):
+                    # Older server: fall back to plain 1-second polling
+                    print("Server does not support long-polling, falling back to polling")
+                    self.long_poll = False
+                commands = data.get('commands', [])
+                if data.get('retry_after'):
+                    # Server has no thread free to hold the long-poll: back off briefly
+                    time.sleep(float(data['retry_after']))
+                received_at = time.time()
+                for command in commands:
+                    command['received_at'] = received_at
+                return commands
+            print(f"Error checking commands: HTTP {response.status_code}")
         except Exception as e:
             print(f"Error checking commands: {e}")
-        return []
+        return None
+    
+    @contextmanager
+    def timed(self, stage):
+        """Add the time spent in the block to the current command's stage_ms[stage]"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stage_ms[stage] = self.stage_ms.get(stage, 0.0) + elapsed
+    
+    def locate(self, image_name, region=None):
+        """Find a template on screen, returning the Match or None"""
+        if self.templates.get(image_name) is None:
+            reason = self.templates.invalid().get(image_name, 'unknown image name')
+            raise ValueError(f"Image not available: {image_name} ({reason})")
+        with self.timed('locate'):
+            return self.matcher.locate(image_name, region=region)
+    
+    def click(self, x, y):
+        with self.timed('action'):
+            self.actions.click(x, y)
+    
+    def type_text(self, text, mode=None):
+        with self.timed('action'):
+            return self.actions.type_text(text, mode)
+    
+    def run_sequence(self, command):
+        """Run a multi-step sequence locally; returns (success, message, per-step progress)"""
+        try:
+            steps = compile_sequence(command.get('steps'), images=set(self.templates.names()))
+        except ValueError as e:
+            print(f"❌ Invalid sequence: {e}")
+            return False, f"Invalid sequence: {e}", []
+        success, message, progress = SequenceRunner(self).run(steps)
+        print(f"{'✅' if success else '❌'} Sequence {command.get('id')}: {message}")
+        return success, message, progress
+    
+    def run_command(self, command):
+        """Execute one command and build the result reported back to the server"""
+        # Echo action and enqueue time so the server can measure end-to-end latency
+        result = {'command_id': command['id'], 'success': False, 'message': '',
+                  'action': command.get('action'), 'enqueued_at': command.get('enqueued_at')}
+        if command.get('broadcast_id'):
+            result['broadcast_id'] = command['broadcast_id']
+        # Client-side timestamps for the server's per-stage latency breakdown (see latency_trace)
+        trace = {'delivered_at': command.get('delivered_at'), 'received_at': command.get('received_at'),
+                 'started_at': time.time()}
+        self.stage_ms = {}
+        try:
+            with self.actions.using(command.get('timing')):
+                if command.get('action') == 'run_sequence':
+                    print(f"Executing command {command.get('id')}: run_sequence "
+                          f"({len(command.get('steps') or [])} steps)")
+                    result['success'], result['message'], result['steps'] = self.run_sequence(command)
+                else:
+                    result['success'] = self.execute_command(command)
+        except ValueError as e:
+            # Invalid timing profile
+            print(f"❌ {e}")
+            result['message'] = str(e)
+        trace['finished_at'] = time.time()
+        for stage, ms in self.stage_ms.items():
+            trace[f'{stage}_ms'] = round(ms, 3)
+        result['trace'] = trace
+        return result
     
     def execute_command(self, command):
         """Execute a PyAutoGUI command locally"""
@@ -68,40 +216,42 @@ class PyAutoGUIClient:
             
             if action == 'click_image':
                 image_name = command.get('image_name')
-                image_path = LOCAL_IMAGES.get(image_name)
+                template = self.templates.get(image_name)
                 
-                if image_path and os.path.exists(image_path):
-                    location = pyautogui.locateOnScreen(image_path, confidence=0.9)
-                    if location:
-                        center = pyautogui.center(location)
-                        pyautogui.click(center.x, center.y)
-                        print(f"✅ Clicked {image_name} at ({center.x}, {center.y})")
+                if template:
+                    match = self.locate(image_name, region=command.get('region'))
+                    if match:
+                        center = match.center
+                        self.click(center.x, center.y)
+                        print(f"✅ Clicked {image_name} at ({center.x}, {center.y}) score={match.score:.3f}")
                         return True
                     else:
                         print(f"❌ Image {image_name} not found on screen")
                         return False
                 else:
-                    print(f"❌ Image file not found: {image_path}")
+                    reason = self.templates.invalid().get(image_name, 'unknown image name')
+                    print(f"❌ Image not available: {image_name} ({reason})")
                     return False
                     
             elif action == 'click_coordinates':
                 x = command.get('x')
                 y = command.get('y')
-                pyautogui.click(x, y)
+                self.click(x, y)
                 print(f"✅ Clicked at coordinates ({x}, {y})")
                 return True
                 
             elif action == 'type_text':
                 text = command.get('text')
-                pyautogui.typewrite(text)
-                print(f"✅ Typed: {text}")
+                mode = self.type_text(text, command.get('text_mode'))
+                print(f"✅ Typed ({mode}): {text}")
                 return True
                 
             elif action == 'screenshot':
-                screenshot = pyautogui.screenshot()
+                # Fast capture backend (falls back to pyautogui.screenshot); optional region
+                frame = self.matcher.screen.grab(normalize_region(command.get('region')))
                 # Save screenshot locally
                 filename = f"screenshot_{int(time.time())}.png"
-                screenshot.save(filename)
+                cv2.imwrite(filename, frame)
                 print(f"✅ Screenshot saved as {filename}")
                 return True
                 
@@ -114,27 +264,76 @@ class PyAutoGUIClient:
             print(f"❌ Error executing command: {e}")
         return False
     
-    def send_result(self, command_id, success, message=""):
+    def send_result(self, command_id, success, message="", extra=None):
         """Send command result back to server"""
         try:
-            requests.post(f"{self.server_url}/api/command-result", 
+            self.request('POST', "/api/command-result",
                          json={
                              'command_id': command_id,
                              'session_id': self.session_id,
                              'success': success,
-                             'message': message
+                             'message': message,
+                             **(extra or {})
                          })
+            return True
         except Exception as e:
             print(f"Error sending result: {e}")
+            return False
+    
+    def send_results(self, results):
+        """Send the results of a whole batch of commands back in one request
+
+        Results that could not be delivered are kept and retried with the next batch.
+        """
+        results = self.pending_results + results
+        self.pending_results = []
+        reported_at = time.time()
+        for result in results:
+            if isinstance(result.get('trace'), dict):
+                result['trace']['reported_at'] = reported_at
+        
+        if not self.batch_results:
+            for index, result in enumerate(results):
+                extra = {key: value for key, value in result.items()
+                         if key not in ('command_id', 'success', 'message')}
+                if not self.send_result(result['command_id'], result['success'], result.get('message', ''),
+                                        extra=extra):
+                    self.pending_results = results[index:]
+                    return False
+            return True
+        
+        try:
+            response = self.request('POST', "/api/command-results",
+                                    json={'session_id': self.session_id, 'results': results})
+            if response.status_code == 404:
+                # Older server without the batch endpoint
+                print("Server does not support batched results, sending them one by one")
+                self.batch_results = False
+                return self.send_results(results)
+            if response.status_code == 200:
+                return True
+            print(f"Error sending results: HTTP {response.status_code}")
+        except Exception as e:
+            print(f"Error sending results: {e}")
+        self.pending_results = results
+        return False
     
     def run(self):
         """Main client loop"""
         self.running = True
         
-        # Register with server
-        if not self.register_with_server():
+        # Register with server (it may still be waking up, so retry a few times)
+        for attempt in range(REGISTER_ATTEMPTS):
+            if self.register_with_server():
+                break
+            if attempt < REGISTER_ATTEMPTS - 1:
+                delay = self.backoff.next_delay()
+                print(f"Retrying registration in {delay:.1f}s...")
+                time.sleep(delay)
+        else:
             print("Failed to register with server. Exiting.")
             return
+        self.backoff.reset()
         
         print("Client is running. Waiting for commands from web interface...")
         print("Open your web app and send commands to control this local screen!")
@@ -142,19 +341,28 @@ class PyAutoGUIClient:
         while self.running:
             try:
                 commands = self.check_for_commands()
+                if commands is None:
+                    delay = self.backoff.next_delay()
+                    print(f"Server unavailable, retrying in {delay:.1f}s...")
+                    time.sleep(delay)
+                    continue
+                self.backoff.reset()
                 
-                for command in commands:
-                    success = self.execute_command(command)
-                    self.send_result(command['id'], success)
+                results = [self.run_command(command) for command in commands]
+                
+                # Report the whole batch in one round trip
+                if results or self.pending_results:
+                    self.send_results(results)
                 
-                time.sleep(1)  # Check every second
+                if not self.long_poll:
+                    time.sleep(1)  # Check every second
                 
             except KeyboardInterrupt:
                 print("\nShutting down client...")
                 self.running = False
             except Exception as e:
                 print(f"Error in main loop: {e}")
-                time.sleep(5)  # Wait before retrying
+                time.sleep(self.backoff.next_delay())  # Wait before retrying
 
 def main():
     """Main function"""
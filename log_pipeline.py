@@ -0,0 +1,265 @@
+"""
+Console log pipeline
+Queue-backed background writer with batched, buffered writes and size/time based file rotation
+"""
+
+import atexit
+import glob
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+
+# Level codes used by the compact (version 2) console log batch format
+COMPACT_LEVELS = {'l': 'log', 'i': 'info', 'w': 'warn', 'e': 'error', 'd': 'debug'}
+
+
+def parse_console_batch(data):
+    """Return (session_id, rows) for a /api/console-logs body in either format
+
+    Version 1: {"sessionId", "logs": [{"timestamp", "level", "message", "url", "userAgent"}, ...]}
+    Version 2: {"v": 2, "sessionId", "url", "t0": epoch ms, "logs": [[offset ms, level code,
+    message] or [offset ms, level code, message, url], ...]}, with the page URL sent once per batch
+    """
+    session_id = data.get('sessionId', 'unknown')
+    logs = data.get('logs', [])
+    if not isinstance(logs, list):
+        raise ValueError("logs must be a list")
+    if data.get('v') != 2:
+        return session_id, [(entry.get('timestamp'), entry.get('level', 'info'), entry.get('message', ''),
+                             entry.get('url')) for entry in logs]
+
+    t0 = float(data.get('t0') or 0)
+    url = data.get('url')
+    rows = []
+    for entry in logs:
+        if not isinstance(entry, list) or len(entry) < 3:
+            raise ValueError("compact log entries must be [offset, level, message(, url)]")
+        client_time = datetime.fromtimestamp((t0 + entry[0]) / 1000, timezone.utc).isoformat()
+        level = COMPACT_LEVELS.get(entry[1], entry[1])
+        rows.append((client_time, level, entry[2], entry[3] if len(entry) > 3 else url))
+    return session_id, rows
+
+
+class LogPipeline:
+    """Accepts log entries without blocking and writes them from a single background thread"""
+
+    def __init__(self, directory='logs', prefix='console_logs', max_queue=10000, batch_size=500,
+                 flush_interval=1.0, max_bytes=10 * 1024 * 1024, rotate_interval=24 * 3600,
+                 backup_count=20, echo=False, store=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.echo = echo
+        # Optional LogSegmentStore that receives the same batches as structured records
+        self.store = store
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._file = None
+        self._filename = None
+        self._file_bytes = 0
+        self._opened_at = 0.0
+        self._counters = {'enqueued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'rotations': 0,
+                          'write_errors': 0}
+        self._counters_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    # Producers (request threads)
+
+    def submit(self, session_id, entries):
+        """Enqueue browser console entries; returns (accepted, dropped) without touching disk"""
+        return self.submit_rows(session_id, [(entry.get('timestamp'), entry.get('level', 'info'),
+                                              entry.get('message', ''), entry.get('url')) for entry in entries])
+
+    def submit_rows(self, session_id, rows):
+        """Enqueue (client_time, level, message, url) rows; returns (accepted, dropped)"""
+        received = time.time()
+        accepted = 0
+        for client_time, level, message, url in rows:
+            level = str(level)
+            fields = {'sessionId': session_id, 'level': level.lower(), 'message': message,
+                      'clientTime': client_time, 'url': url}
+            record = (received, 'INFO', f"[{session_id}] {level.upper()}: {message}", fields)
+            if self._put(record):
+                accepted += 1
+        dropped = len(rows) - accepted
+        self._count('enqueued', accepted)
+        if dropped:
+            self._count('dropped', dropped)
+        return accepted, dropped
+
+    def info(self, message):
+        self._log('INFO', message)
+
+    def error(self, message):
+        self._log('ERROR', message)
+
+    def _log(self, level, message):
+        fields = {'sessionId': 'server', 'level': level.lower(), 'message': message}
+        if self._put((time.time(), level, message, fields)):
+            self._count('enqueued')
+        else:
+            self._count('dropped')
+
+    def _put(self, record):
+        if self._thread is None:
+            # Started lazily (after any fork) on first use if nobody called start()
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            return False
+
+    # Writer thread
+
+    def start(self):
+        """Start the background writer (idempotent)"""
+        with self._start_lock:
+            return self._start()
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='console-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self._thread
+
+    def close(self, timeout=5.0):
+        """Flush everything still queued and stop the writer"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._close_file()
+
+    def _run(self):
+        while not self._stopping.is_set() or not self._queue.empty():
+            batch = self._drain()
+            if batch:
+                self._write(batch)
+            elif self._file is not None and time.monotonic() - self._opened_at >= self.rotate_interval:
+                # Idle past the rotation interval: close now, the next write opens a fresh file
+                self._close_file()
+                self._count('rotations')
+
+    def _drain(self):
+        # Block for the first record, then grab whatever else is ready up to batch_size
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        lines = []
+        for created, level, message, _ in batch:
+            stamp = datetime.fromtimestamp(created)
+            lines.append(f"{stamp.strftime('%Y-%m-%d %H:%M:%S')},{stamp.microsecond // 1000:03d} - "
+                         f"{level.upper()} - {message}\n")
+        data = ''.join(lines)
+
+        try:
+            self._maybe_rotate(len(data))
+            self._file.write(data)
+            self._file.flush()
+            self._file_bytes += len(data)
+            self._count('written', len(batch))
+            self._count('batches')
+        except Exception as e:
+            self._count('write_errors')
+            print(f"Error writing console logs: {e}")
+
+        if self.store is not None:
+            try:
+                self.store.append([dict(fields, ts=created) for created, _, _, fields in batch])
+            except Exception as e:
+                self._count('write_errors')
+                print(f"Error writing console log segment: {e}")
+
+        if self.echo:
+            print(data, end='')
+
+    def _maybe_rotate(self, incoming=0):
+        now = time.monotonic()
+        if self._file is not None:
+            too_big = self._file_bytes and self._file_bytes + incoming > self.max_bytes
+            too_old = now - self._opened_at >= self.rotate_interval
+            if not (too_big or too_old):
+                return
+            self._close_file()
+            self._count('rotations')
+
+        # The pid keeps each worker process on its own files when several share the directory
+        self._filename = os.path.join(
+            self.directory, f"{self.prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}.log")
+        self._file = open(self._filename, 'a', encoding='utf-8', buffering=64 * 1024)
+        self._file_bytes = 0
+        self._opened_at = now
+        self._prune()
+
+    def _prune(self):
+        # Only remove this process's own files, plus files nobody has written to for two rotation
+        # intervals (left by exited workers); another worker's current file is never touched
+        if not self.backup_count:
+            return
+        own = f"_{os.getpid()}.log"
+        stale_before = time.time() - 2 * self.rotate_interval
+        files = []
+        for path in sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}_*.log"))):
+            try:
+                if path.endswith(own) or os.path.getmtime(path) < stale_before:
+                    files.append(path)
+            except OSError:
+                continue
+        for path in files[:-self.backup_count]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+    # Introspection
+
+    def stats(self):
+        with self._counters_lock:
+            counters = dict(self._counters)
+        counters.update({
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'current_file': self._filename,
+            'writer_alive': self._thread is not None and self._thread.is_alive()
+        })
+        if self.store is not None:
+            counters['segments'] = self.store.stats()
+        return counters
+
+    def _count(self, counter, amount=1):
+        with self._counters_lock:
+            self._counters[counter] += amount
@@ -0,0 +1,247 @@
+"""
+Console log segment store
+Compressed append-only JSONL segments with a sidecar index for session/level/time queries
+"""
+
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+
+
+class Segment:
+    """One gzip JSONL segment and its sidecar index"""
+
+    def __init__(self, path, index=None):
+        self.path = path
+        self.index_path = path[:-len('.jsonl.gz')] + '.idx.json'
+        self.index = index or {'start': None, 'end': None, 'entries': 0, 'sessions': {}, 'levels': {}}
+        self.index_mtime = None
+        # segment_<date>_<time>_<microseconds>_<pid>.jsonl.gz: when and by which process it was opened
+        parts = os.path.basename(path)[:-len('.jsonl.gz')].split('_')
+        try:
+            self.opened = time.mktime(time.strptime(parts[1] + parts[2], '%Y%m%d%H%M%S'))
+            self.pid = int(parts[4])
+        except (IndexError, ValueError):
+            self.opened, self.pid = 0.0, None
+
+    @property
+    def bytes(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def add(self, record):
+        index = self.index
+        ts = record['ts']
+        index['start'] = ts if index['start'] is None else min(index['start'], ts)
+        index['end'] = ts if index['end'] is None else max(index['end'], ts)
+        index['entries'] += 1
+        session = record.get('sessionId') or 'unknown'
+        level = record.get('level') or 'info'
+        index['sessions'][session] = index['sessions'].get(session, 0) + 1
+        index['levels'][level] = index['levels'].get(level, 0) + 1
+
+    def may_contain(self, session_id=None, level=None, since=None, until=None):
+        """Check the sidecar index so unrelated segments are never decompressed"""
+        index = self.index
+        if not index['entries']:
+            return False
+        if session_id is not None and session_id not in index['sessions']:
+            return False
+        if level is not None and level not in index['levels']:
+            return False
+        if since is not None and index['end'] < since:
+            return False
+        if until is not None and index['start'] > until:
+            return False
+        return True
+
+    def save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def read(self):
+        """Yield records from the segment, stopping quietly at a truncated tail"""
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except (EOFError, OSError):
+            return
+
+    def remove(self):
+        for path in (self.path, self.index_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class LogSegmentStore:
+    """Append-only compressed log segments with per-segment indexes and retention"""
+
+    def __init__(self, directory='logs/segments', segment_bytes=4 * 1024 * 1024, segment_seconds=3600,
+                 max_age=7 * 24 * 3600, max_total_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.max_age = max_age
+        self.max_total_bytes = max_total_bytes
+
+        self._segments = []
+        self._active = None
+        self._active_opened = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Deferred until first use so constructing the store costs nothing at import time
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.directory, exist_ok=True)
+        for path in sorted(glob.glob(os.path.join(self.directory, 'segment_*.jsonl.gz'))):
+            segment = Segment(path)
+            if not self._read_index(segment):
+                # Missing or torn index: rebuild it from the segment itself
+                for record in segment.read():
+                    segment.add(record)
+                segment.save_index()
+            self._segments.append(segment)
+
+    def _read_index(self, segment):
+        try:
+            with open(segment.index_path, encoding='utf-8') as f:
+                segment.index = json.load(f)
+            segment.index_mtime = os.path.getmtime(segment.index_path)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _refresh(self):
+        # Other worker processes write their own segments into the same directory:
+        # pick up new segments and re-read indexes that changed since we last looked
+        known = {segment.path: segment for segment in self._segments}
+        segments = []
+        for path in sorted(glob.glob(os.path.join(self.directory, 'segment_*.jsonl.gz'))):
+            segment = known.get(path)
+            if segment is None:
+                segment = Segment(path)
+                if not self._read_index(segment):
+                    continue
+            elif segment is not self._active:
+                try:
+                    if os.path.getmtime(segment.index_path) != segment.index_mtime:
+                        self._read_index(segment)
+                except OSError:
+                    continue
+            segments.append(segment)
+        if self._active is not None and self._active not in segments:
+            segments.append(self._active)
+        self._segments = segments
+
+    def append(self, records):
+        """Append a batch of records as one gzip member and update the sidecar index"""
+        if not records:
+            return
+        with self._lock:
+            self._load()
+            segment = self._writable_segment()
+            data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+            with open(segment.path, 'ab') as f:
+                f.write(gzip.compress(data.encode('utf-8')))
+            for record in records:
+                segment.add(record)
+            segment.save_index()
+
+    def _writable_segment(self):
+        now = time.time()
+        active = self._active
+        if active is None or active.bytes >= self.segment_bytes or now - self._active_opened >= self.segment_seconds:
+            path = os.path.join(self.directory, f"segment_{time.strftime('%Y%m%d_%H%M%S', time.localtime(now))}"
+                                                f"_{int((now % 1) * 1e6):06d}_{os.getpid()}.jsonl.gz")
+            active = Segment(path)
+            self._segments.append(active)
+            self._active = active
+            self._active_opened = now
+            self._enforce_retention(now)
+        return active
+
+    def _sealed(self, segment, now):
+        """True once no process will append to the segment again, so retention may remove it"""
+        if segment is self._active:
+            return False
+        if segment.pid == os.getpid():
+            return True
+        # Another worker's segment: its writer moves on to a new one after segment_seconds
+        return now - segment.opened > self.segment_seconds + 60
+
+    def _enforce_retention(self, now):
+        # Oldest first: drop segments past max_age, then until the total fits max_total_bytes.
+        # Segments another worker may still be appending to are kept and counted.
+        keep = []
+        for segment in self._segments:
+            end = segment.index['end']
+            if end is not None and now - end > self.max_age and self._sealed(segment, now):
+                segment.remove()
+            else:
+                keep.append(segment)
+        total = sum(segment.bytes for segment in keep)
+        for segment in list(keep):
+            if total <= self.max_total_bytes:
+                break
+            if self._sealed(segment, now):
+                keep.remove(segment)
+                total -= segment.bytes
+                segment.remove()
+        self._segments = keep
+
+    def enforce_retention(self):
+        with self._lock:
+            self._load()
+            self._enforce_retention(time.time())
+
+    def query(self, session_id=None, level=None, since=None, until=None, limit=1000):
+        """Yield matching records in write order, only opening segments whose index matches"""
+        with self._lock:
+            self._load()
+            self._refresh()
+            candidates = [segment for segment in self._segments
+                          if segment.may_contain(session_id, level, since, until)]
+
+        returned = 0
+        for segment in candidates:
+            for record in segment.read():
+                if session_id is not None and record.get('sessionId') != session_id:
+                    continue
+                if level is not None and record.get('level') != level:
+                    continue
+                if since is not None and record['ts'] < since:
+                    continue
+                if until is not None and record['ts'] > until:
+                    continue
+                yield record
+                returned += 1
+                if limit and returned >= limit:
+                    return
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            segments = list(self._segments)
+        return {
+            'segments': len(segments),
+            'entries': sum(segment.index['entries'] for segment in segments),
+            'bytes': sum(segment.bytes for segment in segments),
+            'oldest': segments[0].index['start'] if segments else None,
+            'newest': segments[-1].index['end'] if segments else None
+        }
@@ -0,0 +1,95 @@
+"""
+Match pool
+Spreads template matching over cores with a thread pool
+
+OpenCV releases the GIL inside matchTemplate/resize, so worker threads run truly in parallel
+while reading the captured frame in place: nothing is pickled or copied per task.
+"""
+
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# A score-map band narrower than this is not worth a task of its own
+MIN_TILE_ROWS = 64
+
+_local = threading.local()
+
+
+def default_workers():
+    """MATCH_WORKERS, or one worker per core up to 4"""
+    value = os.environ.get('MATCH_WORKERS')
+    if value:
+        return max(1, int(value))
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+class MatchPool:
+    """Ordered parallel map over a lazily created thread pool"""
+
+    def __init__(self, workers=None):
+        self.workers = default_workers() if workers is None else max(1, int(workers))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='match',
+                                                    initializer=_mark_worker)
+            return self._executor
+
+    def map(self, fn, items):
+        """Return [fn(item) for item in items], computed in parallel but always in item order"""
+        items = list(items)
+        # Nested maps (tiles inside a template task) run inline so workers never wait on each other
+        if self.workers <= 1 or len(items) <= 1 or getattr(_local, 'worker', False):
+            return [fn(item) for item in items]
+        return list(self._pool().map(fn, items))
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+def _mark_worker():
+    _local.worker = True
+
+
+def match_template_tiled(frame, template, pool, confidence):
+    """match_template over horizontal bands of the frame in parallel
+
+    Bands overlap by the template height so every position is scored exactly once with the
+    same value as a whole-frame match; ties resolve to the topmost, then leftmost position.
+    Returns (score, (left, top)) like match_template.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    tmpl_h, tmpl_w = template.shape[:2]
+    if tmpl_h > frame_h or tmpl_w > frame_w:
+        return 0.0, None
+    rows = frame_h - tmpl_h + 1
+    bands = min(pool.workers, rows // MIN_TILE_ROWS)
+    if bands <= 1:
+        starts = [0]
+        step = rows
+    else:
+        step = int(math.ceil(rows / bands))
+        starts = list(range(0, rows, step))
+
+    def band(start):
+        scores = cv2.matchTemplate(frame[start:start + step + tmpl_h - 1], template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (x, y) = cv2.minMaxLoc(scores)
+        return (float(score), x, y + start) if np.isfinite(score) else (-1.0, 0, 0)
+
+    score, x, y = max(pool.map(band, starts), key=lambda found: (found[0], -found[2], -found[1]))
+    if score <= -1.0:
+        return 0.0, None
+    if score < confidence:
+        return score, None
+    return score, (x, y)
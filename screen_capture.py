@@ -0,0 +1,391 @@
+"""
+Screen capture
+Grabs the screen (or a region of it) straight into reusable NumPy buffers
+
+Backends, tried in order by 'auto':
+  xshm      - X11 MIT-SHM: the X server writes pixels into a shared memory segment we map as a NumPy array
+  mss       - mss (ctypes, no temporary files) on X11, Windows and macOS, when installed
+  pyautogui - pyautogui.screenshot() via pyscreeze, always available as the fallback
+"""
+
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+BACKENDS = ('xshm', 'mss', 'pyautogui')
+
+# Shared memory images kept per thread, keyed by capture size (full screen plus recent regions)
+MAX_CACHED_IMAGES = 4
+
+
+class CaptureError(Exception):
+    """A capture backend is unavailable or failed"""
+
+
+def clip_region(region, screen_size):
+    """Clip a (left, top, width, height) region to the screen; None means the whole screen"""
+    width, height = screen_size
+    if region is None:
+        return (0, 0, width, height)
+    left, top = max(0, int(region[0])), max(0, int(region[1]))
+    right = min(width, int(region[0]) + int(region[2]))
+    bottom = min(height, int(region[1]) + int(region[3]))
+    if right <= left or bottom <= top:
+        raise ValueError(f"region {tuple(region)} is outside the {width}x{height} screen")
+    return (left, top, right - left, bottom - top)
+
+
+class _XImage(ctypes.Structure):
+    # Leading fields of Xlib's XImage; only these are read
+    _fields_ = [('width', ctypes.c_int), ('height', ctypes.c_int), ('xoffset', ctypes.c_int),
+                ('format', ctypes.c_int), ('data', ctypes.c_void_p), ('byte_order', ctypes.c_int),
+                ('bitmap_unit', ctypes.c_int), ('bitmap_bit_order', ctypes.c_int),
+                ('bitmap_pad', ctypes.c_int), ('depth', ctypes.c_int), ('bytes_per_line', ctypes.c_int),
+                ('bits_per_pixel', ctypes.c_int)]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [('shmseg', ctypes.c_ulong), ('shmid', ctypes.c_int), ('shmaddr', ctypes.c_void_p),
+                ('readOnly', ctypes.c_int)]
+
+
+_ZPIXMAP = 2
+_ALL_PLANES = ctypes.c_ulong(-1)
+_IPC_PRIVATE = 0
+_IPC_CREAT = 0o1000
+_IPC_RMID = 0
+
+_xlib = None
+_xlib_lock = threading.Lock()
+_x_errors = []
+
+
+def _load_xlib():
+    """Load libX11, libXext and libc once and declare the calls used below"""
+    global _xlib
+    with _xlib_lock:
+        if _xlib is not None:
+            return _xlib
+        names = [ctypes.util.find_library(name) for name in ('X11', 'Xext', 'c')]
+        if not all(names):
+            raise CaptureError("libX11/libXext not found")
+        x11, xext, libc = (ctypes.CDLL(name) for name in names)
+
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDestroyImage.argtypes = [ctypes.POINTER(_XImage)]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo),
+                                         ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+        # Xlib's default error handler exits the process; record errors instead so a failed
+        # grab only falls back to the next backend
+        handler_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+        handler = handler_type(lambda display, event: _x_errors.append(event) or 0)
+        x11.XSetErrorHandler.argtypes = [handler_type]
+        x11.XSetErrorHandler(handler)
+
+        _xlib = (x11, xext, libc, handler)
+        return _xlib
+
+
+class _ShmImage:
+    """One XShm image of a fixed size, exposed as a BGRA NumPy view of the shared segment"""
+
+    def __init__(self, backend, width, height):
+        x11, xext, libc, _ = backend.libs
+        self.backend = backend
+        self.info = _XShmSegmentInfo()
+        self.image = xext.XShmCreateImage(backend.display, backend.visual, backend.depth, _ZPIXMAP,
+                                          None, ctypes.byref(self.info), width, height)
+        if not self.image:
+            raise CaptureError("XShmCreateImage failed")
+        image = self.image.contents
+        if image.bits_per_pixel != 32:
+            x11.XDestroyImage(self.image)
+            raise CaptureError(f"unsupported {image.bits_per_pixel} bits per pixel")
+
+        size = image.bytes_per_line * image.height
+        self.info.shmid = libc.shmget(_IPC_PRIVATE, size, _IPC_CREAT | 0o600)
+        if self.info.shmid < 0:
+            x11.XDestroyImage(self.image)
+            raise CaptureError("shmget failed")
+        address = libc.shmat(self.info.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            libc.shmctl(self.info.shmid, _IPC_RMID, None)
+            x11.XDestroyImage(self.image)
+            raise CaptureError("shmat failed")
+        self.info.shmaddr = image.data = address
+        self.info.readOnly = 0
+
+        del _x_errors[:]
+        attached = xext.XShmAttach(backend.display, ctypes.byref(self.info))
+        x11.XSync(backend.display, 0)
+        # Marked for removal now; the kernel frees it once both we and the X server detach
+        libc.shmctl(self.info.shmid, _IPC_RMID, None)
+        if not attached or _x_errors:
+            self.close(detach=False)
+            raise CaptureError("XShmAttach failed (X server cannot share memory with this process)")
+
+        buffer = (ctypes.c_ubyte * size).from_address(address)
+        rows = np.frombuffer(buffer, dtype=np.uint8).reshape(image.height, image.bytes_per_line)
+        self.pixels = rows[:, :width * 4].reshape(image.height, width, 4)
+
+    def grab(self, left, top):
+        x11, xext, _, _ = self.backend.libs
+        del _x_errors[:]
+        if not xext.XShmGetImage(self.backend.display, self.backend.root, self.image, left, top,
+                                 _ALL_PLANES) or _x_errors:
+            raise CaptureError("XShmGetImage failed")
+        return self.pixels
+
+    def close(self, detach=True):
+        x11, xext, libc, _ = self.backend.libs
+        if detach:
+            xext.XShmDetach(self.backend.display, ctypes.byref(self.info))
+            x11.XSync(self.backend.display, 0)
+        self.pixels = None
+        libc.shmdt(ctypes.c_void_p(self.info.shmaddr))
+        # XDestroyImage would free() the shared segment as if it were malloc'd
+        self.image.contents.data = None
+        x11.XDestroyImage(self.image)
+
+
+class _XShmBackend:
+    name = 'xshm'
+
+    def __init__(self):
+        if not sys.platform.startswith('linux') or not os.environ.get('DISPLAY'):
+            raise CaptureError("no X display")
+        self.libs = _load_xlib()
+        x11, xext, _, _ = self.libs
+        self.display = x11.XOpenDisplay(None)
+        if not self.display:
+            raise CaptureError(f"cannot open display {os.environ.get('DISPLAY')}")
+        if not xext.XShmQueryExtension(self.display):
+            x11.XCloseDisplay(self.display)
+            raise CaptureError("X server has no MIT-SHM extension")
+        screen = x11.XDefaultScreen(self.display)
+        self.root = x11.XRootWindow(self.display, screen)
+        self.visual = x11.XDefaultVisual(self.display, screen)
+        self.depth = x11.XDefaultDepth(self.display, screen)
+        self.screen_size = (x11.XDisplayWidth(self.display, screen), x11.XDisplayHeight(self.display, screen))
+        self._images = OrderedDict()
+
+    def grab(self, region):
+        """Return a BGRA view of the shared image; valid until the next grab of the same size"""
+        left, top, width, height = region
+        image = self._images.get((width, height))
+        if image is None:
+            image = self._images[(width, height)] = _ShmImage(self, width, height)
+            while len(self._images) > MAX_CACHED_IMAGES:
+                self._images.popitem(last=False)[1].close()
+        else:
+            self._images.move_to_end((width, height))
+        return image.grab(left, top), 'BGRA'
+
+    def close(self):
+        x11 = self.libs[0]
+        for image in self._images.values():
+            image.close()
+        self._images.clear()
+        x11.XCloseDisplay(self.display)
+
+
+class _MssBackend:
+    name = 'mss'
+
+    def __init__(self):
+        try:
+            import mss
+        except ImportError:
+            raise CaptureError("mss is not installed")
+        self.sct = mss.mss()
+        # Primary monitor, matching the coordinates pyautogui clicks in
+        self.monitor = self.sct.monitors[1]
+        self.screen_size = (self.monitor['width'], self.monitor['height'])
+
+    def grab(self, region):
+        left, top, width, height = region
+        shot = self.sct.grab({'left': self.monitor['left'] + left, 'top': self.monitor['top'] + top,
+                              'width': width, 'height': height})
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4), 'BGRA'
+
+    def close(self):
+        self.sct.close()
+
+
+class _PyAutoGUIBackend:
+    name = 'pyautogui'
+
+    def __init__(self):
+        import pyautogui
+        self.pyautogui = pyautogui
+        size = pyautogui.size()
+        self.screen_size = (size.width, size.height)
+
+    def grab(self, region):
+        screenshot = self.pyautogui.screenshot(region=region)
+        return np.asarray(screenshot.convert('RGB')), 'RGB'
+
+    def close(self):
+        pass
+
+
+_BACKEND_CLASSES = {'xshm': _XShmBackend, 'mss': _MssBackend, 'pyautogui': _PyAutoGUIBackend}
+
+_CONVERSIONS = {
+    ('BGRA', False): cv2.COLOR_BGRA2BGR, ('BGRA', True): cv2.COLOR_BGRA2GRAY,
+    ('RGB', False): cv2.COLOR_RGB2BGR, ('RGB', True): cv2.COLOR_RGB2GRAY
+}
+
+
+class ScreenCapture:
+    """Screen grabber that converts each capture into a per-thread, reused BGR or grayscale buffer
+
+    Frames returned by grab() are overwritten by the next grab of the same size and colour on the
+    same thread; pass copy=True to keep one. Each thread gets its own backend connection, which
+    short-lived threads should release with close().
+    """
+
+    def __init__(self, backend='auto'):
+        if backend != 'auto' and backend not in BACKENDS:
+            raise ValueError(f"Unknown capture backend: {backend}")
+        self.backend = backend
+        self._local = threading.local()
+        self._counters = {'grabs': 0, 'fallbacks': 0, 'capture_time': 0.0}
+        self._backends_used = {}
+        self._lock = threading.Lock()
+
+    def _candidates(self):
+        return BACKENDS if self.backend == 'auto' else BACKENDS[BACKENDS.index(self.backend):]
+
+    def _backend(self):
+        backend = getattr(self._local, 'backend', None)
+        if backend is not None:
+            return backend
+        errors = []
+        skip = getattr(self._local, 'failed', set())
+        for name in self._candidates():
+            if name in skip:
+                continue
+            try:
+                backend = _BACKEND_CLASSES[name]()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+                continue
+            if errors:
+                print(f"Screen capture using {name} ({'; '.join(errors)})")
+            self._local.backend = backend
+            self._local.buffers = {}
+            return backend
+        raise CaptureError(f"No screen capture backend available ({'; '.join(errors)})")
+
+    def _fall_back(self, backend, error):
+        print(f"Screen capture backend {backend.name} failed, falling back: {error}")
+        try:
+            backend.close()
+        except Exception:
+            pass
+        self._local.failed = getattr(self._local, 'failed', set()) | {backend.name}
+        self._local.backend = None
+        with self._lock:
+            self._counters['fallbacks'] += 1
+
+    def active_backend(self):
+        """Name of the backend this thread captures with"""
+        return self._backend().name
+
+    def size(self):
+        """(width, height) of the captured screen"""
+        return self._backend().screen_size
+
+    def grab(self, region=None, grayscale=False, copy=False):
+        """Capture the screen or a (left, top, width, height) region as a BGR or grayscale array"""
+        started = time.perf_counter()
+        while True:
+            backend = self._backend()
+            box = clip_region(region, backend.screen_size)
+            try:
+                raw, layout = backend.grab(box)
+                break
+            except ValueError:
+                raise
+            except Exception as e:
+                if backend.name == self._candidates()[-1]:
+                    raise
+                self._fall_back(backend, e)
+
+        # One conversion from the backend's layout straight into the reused output buffer
+        key = (raw.shape[0], raw.shape[1], grayscale)
+        out = self._local.buffers.get(key)
+        if out is None:
+            if len(self._local.buffers) >= MAX_CACHED_IMAGES * 2:
+                self._local.buffers.clear()
+            shape = raw.shape[:2] if grayscale else raw.shape[:2] + (3,)
+            out = self._local.buffers[key] = np.empty(shape, dtype=np.uint8)
+        cv2.cvtColor(raw, _CONVERSIONS[(layout, grayscale)], dst=out)
+
+        with self._lock:
+            self._counters['grabs'] += 1
+            self._counters['capture_time'] += time.perf_counter() - started
+            self._backends_used[backend.name] = self._backends_used.get(backend.name, 0) + 1
+        return out.copy() if copy else out
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            backends = dict(self._backends_used)
+        capture_time = counters.pop('capture_time')
+        counters['avg_capture_ms'] = round(capture_time / counters['grabs'] * 1000, 2) if counters['grabs'] else None
+        counters['backends'] = backends
+        counters['requested_backend'] = self.backend
+        return counters
+
+    def close(self):
+        """Release this thread's backend (shared memory segments and display connection)"""
+        backend = getattr(self._local, 'backend', None)
+        if backend is not None:
+            backend.close()
+            self._local.backend = None
+
+
+_default_capture = None
+_default_lock = threading.Lock()
+
+
+def default_capture():
+    """Process-wide ScreenCapture; SCREEN_CAPTURE picks the backend (default auto)"""
+    global _default_capture
+    with _default_lock:
+        if _default_capture is None:
+            _default_capture = ScreenCapture(os.environ.get('SCREEN_CAPTURE', 'auto'))
+        return _default_capture
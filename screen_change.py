@@ -0,0 +1,105 @@
+"""
+Screen change detection
+Compares a downsampled copy of each frame per tile so unchanged frames can skip template matching
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class ScreenChange:
+    """Outcome of comparing one frame with the previous one"""
+
+    def __init__(self, changed, regions, dirty_tiles, total_tiles):
+        self.changed = changed
+        # List of (left, top, width, height) boxes in frame pixels, or None for "the whole frame"
+        self.regions = regions
+        self.dirty_tiles = dirty_tiles
+        self.total_tiles = total_tiles
+
+
+class ChangeDetector:
+    """Per-tile frame differencing on a downsampled grayscale frame"""
+
+    def __init__(self, tile_size=128, downsample=4, threshold=12, full_ratio=0.5, force_interval=30.0):
+        self.tile_size = tile_size
+        self.downsample = downsample
+        self.threshold = threshold
+        self.full_ratio = full_ratio
+        self.force_interval = force_interval
+
+        self._previous = None
+        self._last_full = 0.0
+        self._counters = {'cycles_skipped': 0, 'cycles_partial': 0, 'cycles_full': 0, 'dirty_tiles': 0}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget the previous frame so the next update is treated as a full change"""
+        with self._lock:
+            self._previous = None
+
+    def update(self, frame):
+        """Compare frame with the previous one and return a ScreenChange"""
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+        small = cv2.resize(gray, (max(1, width // self.downsample), max(1, height // self.downsample)),
+                           interpolation=cv2.INTER_AREA)
+
+        cell = max(1, self.tile_size // self.downsample)
+        rows = -(-small.shape[0] // cell)
+        cols = -(-small.shape[1] // cell)
+        total = rows * cols
+        now = time.monotonic()
+
+        with self._lock:
+            previous = self._previous
+            self._previous = small
+
+            if previous is None or previous.shape != small.shape or now - self._last_full >= self.force_interval:
+                self._last_full = now
+                self._counters['cycles_full'] += 1
+                return ScreenChange(True, None, total, total)
+
+            diff = cv2.absdiff(small, previous)
+            padded = np.zeros((rows * cell, cols * cell), dtype=diff.dtype)
+            padded[:diff.shape[0], :diff.shape[1]] = diff
+            tile_max = padded.reshape(rows, cell, cols, cell).max(axis=(1, 3))
+            dirty = tile_max > self.threshold
+            dirty_count = int(dirty.sum())
+
+            if dirty_count == 0:
+                self._counters['cycles_skipped'] += 1
+                return ScreenChange(False, [], 0, total)
+
+            self._counters['dirty_tiles'] += dirty_count
+            if dirty_count >= total * self.full_ratio:
+                self._last_full = now
+                self._counters['cycles_full'] += 1
+                return ScreenChange(True, None, dirty_count, total)
+
+            self._counters['cycles_partial'] += 1
+
+        return ScreenChange(True, self._dirty_regions(dirty, width, height), dirty_count, total)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        cycles = counters['cycles_skipped'] + counters['cycles_partial'] + counters['cycles_full']
+        counters['cycles_processed'] = counters['cycles_partial'] + counters['cycles_full']
+        counters['skip_rate'] = round(counters['cycles_skipped'] / cycles, 4) if cycles else None
+        return counters
+
+    def _dirty_regions(self, dirty, width, height):
+        # Merge touching dirty tiles into boxes so each change is searched once
+        count, _, boxes, _ = cv2.connectedComponentsWithStats(dirty.astype(np.uint8), connectivity=8)
+        regions = []
+        for col, row, cols, rows, _ in boxes[1:count]:
+            left = int(col) * self.tile_size
+            top = int(row) * self.tile_size
+            right = min(width, (int(col) + int(cols)) * self.tile_size)
+            bottom = min(height, (int(row) + int(rows)) * self.tile_size)
+            regions.append((left, top, right - left, bottom - top))
+        return regions
@@ -0,0 +1,28 @@
+"""
+Screen regions
+Helpers for (left, top, width, height) boxes shared by the web tier and the matchers
+"""
+
+
+def normalize_region(region):
+    """Validate a caller-supplied region as a (left, top, width, height) tuple, or None"""
+    if region is None:
+        return None
+    if isinstance(region, dict):
+        region = (region.get('left'), region.get('top'), region.get('width'), region.get('height'))
+    try:
+        left, top, width, height = (int(value) for value in region)
+    except (TypeError, ValueError):
+        raise ValueError("region must be [left, top, width, height]")
+    if width <= 0 or height <= 0 or left < 0 or top < 0:
+        raise ValueError("region must have a non-negative origin and a positive size")
+    return (left, top, width, height)
+
+
+def pad_box(box, padding, frame_size):
+    """Grow a (left, top, width, height) box by padding, clipped to the frame"""
+    left = max(0, box[0] - padding)
+    top = max(0, box[1] - padding)
+    right = min(frame_size[0], box[0] + box[2] + padding)
+    bottom = min(frame_size[1], box[1] + box[3] + padding)
+    return (left, top, max(0, right - left), max(0, bottom - top))
@@ -12,7 +12,7 @@ def install_requirements():
     """Install required packages for the local client"""
     print("Installing required packages...")
     try:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "pyautogui", "pillow", "requests"])
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "pyautogui", "pillow", "requests", "numpy", "opencv-python", "mss", "pyperclip"])
         print("✅ Packages installed successfully!")
         return True
     except subprocess.CalledProcessError as e:
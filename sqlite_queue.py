@@ -0,0 +1,352 @@
+"""
+SQLite command queue backend
+Client registry, command queues and results in one WAL-mode database shared by all worker processes
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from command_queue import OVERFLOW_POLICIES, CommandQueueBackend, QueueFull, UnknownClient
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    session_id TEXT PRIMARY KEY,
+    info TEXT NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS commands_session ON commands (session_id, id);
+CREATE TABLE IF NOT EXISTS results (
+    command_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_stored ON results (stored_at);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    broadcast_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS broadcasts_stored ON broadcasts (stored_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SQLiteCommandQueue(CommandQueueBackend):
+    """Command queue backend stored in SQLite so several processes can serve the same clients
+
+    Long-polls are woken instantly by enqueues from the same process and otherwise notice
+    commands from other processes within poll_interval seconds.
+    """
+
+    def __init__(self, path, max_pending=100, overflow='reject', result_ttl=3600, max_results=10000,
+                 client_ttl=120, poll_interval=0.05):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.path = path
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self.client_ttl = client_ttl
+        self.poll_interval = poll_interval
+
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._reaper = None
+        self._listeners = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    # Connection handling
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('PRAGMA busy_timeout=30000')
+            self._local.db = db
+        return db
+
+    class _Transaction:
+        def __init__(self, db):
+            self.db = db
+
+        def __enter__(self):
+            # IMMEDIATE takes the write lock up front so check-then-insert is atomic across processes
+            self.db.execute('BEGIN IMMEDIATE')
+            return self.db
+
+        def __exit__(self, exc_type, exc, tb):
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+            return False
+
+    def _transaction(self):
+        return self._Transaction(self._connect())
+
+    def _count(self, db, counter, amount=1):
+        db.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                   'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value', (counter, amount))
+
+    # Client registry
+
+    def register_client(self, session_id, client_type, group=None, tags=None):
+        now = datetime.now().isoformat()
+        with self._transaction() as db:
+            row = db.execute('SELECT info FROM clients WHERE session_id = ?', (session_id,)).fetchone()
+            info = json.loads(row[0]) if row else {'connected_at': now}
+            info['type'] = client_type
+            info['group'] = group
+            info['tags'] = sorted(tags or [])
+            info['last_seen'] = now
+            db.execute('INSERT OR REPLACE INTO clients (session_id, info, last_seen) VALUES (?, ?, ?)',
+                       (session_id, json.dumps(info), time.time()))
+        self._emit('client_connected', {'session_id': session_id, 'client': info})
+        return info
+
+    def touch(self, session_id):
+        db = self._connect()
+        cursor = db.execute(
+            "UPDATE clients SET last_seen = ?, info = json_set(info, '$.last_seen', ?) WHERE session_id = ?",
+            (time.time(), datetime.now().isoformat(), session_id))
+        return cursor.rowcount > 0
+
+    def is_connected(self, session_id):
+        row = self._connect().execute('SELECT 1 FROM clients WHERE session_id = ?', (session_id,)).fetchone()
+        return row is not None
+
+    def clients(self):
+        rows = self._connect().execute('SELECT session_id, info FROM clients ORDER BY rowid').fetchall()
+        return {session_id: json.loads(info) for session_id, info in rows}
+
+    def remove_client(self, session_id, reason='removed'):
+        with self._transaction() as db:
+            removed = db.execute('DELETE FROM clients WHERE session_id = ?', (session_id,)).rowcount > 0
+            db.execute('DELETE FROM commands WHERE session_id = ?', (session_id,))
+        self._notify()
+        if removed:
+            self._emit('client_disconnected', {'session_id': session_id, 'reason': reason})
+        return removed
+
+    # Commands
+
+    def enqueue(self, session_id, command):
+        return self.enqueue_many(session_id, [command])[0]
+
+    def enqueue_many(self, session_id, commands):
+        rejected = None
+        ids = []
+        with self._transaction() as db:
+            if db.execute('SELECT 1 FROM clients WHERE session_id = ?', (session_id,)).fetchone() is None:
+                raise UnknownClient(session_id)
+
+            pending = db.execute('SELECT COUNT(*) FROM commands WHERE session_id = ?', (session_id,)).fetchone()[0]
+            overflow = pending + len(commands) - self.max_pending
+            if overflow > 0 and (self.overflow == 'reject' or len(commands) > self.max_pending):
+                # Commit the counter but none of the commands
+                self._count(db, 'rejected', len(commands))
+                rejected = (f"Command queue for {session_id} is full "
+                            f"({pending}/{self.max_pending} pending, {len(commands)} more requested)")
+            else:
+                if overflow > 0:
+                    db.execute('DELETE FROM commands WHERE id IN (SELECT id FROM commands WHERE session_id = ? '
+                               'ORDER BY id LIMIT ?)', (session_id, overflow))
+                    self._count(db, 'dropped', overflow)
+                for command in commands:
+                    cursor = db.execute('INSERT INTO commands (session_id, payload) VALUES (?, ?)',
+                                        (session_id, json.dumps(command)))
+                    command['id'] = cursor.lastrowid
+                    ids.append(command['id'])
+                self._count(db, 'enqueued', len(ids))
+
+        if rejected:
+            raise QueueFull(rejected)
+        self._notify()
+        return ids
+
+    def enqueue_broadcast(self, broadcast_id, session_ids, command):
+        """Queue a copy of command for every session in one transaction
+
+        Returns (queued {session_id: command_id}, failed {session_id: reason}).
+        """
+        queued, failed = {}, {}
+        targets = json.dumps(list(session_ids))
+        with self._transaction() as db:
+            known = {row[0] for row in db.execute(
+                'SELECT session_id FROM clients WHERE session_id IN (SELECT value FROM json_each(?))', (targets,))}
+            depths = dict(db.execute(
+                'SELECT session_id, COUNT(*) FROM commands WHERE session_id IN (SELECT value FROM json_each(?)) '
+                'GROUP BY session_id', (targets,)).fetchall())
+            payload = json.dumps(dict(command, broadcast_id=broadcast_id))
+            rejected = dropped = 0
+            for session_id in session_ids:
+                if session_id not in known:
+                    failed[session_id] = 'Client not connected'
+                    continue
+                if depths.get(session_id, 0) >= self.max_pending:
+                    if self.overflow == 'reject':
+                        rejected += 1
+                        failed[session_id] = (f"Command queue for {session_id} is full "
+                                              f"({self.max_pending} pending)")
+                        continue
+                    db.execute('DELETE FROM commands WHERE id = (SELECT MIN(id) FROM commands WHERE session_id = ?)',
+                               (session_id,))
+                    dropped += 1
+                cursor = db.execute('INSERT INTO commands (session_id, payload) VALUES (?, ?)', (session_id, payload))
+                queued[session_id] = cursor.lastrowid
+
+            db.execute('INSERT OR REPLACE INTO broadcasts (broadcast_id, payload, stored_at) VALUES (?, ?, ?)',
+                       (broadcast_id, json.dumps({
+                           'broadcast_id': broadcast_id,
+                           'action': command.get('action'),
+                           'created_at': datetime.now().isoformat(),
+                           'queued': queued,
+                           'failed': failed
+                       }), time.time()))
+            self._count(db, 'enqueued', len(queued))
+            self._count(db, 'broadcasts')
+            if rejected:
+                self._count(db, 'rejected', rejected)
+            if dropped:
+                self._count(db, 'dropped', dropped)
+        self._notify()
+        return queued, failed
+
+    def get_broadcast(self, broadcast_id):
+        row = self._connect().execute('SELECT payload FROM broadcasts WHERE broadcast_id = ?',
+                                      (broadcast_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def take(self, session_id, wait=0):
+        deadline = time.monotonic() + wait
+        db = self._connect()
+        while True:
+            version = db.execute('PRAGMA data_version').fetchone()[0]
+            commands = self._take_now(session_id)
+            remaining = deadline - time.monotonic()
+            if commands or remaining <= 0 or not self.is_connected(session_id):
+                return commands
+            # Same-process enqueues notify immediately; other processes are seen on the next poll.
+            # data_version only changes when another connection commits, so an idle wait costs a
+            # pragma per poll instead of queries
+            while remaining > 0:
+                with self._wakeup:
+                    notified = self._wakeup.wait(min(self.poll_interval, remaining))
+                if notified or db.execute('PRAGMA data_version').fetchone()[0] != version:
+                    break
+                remaining = deadline - time.monotonic()
+
+    def _take_now(self, session_id):
+        db = self._connect()
+        # Cheap read first so idle long-polls don't take the write lock
+        if db.execute('SELECT 1 FROM commands WHERE session_id = ? LIMIT 1', (session_id,)).fetchone() is None:
+            return []
+        with self._transaction() as db:
+            rows = db.execute('SELECT id, payload FROM commands WHERE session_id = ? ORDER BY id',
+                              (session_id,)).fetchall()
+            if not rows:
+                return []
+            db.execute('DELETE FROM commands WHERE session_id = ? AND id <= ?', (session_id, rows[-1][0]))
+            self._count(db, 'delivered', len(rows))
+        commands = []
+        for command_id, payload in rows:
+            command = json.loads(payload)
+            command['id'] = command_id
+            commands.append(command)
+        return commands
+
+    def depth(self, session_id):
+        row = self._connect().execute('SELECT COUNT(*) FROM commands WHERE session_id = ?',
+                                      (session_id,)).fetchone()
+        return row[0]
+
+    def _notify(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    # Results
+
+    def record_result(self, command_id, result):
+        with self._transaction() as db:
+            db.execute('INSERT OR REPLACE INTO results (command_id, payload, stored_at) VALUES (?, ?, ?)',
+                       (json.dumps(command_id), json.dumps(result), time.time()))
+            self._count(db, 'results')
+
+    def get_result(self, command_id):
+        row = self._connect().execute('SELECT payload FROM results WHERE command_id = ?',
+                                      (json.dumps(command_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_results(self, command_ids):
+        keys = json.dumps([json.dumps(command_id) for command_id in command_ids])
+        rows = self._connect().execute('SELECT command_id, payload FROM results '
+                                       'WHERE command_id IN (SELECT value FROM json_each(?))', (keys,)).fetchall()
+        return {json.loads(command_id): json.loads(payload) for command_id, payload in rows}
+
+    def results(self):
+        rows = self._connect().execute('SELECT command_id, payload FROM results ORDER BY stored_at').fetchall()
+        return {json.loads(command_id): json.loads(payload) for command_id, payload in rows}
+
+    # Housekeeping
+
+    def reap(self):
+        now = time.time()
+        with self._transaction() as db:
+            stale = [row[0] for row in db.execute('SELECT session_id FROM clients WHERE last_seen < ?',
+                                                  (now - self.client_ttl,)).fetchall()]
+            for session_id in stale:
+                db.execute('DELETE FROM clients WHERE session_id = ?', (session_id,))
+                db.execute('DELETE FROM commands WHERE session_id = ?', (session_id,))
+                print(f"Client reaped (not seen for {self.client_ttl}s): {session_id}")
+
+            evicted = db.execute('DELETE FROM results WHERE stored_at < ?', (now - self.result_ttl,)).rowcount
+            evicted += db.execute('DELETE FROM results WHERE command_id IN (SELECT command_id FROM results '
+                                  'ORDER BY stored_at DESC LIMIT -1 OFFSET ?)', (self.max_results,)).rowcount
+            db.execute('DELETE FROM broadcasts WHERE stored_at < ?', (now - self.result_ttl,))
+            db.execute('DELETE FROM broadcasts WHERE broadcast_id IN (SELECT broadcast_id FROM broadcasts '
+                       'ORDER BY stored_at DESC LIMIT -1 OFFSET ?)', (self.max_results,))
+            if stale:
+                self._count(db, 'clients_reaped', len(stale))
+            if evicted:
+                self._count(db, 'results_evicted', evicted)
+        if stale:
+            self._notify()
+        for session_id in stale:
+            self._emit('client_disconnected', {'session_id': session_id, 'reason': 'timeout'})
+        return len(stale), evicted
+
+    def stats(self):
+        db = self._connect()
+        counters = {'enqueued': 0, 'delivered': 0, 'rejected': 0, 'dropped': 0,
+                    'results': 0, 'results_evicted': 0, 'clients_reaped': 0, 'broadcasts': 0}
+        counters.update(dict(db.execute('SELECT name, value FROM counters').fetchall()))
+        depths = {session_id: 0 for (session_id,) in db.execute('SELECT session_id FROM clients').fetchall()}
+        for session_id, count in db.execute('SELECT session_id, COUNT(*) FROM commands GROUP BY session_id'):
+            depths[session_id] = count
+        counters.update({
+            'clients': db.execute('SELECT COUNT(*) FROM clients').fetchone()[0],
+            'pending': sum(depths.values()),
+            'queue_depths': depths,
+            'stored_results': db.execute('SELECT COUNT(*) FROM results').fetchone()[0],
+            'stored_broadcasts': db.execute('SELECT COUNT(*) FROM broadcasts').fetchone()[0],
+            'max_pending': self.max_pending,
+            'overflow': self.overflow,
+            'backend': f"sqlite:///{self.path}"
+        })
+        return counters
@@ -1,4 +1,12 @@
 // Permission handling JavaScript
+
+// Console log batching: flush at LOG_BATCH_MAX_ENTRIES entries or LOG_BATCH_MAX_BYTES of messages,
+// otherwise LOG_FLUSH_INTERVAL ms after the first buffered entry; larger bodies are gzipped
+const LOG_BATCH_MAX_ENTRIES = 200;
+const LOG_BATCH_MAX_BYTES = 64 * 1024;
+const LOG_FLUSH_INTERVAL = 2000;
+const LOG_COMPRESS_MIN_BYTES = 1024;
+const LOG_BUFFER_MAX_ENTRIES = 2000;
 class PermissionManager {
     constructor() {
         this.permissions = {
@@ -246,34 +254,42 @@ class PermissionManager {
         const originalError = console.error;
         const originalWarn = console.warn;
         const originalInfo = console.info;
+        this.originalError = originalError;
         
-        // Store logs to send to server
+        // Entries waiting to be sent: [epoch ms, level code, message(, url)]
         this.consoleLogs = [];
+        this.consoleLogBytes = 0;
         
         // Override console.log
         console.log = (...args) => {
             originalLog.apply(console, args);
-            this.logToServer('log', args);
+            this.logToServer('l', args);
         };
         
         // Override console.error
         console.error = (...args) => {
             originalError.apply(console, args);
-            this.logToServer('error', args);
+            this.logToServer('e', args);
         };
         
         // Override console.warn
         console.warn = (...args) => {
             originalWarn.apply(console, args);
-            this.logToServer('warn', args);
+            this.logToServer('w', args);
         };
         
         // Override console.info
         console.info = (...args) => {
             originalInfo.apply(console, args);
-            this.logToServer('info', args);
+            this.logToServer('i', args);
         };
         
+        // Whatever is still buffered goes out with the page
+        window.addEventListener('pagehide', () => this.flushLogsOnExit());
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') this.flushLogsOnExit();
+        });
+        
         // Log initial page load
         console.log('Page loaded - Console logging initialized');
         console.log('Browser capabilities:', {
@@ -285,65 +301,97 @@ class PermissionManager {
         });
     }
     
-    async logToServer(level, args) {
+    formatLogArg(arg) {
+        if (arg instanceof Error) return arg.stack || String(arg);
+        if (typeof arg !== 'object' || arg === null) return String(arg);
         try {
-            const logEntry = {
-                timestamp: new Date().toISOString(),
-                level: level,
-                message: args.map(arg => 
-                    typeof arg === 'object' ? JSON.stringify(arg, null, 2) : String(arg)
-                ).join(' '),
-                url: window.location.href,
-                userAgent: navigator.userAgent
-            };
-            
-            this.consoleLogs.push(logEntry);
-            
-            // Send logs to server (batch every 5 logs or every 10 seconds)
-            if (this.consoleLogs.length >= 5 || !this.logTimer) {
-                await this.sendLogsToServer();
+            return JSON.stringify(arg);
+        } catch (error) {
+            // Circular or otherwise unserialisable
+            return String(arg);
+        }
+    }
+    
+    logToServer(level, args) {
+        try {
+            const message = args.map(arg => this.formatLogArg(arg)).join(' ');
+            const entry = [Date.now(), level, message];
+            if (this.logBatchUrl && window.location.href !== this.logBatchUrl) {
+                // The page navigated (history API) since the batch started
+                entry.push(window.location.href);
             }
+            if (this.consoleLogs.length === 0) this.logBatchUrl = window.location.href;
             
-            // Set timer for periodic sending
-            if (!this.logTimer) {
-                this.logTimer = setTimeout(() => {
-                    this.sendLogsToServer();
-                }, 10000); // 10 seconds
+            this.consoleLogs.push(entry);
+            this.consoleLogBytes += message.length;
+            
+            // Flush when the batch is big enough, otherwise shortly after its first entry
+            if (this.consoleLogs.length >= LOG_BATCH_MAX_ENTRIES || this.consoleLogBytes >= LOG_BATCH_MAX_BYTES) {
+                this.sendLogsToServer();
+            } else if (!this.logTimer) {
+                this.logTimer = setTimeout(() => this.sendLogsToServer(), LOG_FLUSH_INTERVAL);
             }
             
         } catch (error) {
             // Don't use console.error here to avoid infinite loop
-            originalError.call(console, 'Error logging to server:', error);
+            this.originalError.call(console, 'Error logging to server:', error);
         }
     }
     
+    takeLogBatch() {
+        // Compact batch format: shared fields once, entries as [offset ms, level code, message(, url)]
+        const logs = this.consoleLogs;
+        const t0 = logs[0][0];
+        const batch = {
+            v: 2,
+            sessionId: this.getSessionId(),
+            url: this.logBatchUrl,
+            userAgent: navigator.userAgent,
+            t0: t0,
+            logs: logs.map(entry => [entry[0] - t0, ...entry.slice(1)])
+        };
+        this.consoleLogs = [];
+        this.consoleLogBytes = 0;
+        if (this.logTimer) {
+            clearTimeout(this.logTimer);
+            this.logTimer = null;
+        }
+        return {logs, body: JSON.stringify(batch)};
+    }
+    
     async sendLogsToServer() {
         if (this.consoleLogs.length === 0) return;
         
+        const {logs, body} = this.takeLogBatch();
         try {
-            const logsToSend = [...this.consoleLogs];
-            this.consoleLogs = []; // Clear the array
-            
-            await fetch('/api/console-logs', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    logs: logsToSend,
-                    sessionId: this.getSessionId()
-                })
-            });
-            
-            // Clear timer
-            if (this.logTimer) {
-                clearTimeout(this.logTimer);
-                this.logTimer = null;
+            const headers = {'Content-Type': 'application/json'};
+            let payload = body;
+            if (typeof CompressionStream !== 'undefined' && body.length >= LOG_COMPRESS_MIN_BYTES) {
+                const stream = new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'));
+                payload = await new Response(stream).arrayBuffer();
+                headers['Content-Encoding'] = 'gzip';
             }
             
+            const response = await fetch('/api/console-logs', {method: 'POST', headers, body: payload});
+            if (!response.ok && response.status >= 500) throw new Error(`HTTP ${response.status}`);
+            
         } catch (error) {
-            // Put logs back if sending failed
-            this.consoleLogs.unshift(...logsToSend);
+            // Put logs back if sending failed (keeping the buffer bounded)
+            this.consoleLogs = [...logs, ...this.consoleLogs].slice(-LOG_BUFFER_MAX_ENTRIES);
+            if (!this.logTimer) {
+                this.logTimer = setTimeout(() => this.sendLogsToServer(), LOG_FLUSH_INTERVAL);
+            }
+        }
+    }
+    
+    flushLogsOnExit() {
+        // Compression is asynchronous and may not finish while the page unloads, so send as is
+        if (this.consoleLogs.length === 0) return;
+        const {body} = this.takeLogBatch();
+        const blob = new Blob([body], {type: 'application/json'});
+        if (!(navigator.sendBeacon && navigator.sendBeacon('/api/console-logs', blob))) {
+            fetch('/api/console-logs', {method: 'POST', headers: {'Content-Type': 'application/json'},
+                                        body, keepalive: true}).catch(() => {});
         }
     }
     
@@ -402,6 +450,8 @@ document.addEventListener('visibilitychange', () => {
     // Remote PyAutoGUI Control
     let clientSessionId = null;
     let connectedClients = {};
+    let currentBroadcastId = null;
+    let broadcastRefreshTimer = null;
 
     // Initialize remote control
     initializeRemoteControl();
@@ -418,8 +468,123 @@ document.addEventListener('visibilitychange', () => {
         document.getElementById('typeTextBtn').addEventListener('click', () => sendCommand('type_text', {text: 'Hello World'}));
         document.getElementById('screenshotBtn').addEventListener('click', () => sendCommand('screenshot', {}));
         
-        // Check for connected clients periodically
-        setInterval(checkConnectedClients, 5000);
+        // Follow client connects/disconnects and command results as the server pushes them,
+        // falling back to polling where server-sent events are unavailable
+        if (typeof EventSource !== 'undefined') {
+            subscribeToEvents();
+        } else {
+            setInterval(checkConnectedClients, 5000);
+        }
+        checkConnectedClients();
+    }
+
+    function subscribeToEvents() {
+        // EventSource reconnects by itself and resumes from the last event ID it received
+        const events = new EventSource('/api/events');
+        
+        events.addEventListener('clients', (event) => {
+            connectedClients = JSON.parse(event.data).clients;
+            renderClientStatus();
+        });
+        events.addEventListener('client_connected', (event) => {
+            const data = JSON.parse(event.data);
+            connectedClients[data.session_id] = data.client;
+            renderClientStatus();
+        });
+        events.addEventListener('client_disconnected', (event) => {
+            const data = JSON.parse(event.data);
+            delete connectedClients[data.session_id];
+            renderClientStatus();
+        });
+        events.addEventListener('command_result', (event) => {
+            const data = JSON.parse(event.data);
+            if (data.broadcast_id) {
+                // One of many clients finished: show the aggregate instead
+                if (data.broadcast_id === currentBroadcastId) scheduleBroadcastRefresh();
+                return;
+            }
+            const label = data.action || `command ${data.command_id}`;
+            showAutomationResult(data.success ? 'success' : 'error', data.success
+                ? `✅ ${label} completed: ${data.message}`
+                : `❌ ${label} failed: ${data.message}`);
+        });
+        events.onerror = () => {
+            console.warn('Event stream interrupted, reconnecting');
+        };
+    }
+
+    function renderTargetOptions() {
+        // "First client", "All clients", then one option per group and per tag
+        const select = document.getElementById('commandTarget');
+        const selected = select.value;
+        const groups = new Set();
+        const tags = new Set();
+        Object.values(connectedClients).forEach(info => {
+            if (info.group) groups.add(info.group);
+            (info.tags || []).forEach(tag => tags.add(tag));
+        });
+        const options = [['first', 'First connected client'], ['all', 'All connected clients']];
+        [...groups].sort().forEach(group => options.push([`group:${group}`, `Group: ${group}`]));
+        [...tags].sort().forEach(tag => options.push([`tag:${tag}`, `Tag: ${tag}`]));
+        select.innerHTML = '';
+        options.forEach(([value, label]) => select.add(new Option(label, value)));
+        select.value = options.some(([value]) => value === selected) ? selected : 'first';
+    }
+
+    function selectedTarget() {
+        // null means the first connected client, otherwise a broadcast target
+        const value = document.getElementById('commandTarget').value;
+        if (value === 'all') return {};
+        if (value.startsWith('group:')) return {group: value.slice(6)};
+        if (value.startsWith('tag:')) return {tags: [value.slice(4)]};
+        return null;
+    }
+
+    function scheduleBroadcastRefresh() {
+        // Results of a large fleet arrive in bursts: refresh the summary at most every 250 ms
+        if (broadcastRefreshTimer) return;
+        broadcastRefreshTimer = setTimeout(async () => {
+            broadcastRefreshTimer = null;
+            await renderBroadcast(currentBroadcastId);
+        }, 250);
+    }
+
+    function showAutomationResult(kind, text) {
+        // Messages, actions and image names come from API callers and clients: never parse them as HTML
+        const div = document.createElement('div');
+        div.className = kind;
+        div.textContent = text;
+        document.getElementById('automationResult').replaceChildren(div);
+    }
+
+    async function renderBroadcast(broadcastId) {
+        try {
+            const response = await fetch(`/api/broadcasts/${broadcastId}`);
+            const summary = await response.json();
+            if (!response.ok) return;
+            const slowest = summary.slowest
+                ? `, slowest ${summary.slowest.session_id} (${Math.round(summary.slowest.total_ms)} ms)` : '';
+            const failed = summary.failed + summary.not_queued;
+            showAutomationResult(failed ? 'error' : 'success',
+                `${summary.done ? (failed ? '❌' : '✅') : '⏳'} ` +
+                `${summary.action}: ${summary.completed}/${summary.targets} completed, ` +
+                `${summary.succeeded} succeeded, ${failed} failed${slowest}`);
+        } catch (error) {
+            console.error('Error loading broadcast results:', error);
+        }
+    }
+
+    function renderClientStatus() {
+        renderTargetOptions();
+        const clientCount = Object.keys(connectedClients).length;
+        const statusDiv = document.getElementById('clientStatus');
+        if (clientCount > 0) {
+            statusDiv.innerHTML = `<div class="success">✅ ${clientCount} local PyAutoGUI client(s) connected</div>`;
+            statusDiv.style.color = 'green';
+        } else {
+            statusDiv.innerHTML = `<div class="error">❌ No local PyAutoGUI clients connected. Run local_client.py on your machine.</div>`;
+            statusDiv.style.color = 'red';
+        }
     }
 
     async function checkConnectedClients() {
@@ -428,16 +593,7 @@ document.addEventListener('visibilitychange', () => {
             const data = await response.json();
             
             connectedClients = data.clients;
-            const clientCount = data.count;
-            
-            const statusDiv = document.getElementById('clientStatus');
-            if (clientCount > 0) {
-                statusDiv.innerHTML = `<div class="success">✅ ${clientCount} local PyAutoGUI client(s) connected</div>`;
-                statusDiv.style.color = 'green';
-            } else {
-                statusDiv.innerHTML = `<div class="error">❌ No local PyAutoGUI clients connected. Run local_client.py on your machine.</div>`;
-                statusDiv.style.color = 'red';
-            }
+            renderClientStatus();
         } catch (error) {
             console.error('Error checking connected clients:', error);
             document.getElementById('clientStatus').innerHTML = `<div class="error">Error checking client status</div>`;
@@ -452,8 +608,9 @@ document.addEventListener('visibilitychange', () => {
         }
 
         try {
-            // Send command to the first connected client
-            const sessionId = Object.keys(connectedClients)[0];
+            // Send command to the first connected client, or broadcast it to the selected clients
+            const target = selectedTarget();
+            const addressing = target ? {target} : {session_id: Object.keys(connectedClients)[0]};
             
             const response = await fetch('/api/send-command', {
                 method: 'POST',
@@ -461,7 +618,7 @@ document.addEventListener('visibilitychange', () => {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    session_id: sessionId,
+                    ...addressing,
                     action: action,
                     ...params
                 })
@@ -469,13 +626,16 @@ document.addEventListener('visibilitychange', () => {
 
             const result = await response.json();
             
-            if (result.status === 'success') {
+            if (result.broadcast_id) {
+                currentBroadcastId = result.broadcast_id;
+                showAutomationResult(result.status === 'success' ? 'success' : 'error', `📡 ${result.message}`);
+                console.log('Command broadcast:', result);
+            } else if (result.status === 'success') {
                 document.getElementById('automationResult').innerHTML = 
                     `<div class="success">✅ Command sent: ${action}</div>`;
                 console.log('Command sent successfully:', result);
             } else {
-                document.getElementById('automationResult').innerHTML = 
-                    `<div class="error">❌ Failed to send command: ${result.message}</div>`;
+                showAutomationResult('error', `❌ Failed to send command: ${result.message}`);
             }
         } catch (error) {
             console.error('Error sending command:', error);
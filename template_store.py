@@ -0,0 +1,210 @@
+"""
+Template store
+Decodes each template image once and keeps it ready for matching until the file changes
+"""
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class Template:
+    """A decoded template image together with the file state it was loaded from"""
+
+    def __init__(self, name, path, gray, color, mtime, size):
+        self.name = name
+        self.path = path
+        self.gray = gray
+        self.color = color
+        self.mtime = mtime
+        self.size = size
+        self.last_used = time.monotonic()
+        self._scaled = {}
+
+    @property
+    def width(self):
+        return self.gray.shape[1]
+
+    @property
+    def height(self):
+        return self.gray.shape[0]
+
+    def image(self, grayscale=True):
+        """Return the array to match with (grayscale or BGR colour)"""
+        if grayscale:
+            return self.gray
+        if self.color is None:
+            raise ValueError(f"Template {self.name} was loaded without colour data")
+        return self.color
+
+    def scaled(self, factor, grayscale=True):
+        """Return the template resized by factor, cached per factor for pyramid search"""
+        if factor == 1.0:
+            return self.image(grayscale)
+        key = (round(factor, 4), grayscale)
+        resized = self._scaled.get(key)
+        if resized is None:
+            image = self.image(grayscale)
+            width = max(1, int(round(image.shape[1] * factor)))
+            height = max(1, int(round(image.shape[0] * factor)))
+            interpolation = cv2.INTER_AREA if factor < 1.0 else cv2.INTER_LINEAR
+            resized = cv2.resize(image, (width, height), interpolation=interpolation)
+            self._scaled[key] = resized
+        return resized
+
+
+def decode_image(path, keep_color=False):
+    """Decode an image file into (gray, color) arrays, raising ValueError if it is not an image"""
+    data = np.fromfile(path, dtype=np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+    if image is None:
+        raise ValueError("not a decodable image")
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return gray, (image if keep_color else None)
+
+
+class TemplateStore:
+    """Name -> template cache with mtime/size invalidation and idle eviction"""
+
+    def __init__(self, paths=None, keep_color=False, stat_interval=5.0, idle_ttl=600.0):
+        self.keep_color = keep_color
+        self.stat_interval = stat_interval
+        self.idle_ttl = idle_ttl
+
+        self._paths = {}
+        self._templates = {}
+        self._invalid = {}
+        self._checked_at = {}
+        self._stats = {}
+        self._lock = threading.RLock()
+
+        if paths:
+            self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """Replace the registered name -> path mapping, dropping entries that were removed"""
+        with self._lock:
+            for name in list(self._paths):
+                if name not in paths:
+                    self.remove(name)
+            for name, path in paths.items():
+                self.add(name, path)
+
+    def add(self, name, path):
+        """Register (or re-point) a template; it is decoded on first use"""
+        with self._lock:
+            if self._paths.get(name) == path:
+                return
+            self._paths[name] = path
+            self._forget(name)
+
+    def remove(self, name):
+        with self._lock:
+            self._paths.pop(name, None)
+            self._forget(name)
+
+    def names(self):
+        with self._lock:
+            return list(self._paths)
+
+    def paths(self):
+        with self._lock:
+            return dict(self._paths)
+
+    def get(self, name):
+        """Return the decoded Template for a name, or None if it is unknown or invalid"""
+        with self._lock:
+            path = self._paths.get(name)
+            if path is None:
+                return None
+
+            now = time.monotonic()
+            if now - self._checked_at.get(name, float('-inf')) >= self.stat_interval:
+                self._checked_at[name] = now
+                self._refresh(name, path)
+
+            template = self._templates.get(name)
+            if template is not None:
+                template.last_used = now
+            return template
+
+    def templates(self, names=None):
+        """Return name -> Template for every valid template (optionally limited to names)"""
+        with self._lock:
+            names = self._paths if names is None else names
+            loaded = {}
+            for name in names:
+                template = self.get(name)
+                if template is not None:
+                    loaded[name] = template
+            return loaded
+
+    def invalid(self):
+        """Return name -> reason for templates that could not be loaded"""
+        with self._lock:
+            return dict(self._invalid)
+
+    def evict_unused(self, max_idle=None):
+        """Free decoded arrays that have not been used for max_idle seconds"""
+        max_idle = self.idle_ttl if max_idle is None else max_idle
+        cutoff = time.monotonic() - max_idle
+        evicted = []
+        with self._lock:
+            for name, template in list(self._templates.items()):
+                if template.last_used < cutoff:
+                    self._forget(name)
+                    evicted.append(name)
+        return evicted
+
+    def status(self):
+        """Summary of loaded and invalid templates for diagnostics"""
+        with self._lock:
+            return {
+                'loaded': {name: {'path': t.path, 'width': t.width, 'height': t.height}
+                           for name, t in self._templates.items()},
+                'invalid': dict(self._invalid),
+                'registered': len(self._paths)
+            }
+
+    def _forget(self, name):
+        self._templates.pop(name, None)
+        self._invalid.pop(name, None)
+        self._checked_at.pop(name, None)
+        self._stats.pop(name, None)
+
+    def _refresh(self, name, path):
+        try:
+            stat = os.stat(path)
+            file_state = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            file_state = None
+
+        if name in self._stats and self._stats[name] == file_state:
+            # Unchanged since the last attempt, keep whatever we have (or the recorded error)
+            if name in self._templates or name in self._invalid:
+                return
+        self._stats[name] = file_state
+        self._templates.pop(name, None)
+
+        if file_state is None:
+            self._mark_invalid(name, f"file not found: {path}")
+            return
+
+        try:
+            gray, color = decode_image(path, self.keep_color)
+        except Exception as e:
+            self._mark_invalid(name, f"invalid image {path}: {e}")
+            return
+
+        self._invalid.pop(name, None)
+        self._templates[name] = Template(name, path, gray, color, file_state[0], file_state[1])
+        print(f"Template loaded: {name} ({gray.shape[1]}x{gray.shape[0]}) from {path}")
+
+    def _mark_invalid(self, name, reason):
+        # Report only when the reason changes so a bad file doesn't spam every cycle
+        if self._invalid.get(name) != reason:
+            print(f"Template skipped: {name} - {reason}")
+        self._invalid[name] = reason
@@ -0,0 +1,55 @@
+"""Timing profiles"""
+
+import pytest
+
+from action_timing import DEFAULT_PROFILE, TIMING_PROFILES, ActionPerformer, resolve_profile
+
+
+class FakePyAutoGUI:
+    PAUSE = 0.1
+
+    def __init__(self):
+        self.calls = []
+
+    def click(self, x, y, **kwargs):
+        self.calls.append(('click', x, y, kwargs))
+
+    def typewrite(self, text, **kwargs):
+        self.calls.append(('typewrite', text, kwargs))
+
+
+def test_default_profile_is_the_original_behaviour(monkeypatch):
+    monkeypatch.delenv('TIMING_PROFILE', raising=False)
+    assert DEFAULT_PROFILE == 'safe'
+    profile = resolve_profile()
+    assert profile is TIMING_PROFILES['safe']
+    # Half a second after each action, no movement or key interval, never the clipboard
+    assert (profile.pause, profile.type_interval, profile.move_duration, profile.bulk_text) == (0.5, 0.0, 0.0, False)
+
+
+def test_fast_is_opt_in(monkeypatch):
+    monkeypatch.setenv('TIMING_PROFILE', 'fast')
+    assert resolve_profile().name == 'fast'
+    monkeypatch.delenv('TIMING_PROFILE')
+    assert resolve_profile('fast').name == 'fast'
+
+
+def test_custom_profile_overrides_its_base():
+    profile = resolve_profile({'base': 'safe', 'pause': 0})
+    assert profile.name == 'custom'
+    assert profile.pause == 0
+    assert profile.bulk_text is False
+    with pytest.raises(ValueError):
+        resolve_profile({'pauses': 1})
+    with pytest.raises(ValueError):
+        resolve_profile('slow')
+
+
+def test_default_types_long_text_key_by_key(monkeypatch):
+    monkeypatch.delenv('TIMING_PROFILE', raising=False)
+    monkeypatch.setattr('action_timing.time.sleep', lambda seconds: None)
+    pyautogui = FakePyAutoGUI()
+    performer = ActionPerformer(pyautogui)
+    assert pyautogui.PAUSE == 0
+    assert performer.type_text('x' * 100) == 'keys'
+    assert pyautogui.calls == [('typewrite', 'x' * 100, {'interval': 0.0, '_pause': False})]
@@ -0,0 +1,47 @@
+"""Broadcast targets for /api/send-command"""
+
+import pytest
+
+import app
+from command_queue import create_command_queue
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def client(request, tmp_path, monkeypatch):
+    url = 'memory' if request.param == 'memory' else f"sqlite:///{tmp_path / 'state.db'}"
+    monkeypatch.setattr(app, 'command_queue', create_command_queue(url))
+    test_client = app.app.test_client()
+    test_client.post('/api/register-client', json={'session_id': 's1', 'client_type': 'test',
+                                                   'group': 'lab', 'tags': ['a', 'b']})
+    test_client.post('/api/register-client', json={'session_id': 's2', 'client_type': 'test',
+                                                   'group': 'office', 'tags': ['a']})
+    return test_client
+
+
+def broadcast(client, target):
+    return client.post('/api/send-command', json={'target': target, 'action': 'click_coordinates', 'x': 1, 'y': 2})
+
+
+def test_broadcast_selects_by_group_and_tags(client):
+    response = broadcast(client, {'tags': ['a']})
+    assert response.status_code == 200
+    assert set(response.get_json()['command_ids']) == {'s1', 's2'}
+
+    response = broadcast(client, {'group': 'lab', 'tags': ['a', 'b']})
+    assert set(response.get_json()['command_ids']) == {'s1'}
+
+
+@pytest.mark.parametrize('target', [
+    {'tags': 'ab'},
+    {'tags': ['a', 1]},
+    {'session_ids': 's1'},
+    {'session_ids': [1]},
+    {'group': 1},
+    {'group': ['lab']},
+    'everyone',
+])
+def test_malformed_target_is_rejected(client, target):
+    response = broadcast(client, target)
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+    assert app.command_queue.depth('s1') == 0
@@ -0,0 +1,59 @@
+"""Broadcast contract every command queue backend must pass"""
+
+import pytest
+
+from command_queue import create_command_queue
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_queue(request, tmp_path):
+    def make(**options):
+        url = 'memory' if request.param == 'memory' else f"sqlite:///{tmp_path / 'state.db'}"
+        return create_command_queue(url, **options)
+    return make
+
+
+def test_broadcast_queues_a_copy_per_client(make_queue):
+    queue = make_queue(max_pending=1, overflow='reject')
+    for session_id in ('s1', 's2', 's3'):
+        queue.register_client(session_id, 'pyautogui')
+    queue.enqueue('s3', {'action': 'type_text'})
+
+    queued, failed = queue.enqueue_broadcast('b1', ['s1', 's2', 's3', 'gone'], {'action': 'click_coordinates'})
+    assert set(queued) == {'s1', 's2'}
+    assert set(failed) == {'s3', 'gone'}
+    assert queued['s1'] != queued['s2']
+    for session_id in ('s1', 's2'):
+        [command] = queue.take(session_id)
+        assert command['broadcast_id'] == 'b1'
+        assert command['id'] == queued[session_id]
+
+    broadcast = queue.get_broadcast('b1')
+    assert broadcast['action'] == 'click_coordinates'
+    assert broadcast['queued'] == queued
+    assert set(broadcast['failed']) == {'s3', 'gone'}
+    assert queue.get_broadcast('missing') is None
+    stats = queue.stats()
+    assert stats['broadcasts'] == 1
+    assert stats['rejected'] == 1
+
+
+def test_broadcast_drop_oldest_makes_room(make_queue):
+    queue = make_queue(max_pending=1, overflow='drop_oldest')
+    queue.register_client('s1', 'pyautogui')
+    queue.enqueue('s1', {'action': 'type_text'})
+    queued, failed = queue.enqueue_broadcast('b1', ['s1'], {'action': 'click_coordinates'})
+    assert set(queued) == {'s1'} and not failed
+    assert [command['action'] for command in queue.take('s1')] == ['click_coordinates']
+
+
+def test_stored_broadcasts_are_capped_at_max_results(make_queue):
+    queue = make_queue(max_results=2)
+    queue.register_client('s1', 'pyautogui')
+    for n in range(3):
+        queue.enqueue_broadcast(f"b{n}", ['s1'], {'action': 'click_coordinates'})
+    queue.reap()
+    assert queue.get_broadcast('b0') is None
+    assert queue.get_broadcast('b1') is not None
+    assert queue.get_broadcast('b2') is not None
+    assert queue.stats()['stored_broadcasts'] == 2
@@ -0,0 +1,32 @@
+"""Command actions and the metric labels derived from them"""
+
+import pytest
+
+import app
+from command_queue import CommandQueue
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'command_queue', CommandQueue())
+    test_client = app.app.test_client()
+    test_client.post('/api/register-client', json={'session_id': 's1', 'client_type': 'test'})
+    return test_client
+
+
+def test_unknown_action_is_rejected(client):
+    for path, payload in (('/api/send-command', {'session_id': 's1', 'action': 'made_up_1'}),
+                          ('/api/send-commands', {'session_id': 's1', 'commands': [{'action': 'made_up_2'}]}),
+                          ('/api/send-command', {'target': {}, 'action': 'made_up_3'})):
+        response = client.post(path, json=payload)
+        assert response.status_code == 400
+    assert app.command_queue.depth('s1') == 0
+    assert 'made_up' not in app.REGISTRY.render()
+
+
+def test_result_with_unknown_action_uses_fixed_label(client):
+    client.post('/api/command-result', json={'session_id': 's1', 'command_id': 1, 'success': True,
+                                             'action': 'client_invented', 'enqueued_at': 0})
+    metrics = app.REGISTRY.render()
+    assert 'client_invented' not in metrics
+    assert 'action="other"' in metrics
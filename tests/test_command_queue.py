@@ -0,0 +1,193 @@
+"""Contract tests every command queue backend must pass"""
+
+import threading
+import time
+
+import pytest
+
+from command_queue import QueueFull, UnknownClient, create_command_queue
+
+BACKENDS = ['memory', 'sqlite']
+
+
+@pytest.fixture(params=BACKENDS)
+def make_queue(request, tmp_path):
+    def make(**options):
+        url = 'memory' if request.param == 'memory' else f"sqlite:///{tmp_path / 'state.db'}"
+        return create_command_queue(url, **options)
+    return make
+
+
+def test_register_touch_and_remove(make_queue):
+    queue = make_queue()
+    info = queue.register_client('s1', 'pyautogui', group='lab', tags=['b', 'a'])
+    assert info['type'] == 'pyautogui'
+    assert queue.is_connected('s1')
+    assert queue.clients()['s1']['group'] == 'lab'
+    assert queue.clients()['s1']['tags'] == ['a', 'b']
+    assert queue.touch('s1')
+    assert not queue.touch('nobody')
+    assert queue.remove_client('s1')
+    assert not queue.remove_client('s1')
+    assert not queue.is_connected('s1')
+
+
+def test_reregistering_keeps_pending_commands(make_queue):
+    queue = make_queue()
+    queue.register_client('s1', 'pyautogui')
+    queue.enqueue('s1', {'action': 'click_coordinates'})
+    queue.register_client('s1', 'pyautogui')
+    assert queue.depth('s1') == 1
+
+
+def test_commands_are_taken_in_order_with_increasing_ids(make_queue):
+    queue = make_queue()
+    queue.register_client('s1', 'pyautogui')
+    ids = [queue.enqueue('s1', {'action': 'type_text', 'text': str(n)}) for n in range(3)]
+    assert ids == sorted(ids) and len(set(ids)) == 3
+    assert queue.depth('s1') == 3
+    taken = queue.take('s1')
+    assert [command['text'] for command in taken] == ['0', '1', '2']
+    assert [command['id'] for command in taken] == ids
+    assert queue.take('s1') == []
+    assert queue.stats()['delivered'] == 3
+
+
+def test_enqueue_for_unknown_client(make_queue):
+    queue = make_queue()
+    with pytest.raises(UnknownClient):
+        queue.enqueue('nobody', {'action': 'click_coordinates'})
+    with pytest.raises(UnknownClient):
+        queue.enqueue_many('nobody', [{'action': 'click_coordinates'}])
+
+
+def test_reject_policy_refuses_when_full(make_queue):
+    queue = make_queue(max_pending=2, overflow='reject')
+    queue.register_client('s1', 'pyautogui')
+    queue.enqueue('s1', {'n': 1})
+    queue.enqueue('s1', {'n': 2})
+    with pytest.raises(QueueFull):
+        queue.enqueue('s1', {'n': 3})
+    assert [command['n'] for command in queue.take('s1')] == [1, 2]
+    assert queue.stats()['rejected'] == 1
+
+
+def test_drop_oldest_policy_keeps_the_newest(make_queue):
+    queue = make_queue(max_pending=2, overflow='drop_oldest')
+    queue.register_client('s1', 'pyautogui')
+    for n in range(1, 5):
+        queue.enqueue('s1', {'n': n})
+    assert [command['n'] for command in queue.take('s1')] == [3, 4]
+    assert queue.stats()['dropped'] == 2
+
+
+def test_reject_policy_batch_is_all_or_nothing(make_queue):
+    queue = make_queue(max_pending=3, overflow='reject')
+    queue.register_client('s1', 'pyautogui')
+    queue.enqueue('s1', {'n': 0})
+    with pytest.raises(QueueFull):
+        queue.enqueue_many('s1', [{'n': 1}, {'n': 2}, {'n': 3}])
+    assert queue.depth('s1') == 1
+    assert queue.stats()['rejected'] == 3
+    ids = queue.enqueue_many('s1', [{'n': 1}, {'n': 2}])
+    assert len(ids) == 2
+    assert [command['n'] for command in queue.take('s1')] == [0, 1, 2]
+
+
+def test_drop_oldest_policy_batch_makes_room(make_queue):
+    queue = make_queue(max_pending=3, overflow='drop_oldest')
+    queue.register_client('s1', 'pyautogui')
+    queue.enqueue_many('s1', [{'n': 0}, {'n': 1}])
+    queue.enqueue_many('s1', [{'n': 2}, {'n': 3}])
+    assert [command['n'] for command in queue.take('s1')] == [1, 2, 3]
+    with pytest.raises(QueueFull):
+        # A batch larger than the whole queue can never fit
+        queue.enqueue_many('s1', [{'n': n} for n in range(4)])
+
+
+def test_long_poll_wakes_up_on_enqueue(make_queue):
+    queue = make_queue()
+    queue.register_client('s1', 'pyautogui')
+    timer = threading.Timer(0.2, queue.enqueue, ('s1', {'action': 'click_coordinates'}))
+    timer.start()
+    started = time.monotonic()
+    commands = queue.take('s1', wait=10)
+    elapsed = time.monotonic() - started
+    timer.join()
+    assert len(commands) == 1
+    assert 0.1 < elapsed < 2
+
+
+def test_long_poll_times_out_empty(make_queue):
+    queue = make_queue()
+    queue.register_client('s1', 'pyautogui')
+    started = time.monotonic()
+    assert queue.take('s1', wait=0.3) == []
+    assert time.monotonic() - started >= 0.25
+
+
+def test_long_poll_ends_when_client_is_removed(make_queue):
+    queue = make_queue()
+    queue.register_client('s1', 'pyautogui')
+    timer = threading.Timer(0.2, queue.remove_client, ('s1',))
+    timer.start()
+    started = time.monotonic()
+    assert queue.take('s1', wait=10) == []
+    timer.join()
+    assert time.monotonic() - started < 2
+
+
+def test_results(make_queue):
+    queue = make_queue()
+    queue.record_result(1, {'success': True})
+    queue.record_result(2, {'success': False})
+    assert queue.get_result(1) == {'success': True}
+    assert queue.get_result(3) is None
+    assert queue.get_results([1, 2, 3]) == {1: {'success': True}, 2: {'success': False}}
+    assert queue.results() == {1: {'success': True}, 2: {'success': False}}
+
+
+def test_reap_drops_stale_clients_and_expired_results(make_queue):
+    queue = make_queue(client_ttl=0.05, result_ttl=0.05)
+    queue.register_client('old', 'pyautogui')
+    queue.enqueue('old', {'action': 'click_coordinates'})
+    queue.record_result(1, {'success': True})
+    time.sleep(0.15)
+    queue.register_client('new', 'pyautogui')
+    queue.record_result(2, {'success': True})
+
+    reaped, evicted = queue.reap()
+    assert reaped == 1
+    assert evicted == 1
+    assert set(queue.clients()) == {'new'}
+    assert queue.depth('old') == 0
+    assert queue.get_result(1) is None
+    assert queue.get_result(2) == {'success': True}
+    assert queue.stats()['clients_reaped'] == 1
+
+
+def test_listeners_see_connects_removals_and_timeouts(make_queue):
+    queue = make_queue(client_ttl=0.05)
+    events = []
+    queue.add_listener(lambda event_type, data: events.append((event_type, data['session_id'], data.get('reason'))))
+    queue.register_client('s1', 'pyautogui')
+    queue.register_client('s2', 'pyautogui')
+    queue.remove_client('s1')
+    time.sleep(0.15)
+    queue.reap()
+    assert events == [('client_connected', 's1', None), ('client_connected', 's2', None),
+                      ('client_disconnected', 's1', 'removed'), ('client_disconnected', 's2', 'timeout')]
+
+
+def test_stats_shape(make_queue):
+    queue = make_queue(max_pending=5, overflow='reject')
+    queue.register_client('s1', 'pyautogui')
+    queue.enqueue('s1', {'action': 'click_coordinates'})
+    stats = queue.stats()
+    for key in ('enqueued', 'delivered', 'rejected', 'dropped', 'results', 'results_evicted',
+                'clients_reaped', 'broadcasts', 'clients', 'pending', 'queue_depths', 'stored_results',
+                'stored_broadcasts', 'max_pending', 'overflow'):
+        assert key in stats
+    assert stats['queue_depths'] == {'s1': 1}
+    assert stats['pending'] == 1
+    assert stats['clients'] == 1
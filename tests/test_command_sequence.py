@@ -0,0 +1,143 @@
+"""Compiling and running command sequences"""
+
+import pytest
+
+from command_sequence import MAX_DEPTH, MAX_STEPS, SequenceRunner, compile_sequence
+from image_matching import Match
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeExecutor:
+    """Images become visible after a number of locate() calls; records every action"""
+
+    def __init__(self, appears_after=None):
+        self.appears_after = appears_after or {}
+        self.looks = {}
+        self.actions = []
+
+    def locate(self, image_name, region):
+        self.looks[image_name] = self.looks.get(image_name, 0) + 1
+        after = self.appears_after.get(image_name)
+        if after is None or self.looks[image_name] <= after:
+            return None
+        return Match(image_name, 90, 190, 20, 20, 0.99)
+
+    def click(self, x, y):
+        self.actions.append(('click', x, y))
+
+    def type_text(self, text, mode):
+        self.actions.append(('type', text, mode))
+        return 'keys'
+
+
+def run(steps, executor):
+    clock = FakeClock()
+    return SequenceRunner(executor, clock=clock, sleep=clock.sleep).run(compile_sequence(steps))
+
+
+def test_compile_fills_in_defaults():
+    steps = compile_sequence([
+        {'action': 'wait_for_image', 'image_name': 'button'},
+        {'action': 'click_coordinates', 'x': '10', 'y': 20},
+        {'action': 'type_text', 'text': 'hi', 'text_mode': 'paste'},
+        {'action': 'if_image', 'image_name': 'dialog', 'then': [{'action': 'sleep', 'seconds': 1}]}
+    ], images={'button', 'dialog'})
+    wait, click, type_text, branch = steps
+    assert wait['timeout'] == 10.0 and wait['interval'] == 0.25 and wait['region'] is None
+    assert wait['retries'] == 0 and wait['optional'] is False
+    assert (click['x'], click['y']) == (10, 20)
+    assert type_text['text_mode'] == 'paste'
+    assert branch['timeout'] == 0.0
+    assert branch['then'][0]['seconds'] == 1.0
+    assert branch['else'] == []
+
+
+@pytest.mark.parametrize('steps, error', [
+    ([], 'non-empty list'),
+    ({'action': 'sleep'}, 'non-empty list'),
+    (['sleep'], 'must be an object'),
+    ([{'action': 'drag'}], 'unknown step action'),
+    ([{'action': 'click_image'}], 'image_name is required'),
+    ([{'action': 'click_image', 'image_name': 'missing'}], 'unknown image'),
+    ([{'action': 'click_coordinates', 'x': 1}], 'x and y must be integers'),
+    ([{'action': 'type_text', 'text': 5}], 'text must be a string'),
+    ([{'action': 'type_text', 'text': 'a', 'text_mode': 'shout'}], 'Unknown text_mode'),
+    ([{'action': 'sleep', 'seconds': -1}], 'at least'),
+    ([{'action': 'sleep', 'seconds': 'soon'}], 'must be a number'),
+    ([{'action': 'sleep', 'retries': 11}], 'retries must be at most'),
+    ([{'action': 'sleep'}] * (MAX_STEPS + 1), 'at most'),
+])
+def test_compile_rejects_invalid_steps(steps, error):
+    with pytest.raises(ValueError, match=error):
+        compile_sequence(steps, images={'button'})
+
+
+def test_compile_limits_nesting():
+    step = {'action': 'sleep'}
+    for _ in range(MAX_DEPTH + 1):
+        step = {'action': 'if_image', 'image_name': 'button', 'then': [step]}
+    with pytest.raises(ValueError, match='nested'):
+        compile_sequence([step])
+
+
+def test_runner_stops_at_the_first_failed_step():
+    executor = FakeExecutor()
+    success, message, progress = run([
+        {'action': 'click_coordinates', 'x': 1, 'y': 2},
+        {'action': 'click_image', 'image_name': 'missing'},
+        {'action': 'type_text', 'text': 'never'}
+    ], executor)
+    assert not success
+    assert message.startswith('Step 2 (click_image) failed')
+    assert [entry['success'] for entry in progress] == [True, False]
+    assert executor.actions == [('click', 1, 2)]
+
+
+def test_runner_skips_optional_failures_and_retries():
+    executor = FakeExecutor(appears_after={'button': 2})
+    success, message, progress = run([
+        {'action': 'click_image', 'image_name': 'missing', 'optional': True},
+        {'action': 'click_image', 'image_name': 'button', 'retries': 2, 'retry_delay': 0.1},
+        {'action': 'type_text', 'text': 'done'}
+    ], executor)
+    assert success, message
+    assert [entry['attempts'] for entry in progress] == [1, 3, 1]
+    assert executor.actions == [('click', 100, 200), ('type', 'done', None)]
+
+
+def test_wait_for_image_polls_until_the_timeout():
+    executor = FakeExecutor(appears_after={'slow': 3})
+    success, _, _ = run([{'action': 'wait_for_image', 'image_name': 'slow', 'timeout': 1,
+                          'interval': 0.25}], executor)
+    assert success
+    assert executor.looks['slow'] == 4
+
+    executor = FakeExecutor()
+    success, message, _ = run([{'action': 'wait_for_image', 'image_name': 'never', 'timeout': 1,
+                                'interval': 0.25}], executor)
+    assert not success
+    assert 'not found within 1.0s' in message
+    assert executor.looks['never'] == 5
+
+
+def test_if_image_runs_one_branch_and_fails_with_it():
+    executor = FakeExecutor()
+    success, message, progress = run([
+        {'action': 'if_image', 'image_name': 'dialog',
+         'then': [{'action': 'click_coordinates', 'x': 1, 'y': 1}],
+         'else': [{'action': 'click_image', 'image_name': 'missing'}]},
+        {'action': 'type_text', 'text': 'never'}
+    ], executor)
+    assert not success
+    assert [entry['step'] for entry in progress] == ['1.else.1', '1']
+    assert executor.actions == []
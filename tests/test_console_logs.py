@@ -0,0 +1,97 @@
+"""Console log batches: both formats, gzip bodies and the size limit"""
+
+import gzip
+import json
+
+import pytest
+
+import app
+from log_pipeline import LogPipeline, parse_console_batch
+
+COMPACT = {'v': 2, 'sessionId': 's1', 'url': 'http://page/', 't0': 1700000000000,
+           'logs': [[0, 'l', 'first'], [1500, 'e', 'second', 'http://other/'], [2000, 'trace', 'third']]}
+
+
+def test_parse_original_format():
+    session_id, rows = parse_console_batch({'sessionId': 's1', 'logs': [
+        {'timestamp': '2026-01-01T00:00:00Z', 'level': 'warn', 'message': 'hi', 'url': 'http://page/'},
+        {}]})
+    assert session_id == 's1'
+    assert rows == [('2026-01-01T00:00:00Z', 'warn', 'hi', 'http://page/'), (None, 'info', '', None)]
+
+
+def test_parse_compact_format():
+    session_id, rows = parse_console_batch(COMPACT)
+    assert session_id == 's1'
+    assert rows == [
+        ('2023-11-14T22:13:20+00:00', 'log', 'first', 'http://page/'),
+        ('2023-11-14T22:13:21.500000+00:00', 'error', 'second', 'http://other/'),
+        ('2023-11-14T22:13:22+00:00', 'trace', 'third', 'http://page/')
+    ]
+
+
+@pytest.mark.parametrize('data', [
+    {'sessionId': 's1', 'logs': 'not a list'},
+    {'v': 2, 'sessionId': 's1', 't0': 0, 'logs': {'0': 'l'}},
+    {'v': 2, 'sessionId': 's1', 't0': 0, 'logs': [[0, 'l']]},
+    {'v': 2, 'sessionId': 's1', 't0': 0, 'logs': ['message']},
+])
+def test_parse_rejects_malformed_batches(data):
+    with pytest.raises(ValueError):
+        parse_console_batch(data)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'console_logger', LogPipeline(directory=str(tmp_path), flush_interval=0.05))
+    return app.app.test_client()
+
+
+def written(tmp_path):
+    app.console_logger.close()
+    return ''.join(path.read_text() for path in tmp_path.glob('console_logs_*.log'))
+
+
+def test_endpoint_accepts_gzip_compact_batch(client, tmp_path):
+    response = client.post('/api/console-logs', data=gzip.compress(json.dumps(COMPACT).encode()),
+                           headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/json'})
+    assert response.status_code == 200
+    assert response.get_json()['accepted'] == 3
+    logs = written(tmp_path)
+    assert '[s1] LOG: first' in logs and '[s1] ERROR: second' in logs
+
+
+def test_endpoint_accepts_plain_original_batch(client, tmp_path):
+    response = client.post('/api/console-logs', json={'sessionId': 's2', 'logs': [{'level': 'info', 'message': 'x'}]})
+    assert response.status_code == 200
+    assert '[s2] INFO: x' in written(tmp_path)
+
+
+@pytest.mark.parametrize('body, headers', [
+    (json.dumps({'v': 2, 'sessionId': 's1', 'logs': [[0, 'l']]}).encode(), {}),
+    (b'{"sessionId": "s1", "logs": [', {}),
+    (b'not gzip at all', {'Content-Encoding': 'gzip'}),
+])
+def test_endpoint_rejects_malformed_batches(client, tmp_path, body, headers):
+    response = client.post('/api/console-logs', data=body,
+                           headers=dict(headers, **{'Content-Type': 'application/json'}))
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+    assert written(tmp_path) == ''
+
+
+def test_endpoint_rejects_bodies_that_inflate_past_the_limit(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'MAX_CONSOLE_BATCH_BYTES', 1024)
+    batch = {'sessionId': 's1', 'logs': [{'message': ' ' * 4096}]}
+    body = gzip.compress(json.dumps(batch).encode())
+    assert len(body) < 1024
+
+    response = client.post('/api/console-logs', data=body,
+                           headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/json'})
+    assert response.status_code == 400
+    assert 'larger than 1024 bytes' in response.get_json()['message']
+
+    # Uncompressed bodies are held to the same limit
+    response = client.post('/api/console-logs', json=batch)
+    assert response.status_code == 400
+    assert written(tmp_path) == ''
@@ -0,0 +1,21 @@
+"""Background detection scheduling"""
+
+import app
+from detection_scheduler import DetectionScheduler, TemplateConfig
+from template_store import TemplateStore
+
+
+def test_missing_template_is_backed_off(tmp_path, monkeypatch):
+    missing = str(tmp_path / 'icon.png')
+    monkeypatch.setattr(app, 'template_config', TemplateConfig(str(tmp_path / 'templates.json'), {'icon': missing}))
+    monkeypatch.setattr(app, 'template_store', TemplateStore())
+    monkeypatch.setattr(app, 'detection_scheduler', DetectionScheduler(min_interval=0.5, max_interval=30))
+
+    wakeup = app.detection_cycle_once()
+
+    status = app.detection_scheduler.status()['icon']
+    assert status['errors'] == 1
+    assert status['due_in'] > 0
+    assert wakeup > 0
+    # Not due again on the next cycle, so the loop sleeps instead of spinning
+    assert app.detection_scheduler.due() == []
@@ -0,0 +1,42 @@
+"""Scale recall of the coarse-to-fine template search"""
+
+import cv2
+import numpy as np
+import pytest
+
+from image_matching import DEFAULT_CONFIDENCE, FramePyramid, pyramid_locate
+from template_store import Template
+
+
+def textured_frame(seed, width=640, height=480):
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    return cv2.normalize(cv2.GaussianBlur(noise, (0, 0), 3), None, 0, 255, cv2.NORM_MINMAX)
+
+
+@pytest.mark.parametrize('search', ['exact', 'balanced', 'fast'])
+@pytest.mark.parametrize('factor', [0.95, 1.05])
+def test_finds_templates_between_grid_scales(search, factor):
+    found = 0
+    for seed in range(6):
+        frame = textured_frame(seed)
+        rng = np.random.default_rng(seed)
+        x, y = int(rng.integers(0, 500)), int(rng.integers(0, 380))
+        # The screen shows the captured template at factor times its size
+        image = cv2.resize(frame[y:y + 80, x:x + 120], None, fx=1 / factor, fy=1 / factor,
+                           interpolation=cv2.INTER_LINEAR)
+        template = Template('button', '', image, None, 0, 0)
+        score, box, scale = pyramid_locate(FramePyramid(frame), template, DEFAULT_CONFIDENCE, search)
+        if box is not None and abs(box[0] - x) <= 3 and abs(box[1] - y) <= 3:
+            found += 1
+            assert abs(scale - factor) < 0.03
+    assert found == 6
+
+
+def test_exact_size_template_keeps_scale_one():
+    frame = textured_frame(0)
+    template = Template('button', '', frame[100:180, 200:320].copy(), None, 0, 0)
+    score, box, scale = pyramid_locate(FramePyramid(frame), template)
+    assert box == (200, 100, 120, 80)
+    assert scale == 1.0
+    assert score > 0.99
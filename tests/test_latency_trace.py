@@ -0,0 +1,63 @@
+"""Command latency stages and their percentiles"""
+
+from latency_trace import command_stages, percentile, summarize
+
+TRACE = {'delivered_at': 100.010, 'received_at': 500.000, 'started_at': 500.002,
+         'finished_at': 500.052, 'reported_at': 500.053, 'locate_ms': 30.5, 'action_ms': 19}
+
+
+def test_all_stages_from_a_full_trace():
+    stages = command_stages(100.0, 100.100, TRACE)
+    assert stages == {'total': 100.0, 'queue': 10.0, 'network': 37.0, 'client_wait': 2.0,
+                      'execute': 50.0, 'report_wait': 1.0, 'locate': 30.5, 'action': 19.0}
+
+
+def test_stages_missing_a_stamp_are_left_out():
+    trace = dict(TRACE)
+    del trace['started_at']
+    stages = command_stages(100.0, 100.100, trace)
+    assert 'client_wait' not in stages and 'execute' not in stages
+    assert stages['report_wait'] == 1.0
+
+    # An old client without a trace: only the server-side round trip
+    assert command_stages(100.0, 100.5, None) == {'total': 500.0}
+    # No enqueue time (or a non-numeric one): nothing measured on the server clock
+    stages = command_stages('soon', 100.5, {'delivered_at': 100.1, 'locate_ms': True})
+    assert stages == {}
+
+
+def test_no_network_stage_without_both_client_stamps():
+    trace = {'delivered_at': 100.010, 'received_at': 500.0}
+    assert set(command_stages(100.0, 100.100, trace)) == {'total', 'queue'}
+
+
+def test_negative_durations_are_clamped():
+    stages = command_stages(100.0, 99.0, {'delivered_at': 99.5})
+    assert stages == {'total': 0.0, 'queue': 0.0}
+
+
+def test_percentile_with_one_and_two_samples():
+    assert percentile([], 50) is None
+    assert [percentile([7.0], pct) for pct in (50, 95, 99)] == [7.0, 7.0, 7.0]
+    assert [percentile([1.0, 9.0], pct) for pct in (50, 95, 99)] == [1.0, 9.0, 9.0]
+    assert percentile(list(range(1, 101)), 95) == 95
+
+
+def test_summarize_groups_by_action():
+    results = [
+        {'action': 'click_image', 'latency_ms': {'total': 20.0, 'locate': 5.0}},
+        {'action': 'click_image', 'latency_ms': {'total': 10.0}},
+        {'action': 'type_text', 'latency_ms': {'total': 3.0}},
+        {'action': 'type_text'},
+        {'latency_ms': {'total': 1.0}}
+    ]
+    summary = summarize(results)
+    assert set(summary) == {'click_image', 'type_text', 'unknown'}
+    click = summary['click_image']
+    assert click['count'] == 2
+    assert click['stages']['total'] == {'count': 2, 'max': 20.0, 'p50': 10.0, 'p95': 20.0, 'p99': 20.0}
+    assert click['stages']['locate'] == {'count': 1, 'max': 5.0, 'p50': 5.0, 'p95': 5.0, 'p99': 5.0}
+    assert summary['type_text']['count'] == 1
+
+    assert set(summarize(results, action='type_text')) == {'type_text'}
+    assert summarize([]) == {}
@@ -0,0 +1,48 @@
+"""Console log file rotation"""
+
+import os
+import time
+
+from log_pipeline import LogPipeline
+
+
+def write(path, mtime=None):
+    path.write_text('x\n')
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_prune_leaves_other_workers_files(tmp_path):
+    pid = os.getpid()
+    own = [write(tmp_path / f"console_logs_20260101_00000{n}_000000_{pid}.log") for n in range(4)]
+    # Another worker's open file sorts oldest but must survive
+    other = write(tmp_path / 'console_logs_20250101_000000_000000_999999.log')
+    pipeline = LogPipeline(directory=str(tmp_path), backup_count=2)
+
+    pipeline._prune()
+
+    assert other.exists()
+    assert [path.exists() for path in own] == [False, False, True, True]
+
+
+def test_prune_removes_files_left_by_exited_workers(tmp_path):
+    stale = write(tmp_path / 'console_logs_20250101_000000_000000_999999.log', time.time() - 3 * 86400)
+    recent = write(tmp_path / 'console_logs_20260101_000000_000000_999999.log')
+    pipeline = LogPipeline(directory=str(tmp_path), backup_count=1, rotate_interval=86400)
+    own = write(tmp_path / f"console_logs_20260102_000000_000000_{os.getpid()}.log")
+
+    pipeline._prune()
+
+    assert not stale.exists()
+    assert recent.exists()
+    assert own.exists()
+
+
+def test_files_are_named_after_the_writing_process(tmp_path):
+    pipeline = LogPipeline(directory=str(tmp_path), flush_interval=0.05)
+    pipeline.submit_rows('s1', [(None, 'info', 'hello', None)])
+    pipeline.close()
+    [path] = tmp_path.glob('console_logs_*.log')
+    assert path.name.endswith(f"_{os.getpid()}.log")
+    assert '[s1] INFO: hello' in path.read_text()
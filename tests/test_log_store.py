@@ -0,0 +1,54 @@
+"""Console log segment retention with several worker processes sharing a directory"""
+
+import os
+import time
+
+import log_store
+from log_store import LogSegmentStore
+
+
+def records(count, session_id='s1'):
+    now = time.time()
+    return [{'ts': now, 'sessionId': session_id, 'level': 'info', 'message': f"entry {n} " + 'x' * 200}
+            for n in range(count)]
+
+
+def append_as(monkeypatch, store, pid, batch, now=None):
+    """Append as if the store lived in another worker process (and optionally at another time)"""
+    with monkeypatch.context() as patch:
+        patch.setattr(log_store.os, 'getpid', lambda: pid)
+        if now is not None:
+            patch.setattr(log_store.time, 'time', lambda: now)
+        store.append(batch)
+
+
+def test_retention_keeps_another_workers_open_segment(tmp_path, monkeypatch):
+    other = LogSegmentStore(str(tmp_path))
+    append_as(monkeypatch, other, 4242, records(50, 'other'))
+    store = LogSegmentStore(str(tmp_path), max_total_bytes=1)
+    store.append(records(50))
+    store.query().close()
+
+    store.enforce_retention()
+
+    # Over the byte budget, but the other worker may still append to its segment
+    names = sorted(os.path.basename(path) for path in tmp_path.glob('segment_*.jsonl.gz'))
+    assert len(names) == 2
+    assert names[0].endswith('_4242.jsonl.gz')
+    append_as(monkeypatch, other, 4242, records(1, 'other'))
+    assert len(list(store.query(session_id='other'))) == 51
+
+
+def test_retention_removes_sealed_segments_of_other_workers(tmp_path, monkeypatch):
+    other = LogSegmentStore(str(tmp_path), segment_seconds=60)
+    append_as(monkeypatch, other, 4242, records(50, 'other'), now=time.time() - 3600)
+    store = LogSegmentStore(str(tmp_path), segment_seconds=60, max_total_bytes=1)
+    store.append(records(50))
+    store.query().close()
+
+    store.enforce_retention()
+
+    names = [os.path.basename(path) for path in tmp_path.glob('segment_*.jsonl.gz')]
+    assert len(names) == 1
+    assert names[0].endswith(f"_{os.getpid()}.jsonl.gz")
+    assert store.stats()['segments'] == 1
@@ -0,0 +1,40 @@
+"""Thread budget for long-polls and event streams"""
+
+import threading
+import time
+
+import pytest
+
+import app
+from command_queue import CommandQueue
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'command_queue', CommandQueue())
+    monkeypatch.setattr(app, 'long_lived_slots', threading.BoundedSemaphore(1))
+    test_client = app.app.test_client()
+    test_client.post('/api/register-client', json={'session_id': 's1', 'client_type': 'test'})
+    return test_client
+
+
+def test_long_poll_past_budget_returns_at_once(client):
+    app.long_lived_slots.acquire()
+    started = time.monotonic()
+    data = client.get('/api/get-commands/s1?wait=5').get_json()
+    assert time.monotonic() - started < 1
+    assert data['commands'] == []
+    assert data['retry_after'] == app.BUSY_RETRY_AFTER
+
+
+def test_long_poll_releases_its_slot(client):
+    data = client.get('/api/get-commands/s1?wait=0.1').get_json()
+    assert 'retry_after' not in data
+    assert app.long_lived_slots.acquire(blocking=False)
+
+
+def test_event_stream_past_budget_sends_snapshot_and_ends(client):
+    app.long_lived_slots.acquire()
+    body = client.get('/api/events').get_data(as_text=True)
+    assert body.startswith('retry: 10000')
+    assert 'event: clients' in body
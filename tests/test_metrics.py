@@ -0,0 +1,25 @@
+"""Prometheus text rendering and the per-worker label"""
+
+import os
+
+from metrics import Registry
+
+
+def test_every_sample_carries_the_worker_label():
+    registry = Registry(worker_label='worker')
+    registry.counter('jobs_total', 'Jobs', ('kind',)).inc(kind='a')
+    registry.gauge('depth', 'Depth', callback=lambda: 3)
+    registry.histogram('latency_seconds', 'Latency', buckets=(0.1,)).observe(0.05)
+
+    worker = f'worker="{os.getpid()}"'
+    samples = [line for line in registry.render().splitlines() if not line.startswith('#')]
+    assert f'jobs_total{{kind="a",{worker}}} 1' in samples
+    assert f'depth{{{worker}}} 3' in samples
+    assert f'latency_seconds_bucket{{{worker},le="0.1"}} 1' in samples
+    assert all(worker in line for line in samples)
+
+
+def test_no_worker_label_by_default():
+    registry = Registry()
+    registry.counter('jobs_total', 'Jobs').inc()
+    assert 'jobs_total 1' in registry.render().splitlines()
@@ -0,0 +1,99 @@
+"""Tile-based screen change detection"""
+
+import numpy as np
+import pytest
+
+import screen_change
+from screen_change import ChangeDetector
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(screen_change.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def blank(width=512, height=256, value=100):
+    return np.full((height, width), value, dtype=np.uint8)
+
+
+def test_first_frame_is_a_full_change(clock):
+    detector = ChangeDetector()
+    change = detector.update(blank())
+    assert change.changed and change.regions is None
+    assert change.total_tiles == 8
+
+
+def test_unchanged_frame_is_skipped(clock):
+    detector = ChangeDetector()
+    detector.update(blank())
+    change = detector.update(blank())
+    assert not change.changed
+    assert change.regions == [] and change.dirty_tiles == 0
+    assert detector.stats()['cycles_skipped'] == 1
+
+
+def test_only_the_changed_tile_is_dirty(clock):
+    detector = ChangeDetector()
+    detector.update(blank())
+    frame = blank()
+    frame[150:170, 300:320] = 200
+    change = detector.update(frame)
+    assert change.changed
+    assert change.dirty_tiles == 1
+    assert change.regions == [(256, 128, 128, 128)]
+
+
+def test_touching_dirty_tiles_merge_into_one_region(clock):
+    detector = ChangeDetector()
+    detector.update(blank())
+    frame = blank()
+    frame[10:30, 120:136] = 200
+    change = detector.update(frame)
+    assert change.dirty_tiles == 2
+    assert change.regions == [(0, 0, 256, 128)]
+
+
+def test_changes_are_compared_after_the_4x_downsample(clock):
+    detector = ChangeDetector(threshold=12)
+    detector.update(blank())
+    # One pixel 100 levels brighter averages to about 6 over a 4x4 block: below the threshold
+    frame = blank()
+    frame[40, 40] = 200
+    assert not detector.update(frame).changed
+    # A whole 4x4 block 20 levels brighter stays 20 after averaging
+    frame = blank()
+    frame[40:44, 40:44] = 120
+    assert detector.update(frame).changed
+
+
+def test_mostly_dirty_frame_becomes_a_full_change(clock):
+    detector = ChangeDetector(full_ratio=0.5)
+    detector.update(blank())
+    frame = blank()
+    frame[:, :256] = 200
+    change = detector.update(frame)
+    assert change.changed and change.regions is None
+    assert change.dirty_tiles == 4
+
+
+def test_full_match_is_forced_every_30_seconds(clock):
+    detector = ChangeDetector(force_interval=30.0)
+    detector.update(blank())
+    clock[0] += 29.0
+    assert not detector.update(blank()).changed
+    clock[0] += 1.0
+    change = detector.update(blank())
+    assert change.changed and change.regions is None
+    clock[0] += 1.0
+    assert not detector.update(blank()).changed
+    assert detector.stats()['cycles_full'] == 2
+
+
+def test_resolution_change_and_reset_force_a_full_change(clock):
+    detector = ChangeDetector()
+    detector.update(blank())
+    assert detector.update(blank(width=640)).regions is None
+    detector.reset()
+    assert detector.update(blank(width=640)).regions is None